@@ -0,0 +1,344 @@
+"""
+asyncio transport for GSM modems (Linux only).
+
+The port is opened as a non-blocking file descriptor and watched with
+loop.add_reader, so any number of modems can share one event loop without a
+thread per port:
+
+    async def main():
+        modems = [await AsyncModem.open(port) for port in ("/dev/ttyUSB0", "/dev/ttyUSB1")]
+        await asyncio.gather(*(modem.run(store) for modem in modems))
+"""
+import asyncio
+import inspect
+import os
+import termios
+
+from at_stream_parser import ATStreamParser, CommandResponse, UnsolicitedResult
+from serial_comm_handler5t import COMMAND_TIMEOUTS, DEFAULT_COMMAND_TIMEOUT, UNPARSED_SMS_LOG, SerialCommunication
+from sms_pdu import PDU_STATUS, SMSReassembler
+
+
+class ModemDisconnected(Exception):
+    """Raised when the modem's file descriptor fails or the modem is closed."""
+
+
+def configure_port(fd, baudrate):
+    """
+    Put a serial port into raw 8N1 mode at the given baud rate.
+
+    Args:
+        fd (int): Open file descriptor of the port.
+        baudrate (int): Baud rate, for example 115200.
+    """
+    iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(fd)
+    speed = getattr(termios, f"B{baudrate}")
+    iflag &= ~(termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP | termios.INLCR
+               | termios.IGNCR | termios.ICRNL | termios.IXON | termios.IXOFF | termios.IXANY)
+    oflag &= ~termios.OPOST
+    lflag &= ~(termios.ECHO | termios.ECHONL | termios.ICANON | termios.ISIG | termios.IEXTEN)
+    cflag &= ~(termios.CSIZE | termios.PARENB | termios.CSTOPB | getattr(termios, "CRTSCTS", 0))
+    cflag |= termios.CS8 | termios.CREAD | termios.CLOCAL
+    cc[termios.VMIN] = 0
+    cc[termios.VTIME] = 0
+    termios.tcsetattr(fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+    termios.tcflush(fd, termios.TCIOFLUSH)
+
+
+class AsyncModem:
+    """
+    asyncio counterpart of SerialCommunication.
+
+    Reads are driven by the event loop: every chunk is fed to an
+    ATStreamParser, command responses complete the pending command and URCs
+    are queued for urcs(). Commands are serialised with a lock, so several
+    tasks may use the same modem.
+    """
+
+    # The message formats are shared with the threaded transport
+    increment_timestamps = SerialCommunication.increment_timestamps
+    parse_message = SerialCommunication.parse_message
+    decode_message = SerialCommunication.decode_message
+    list_command = SerialCommunication.list_command
+    assemble_messages = SerialCommunication.assemble_messages
+    log_unparsed = SerialCommunication.log_unparsed
+
+    def __init__(self, fd, port=None, pdu_mode=False):
+        """
+        Use AsyncModem.open() instead of calling this directly.
+
+        Args:
+            fd (int): Non-blocking file descriptor of the configured port.
+            port (str): Port name, for messages.
+            pdu_mode (bool): Read messages as PDUs; see SerialCommunication.
+        """
+        self.fd = fd
+        self.port = port
+        self.pdu_mode = pdu_mode
+        self.reassembler = SMSReassembler()
+        self.unparsed_log = UNPARSED_SMS_LOG
+        self.loop = asyncio.get_running_loop()
+        self.parser = ATStreamParser()
+        self.unsolicited = asyncio.Queue()
+        self.command_lock = asyncio.Lock()
+        self.pending = None
+        self.error = None
+        self.loop.add_reader(fd, self._on_readable)
+
+    @classmethod
+    async def open(cls, port, baudrate=115200, pdu_mode=False):
+        """
+        Open and configure a modem port.
+
+        Args:
+            port (str): Device path, for example "/dev/ttyUSB0".
+            baudrate (int): Baud rate.
+            pdu_mode (bool): Read messages as PDUs, to reassemble concatenated messages.
+
+        Returns:
+            AsyncModem: The connected modem.
+        """
+        fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            configure_port(fd, baudrate)
+        except Exception:
+            os.close(fd)
+            raise
+        return cls(fd, port, pdu_mode)
+
+    def close(self):
+        """
+        Stop reading and close the port. Pending commands and urcs() readers
+        get ModemDisconnected.
+        """
+        if self.fd is None:
+            return
+        self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+        self.fd = None
+        self._fail(ModemDisconnected(f"{self.port} closed"))
+
+    async def configure_for_sms(self):
+        if self.pdu_mode:
+            await self.send_command('AT+CMGF=0')
+        return await self.send_command('AT+CNMI=2,1,0,0,0')
+
+    async def send_command(self, command, timeout=None):
+        """
+        Send an AT command and wait for its final result code.
+
+        Args:
+            command (str): AT command without the trailing carriage return.
+            timeout (float): Seconds to wait for the final result code. Defaults
+                to the COMMAND_TIMEOUTS entry for the command.
+
+        Returns:
+            CommandResponse: The parsed response, or None if the command timed out.
+
+        Raises:
+            ModemDisconnected: If the port failed or was closed.
+        """
+        if timeout is None:
+            timeout = next(
+                (seconds for prefix, seconds in COMMAND_TIMEOUTS.items() if command.startswith(prefix)),
+                DEFAULT_COMMAND_TIMEOUT
+            )
+        async with self.command_lock:
+            if self.error:
+                raise self.error
+            self.pending = self.loop.create_future()
+            try:
+                await self._write((command + '\r').encode())
+                return await asyncio.wait_for(self.pending, timeout)
+            except asyncio.TimeoutError:
+                print(f"Timed out waiting for a final result code for {command} after {timeout}s")
+                self.parser.abort()
+                return None
+            finally:
+                self.pending = None
+
+    async def read_sms(self, index):
+        """
+        Read one message with AT+CMGR.
+
+        Returns:
+            tuple: (phone_number, locations), or (None, []) if the message is not
+            an unread message with coordinates.
+        """
+        response = await self.send_command(f'AT+CMGR={index}')
+        messages = response.messages if response else []
+        if messages and messages[0].status in ("REC UNREAD", str(PDU_STATUS["REC UNREAD"])):
+            # CMGR does not repeat the index, so pass it along
+            for _, phone_number, message_body in self.assemble_messages([messages[0]._replace(index=int(index))]):
+                locations = self.decode_message(message_body)
+                if locations:
+                    return phone_number, locations
+        return None, []
+
+    async def list_sms(self, status="REC UNREAD"):
+        """
+        List the messages on the SIM with a single AT+CMGL command.
+
+        Args:
+            status (str): "REC UNREAD" for new messages only, or "ALL".
+
+        Returns:
+            list: (indices, phone_number, message_body) tuples in SIM order; see
+            SerialCommunication.assemble_messages.
+        """
+        response = await self.send_command(self.list_command(status))
+        if response is None:
+            return []
+        return self.assemble_messages(response.messages)
+
+    async def delete_sms(self, index):
+        """
+        Delete one message from the SIM.
+
+        Returns:
+            bool: True if the modem confirmed the deletion.
+        """
+        response = await self.send_command(f'AT+CMGD={index}')
+        return response is not None and response.result == 'OK'
+
+    async def drain_sms(self, store, status="REC UNREAD", commit=None):
+        """
+        Read every waiting message with one AT+CMGL, hand the coordinates to
+        store and delete the messages that were stored, or logged for lack of
+        coordinates. See SerialCommunication.drain_sms.
+
+        Args:
+            store (callable): Called with (phone_number, locations) for each
+                message. May be a coroutine function.
+            status (str): "REC UNREAD" for new messages only, or "ALL".
+            commit (callable): Optional, called once before any message is
+                deleted, for example IngestJournal.sync. May be a coroutine function.
+
+        Returns:
+            int: Number of messages stored.
+        """
+        stored = 0
+        deletable = []
+        for indices, phone_number, message_body in await self.list_sms(status):
+            locations = self.decode_message(message_body)
+            if not locations:
+                print(f"SMS {indices} from {phone_number} has no coordinates, moving it to {self.unparsed_log}")
+                if self.log_unparsed(phone_number, message_body):
+                    deletable.extend(indices)
+                continue
+            try:
+                result = store(phone_number, locations)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"Error storing SMS {indices}: {e}")
+                continue
+            stored += 1
+            deletable.extend(indices)
+        if stored and commit:
+            try:
+                result = commit()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"Error committing SMS, keeping them on the SIM: {e}")
+                return stored
+        deletable.extend(self.reassembler.expire())
+
+        for index in deletable:
+            if await self.delete_sms(index):
+                self.reassembler.deleted(index)
+            else:
+                print(f"Failed to delete SMS {index}.")
+        return stored
+
+    async def urcs(self):
+        """
+        Yield unsolicited result codes (+CMTI, RING, ...) as they arrive.
+
+        Raises:
+            ModemDisconnected: When the port fails or is closed.
+        """
+        while True:
+            line = await self.unsolicited.get()
+            if isinstance(line, Exception):
+                raise line
+            yield line
+
+    async def run(self, store):
+        """
+        Receive messages until the modem is closed or fails: drain the SIM
+        once, then drain again on +CMTI. One drain covers every +CMTI queued
+        when it starts.
+
+        Args:
+            store (callable): As for drain_sms.
+        """
+        await self.configure_for_sms()
+        # Pick up anything that arrived while disconnected, read or not
+        await self.drain_sms(store, "ALL")
+        async for line in self.urcs():
+            if line.startswith("+CMTI:"):
+                self._discard_queued("+CMTI:")
+                await self.drain_sms(store, "REC UNREAD")
+
+    def _discard_queued(self, prefix):
+        # Drop the queued URCs starting with prefix, keeping the others in order
+        kept = []
+        while not self.unsolicited.empty():
+            line = self.unsolicited.get_nowait()
+            if isinstance(line, Exception) or not line.startswith(prefix):
+                kept.append(line)
+        for line in kept:
+            self.unsolicited.put_nowait(line)
+
+    async def _write(self, data):
+        while data:
+            try:
+                written = os.write(self.fd, data)
+            except BlockingIOError:
+                written = 0
+            except OSError as e:
+                self._fail(ModemDisconnected(f"{self.port}: {e}"))
+                raise self.error
+            data = data[written:]
+            if data:
+                # The output buffer is full; wait until the port can take more
+                writable = self.loop.create_future()
+                self.loop.add_writer(self.fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    self.loop.remove_writer(self.fd)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            data = b''
+            error = e
+        else:
+            error = None
+        if not data:
+            # Readable with nothing to read: the device went away
+            self.loop.remove_reader(self.fd)
+            self._fail(ModemDisconnected(f"{self.port}: {error or 'device disconnected'}"))
+            return
+
+        for event in self.parser.feed(data):
+            if isinstance(event, UnsolicitedResult):
+                self.unsolicited.put_nowait(event.line)
+            elif isinstance(event, CommandResponse):
+                if self.pending is not None and not self.pending.done():
+                    self.pending.set_result(event)
+                else:
+                    print(f"Discarding late response: {event.lines}")
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+        if self.pending is not None and not self.pending.done():
+            self.pending.set_exception(self.error)
+        self.unsolicited.put_nowait(self.error)
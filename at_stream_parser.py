@@ -0,0 +1,126 @@
+import re
+from collections import namedtuple
+
+
+# Lines that end a command response
+FINAL_RESULT_CODES = re.compile(r'^(OK|ERROR|NO CARRIER|\+CMS ERROR: ?\d+|\+CME ERROR: ?.+)$')
+
+# Unsolicited result codes that can arrive at any time, including in the middle of a command response
+URC_PREFIXES = ("+CMTI:", "+CDSI:", "RING")
+
+# Headers followed by message text: +CMGR: "stat","oa",... and +CMGL: index,"stat","oa",...
+# in text mode, +CMGR: stat,[alpha],length and +CMGL: index,stat,[alpha],length in PDU mode
+SMS_HEADER = re.compile(r'^\+(CMGR|CMGL): (?:(\d+),)?(?:"([^"]*)","([^"]*)"|(\d+),)')
+
+# An unsolicited result code such as +CMTI, outside any command response
+UnsolicitedResult = namedtuple("UnsolicitedResult", ["line"])
+
+# One message from a +CMGR or +CMGL response. index is None for +CMGR, which does
+# not repeat the index that was asked for; body keeps the breaks of multi-line messages.
+# In PDU mode status is the numeric status, phone_number is None and body is the hex PDU.
+SMSMessage = namedtuple("SMSMessage", ["index", "status", "phone_number", "body", "header"])
+
+# A complete command response: every line up to and including the final result
+# code, the final result code itself, and the SMSMessage events it contained
+CommandResponse = namedtuple("CommandResponse", ["lines", "result", "messages"])
+
+
+class ATStreamParser:
+    """
+    Incremental parser for the byte stream coming from an AT modem.
+
+    Bytes are fed in as they arrive, in chunks of any size. Complete lines are
+    turned into UnsolicitedResult, SMSMessage and CommandResponse events, and
+    bytes after the last line terminator are kept for the next feed, so a
+    notification split across reads is still seen, and several notifications
+    in one read each produce an event.
+    """
+
+    def __init__(self):
+        self.buffer = b''
+        self.lines = []
+        self.messages = []
+        # (header match, header line, body lines) of the SMS being read, or None
+        self.sms = None
+
+    def feed(self, data):
+        """
+        Parse the next chunk of the stream.
+
+        Args:
+            data (bytes): Bytes read from the port.
+
+        Returns:
+            list: The events completed by this chunk, in stream order.
+        """
+        self.buffer += data
+        events = []
+        start = 0
+        while True:
+            end = self.buffer.find(b'\n', start)
+            if end < 0:
+                break
+            line = self.buffer[start:end].rstrip(b'\r').decode(errors='replace')
+            start = end + 1
+            self._parse_line(line, events)
+        self.buffer = self.buffer[start:]
+        return events
+
+    def abort(self):
+        """
+        Forget a partly received response, for example after a command timed out,
+        so its lines do not end up in the next command's response.
+        """
+        self.lines = []
+        self.messages = []
+        self.sms = None
+
+    def _parse_line(self, line, events):
+        stripped = line.strip()
+
+        if self.sms is not None and not self.sms[2]:
+            # The first line after a +CMGR/+CMGL header is message text, even if it reads "OK"
+            self.sms[2].append(line)
+            self.lines.append(line)
+            return
+
+        if stripped.startswith(URC_PREFIXES):
+            events.append(UnsolicitedResult(stripped))
+            return
+
+        if FINAL_RESULT_CODES.match(stripped):
+            self._end_sms(events)
+            self.lines.append(line)
+            events.append(CommandResponse(self.lines, stripped, self.messages))
+            self.lines = []
+            self.messages = []
+            return
+
+        header = SMS_HEADER.match(stripped)
+        if header:
+            self._end_sms(events)
+            self.sms = (header, stripped, [])
+            self.lines.append(line)
+        elif self.sms is not None:
+            # Further lines of a multi-line message
+            self.sms[2].append(line)
+            self.lines.append(line)
+        elif stripped or self.lines:
+            # Leading blank lines are only the modem's line terminators
+            self.lines.append(line)
+
+    def _end_sms(self, events):
+        if self.sms is None:
+            return
+        header, header_line, body = self.sms
+        self.sms = None
+        index = header.group(2)
+        message = SMSMessage(
+            int(index) if index is not None else None,
+            header.group(3) if header.group(3) is not None else header.group(5),
+            header.group(4),
+            '\n'.join(body).strip(),
+            header_line,
+        )
+        self.messages.append(message)
+        events.append(message)
@@ -0,0 +1,313 @@
+"""
+Benchmark suite for gps_database4.GPSDatabase.
+
+Generates a deterministic synthetic fleet, loads it into a temporary database
+and times ingest, route queries, date listings, CSV export and distance
+computation. Runs headless; results are written as JSON so runs can be compared.
+
+    python gps_benchmark.py --vessels 10 --days 7 --fixes-per-day 500 --output bench.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date as date_cls, timedelta
+
+from gps_csv_export import export_csv
+from gps_database4 import GPSDatabase, distance_km, format_time
+from gps_ingest_writer import IngestWriter
+
+
+# Visakhapatnam harbour, where the synthetic fleet starts
+BASE_LAT = 17.6868
+BASE_LON = 83.2185
+
+
+def generate_fleet(vessels, days, fixes_per_day, seed=0, start_date="2025-01-01"):
+    """
+    Generate a deterministic synthetic fleet track.
+
+    Each vessel does a random walk from the harbour with a slowly changing
+    heading, one fix per minute starting at a random time in the morning.
+
+    Args:
+        vessels (int): Number of vessels (phone numbers).
+        days (int): Number of days per vessel.
+        fixes_per_day (int): Fixes per vessel per day.
+        seed (int): Random seed; the same arguments always give the same fleet.
+        start_date (str): First date (YYYY-MM-DD).
+
+    Returns:
+        list: One (date, [(phone_number, time_value, lat, lon), ...]) tuple per day,
+        with the fixes of all vessels interleaved as they would arrive.
+    """
+    rng = random.Random(seed)
+    first_day = date_cls.fromisoformat(start_date)
+    phone_numbers = [f"+9190000{index:05d}" for index in range(vessels)]
+    positions = {
+        phone_number: [BASE_LAT + rng.uniform(-0.05, 0.05), BASE_LON + rng.uniform(-0.05, 0.05), rng.uniform(0, 360)]
+        for phone_number in phone_numbers
+    }
+
+    fleet = []
+    for day in range(days):
+        start_times = {phone_number: rng.randrange(5 * 3600, 9 * 3600) for phone_number in phone_numbers}
+        fixes = []
+        for step in range(fixes_per_day):
+            for phone_number in phone_numbers:
+                position = positions[phone_number]
+                position[2] = (position[2] + rng.gauss(0, 15)) % 360
+                speed_deg = rng.uniform(0.0, 0.005)  # up to ~550 m per minute
+                position[0] += speed_deg * math.cos(math.radians(position[2]))
+                position[1] += speed_deg * math.sin(math.radians(position[2]))
+                time_value = format_time(start_times[phone_number] + step * 60)
+                fixes.append((phone_number, time_value, round(position[0], 6), round(position[1], 6)))
+        fleet.append(((first_day + timedelta(days=day)).isoformat(), fixes))
+    return fleet
+
+
+def summarize(samples):
+    """
+    Summarize latency samples.
+
+    Args:
+        samples (list): Durations in seconds.
+
+    Returns:
+        dict: Count, mean, median, p95 and max, in milliseconds.
+    """
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def timed(function, *args, **kwargs):
+    """
+    Call a function and time it.
+
+    Returns:
+        tuple: (result, elapsed seconds).
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_ingest_single(db_path, fleet):
+    db = GPSDatabase(db_path)
+    fix_count = 0
+    start = time.perf_counter()
+    for date, fixes in fleet:
+        for phone_number, time_value, lat, lon in fixes:
+            db.insert_coordinates(phone_number, time_value, lat, lon, date)
+        fix_count += len(fixes)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return {"fixes": fix_count, "seconds": elapsed, "fixes_per_second": fix_count / elapsed if elapsed else None}
+
+
+def bench_ingest_batched(db_path, fleet, max_batch=500):
+    db = GPSDatabase(db_path)
+    fix_count = 0
+    start = time.perf_counter()
+    for date, fixes in fleet:
+        for offset in range(0, len(fixes), max_batch):
+            db.insert_coordinates_batch(fixes[offset:offset + max_batch], date)
+        fix_count += len(fixes)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return {"fixes": fix_count, "seconds": elapsed, "fixes_per_second": fix_count / elapsed if elapsed else None}
+
+
+def bench_ingest_writer_thread(db_path, fleet, max_batch=500):
+    # The writer files fixes under the current date, so one synthetic day is
+    # pushed through it as live traffic
+    db = GPSDatabase(db_path)
+    fixes = fleet[0][1] if fleet else []
+    writer = IngestWriter(db, max_batch=max_batch).start()
+    start = time.perf_counter()
+    writer.submit_many(fixes)
+    writer.flush()
+    elapsed = time.perf_counter() - start
+    writer.close()
+    db.close()
+    return {
+        "fixes": len(fixes),
+        "seconds": elapsed,
+        "fixes_per_second": len(fixes) / elapsed if elapsed else None,
+        "batches": writer.committed_batches,
+    }
+
+
+def bench_queries(db, samples, rng):
+    phone_ids = [phone_number_id for phone_number_id, _ in db.get_all_phone_numbers_with_ids()]
+    dates_per_vessel = {}
+    date_latencies = []
+    for phone_number_id in phone_ids:
+        dates, elapsed = timed(db.get_all_dates_for_number, phone_number_id)
+        dates_per_vessel[phone_number_id] = dates
+        date_latencies.append(elapsed)
+
+    route_latencies = []
+    distance_latencies = []
+    track_latencies = []
+    bbox_latencies = []
+    points = 0
+    for _ in range(samples):
+        phone_number_id = rng.choice(phone_ids)
+        date = rng.choice(dates_per_vessel[phone_number_id])
+        coordinates, elapsed = timed(db.get_coordinates_for_id_and_date, phone_number_id, date)
+        route_latencies.append(elapsed)
+        points += len(coordinates)
+
+        _, elapsed = timed(
+            lambda: sum(
+                distance_km(coordinates[i][0], coordinates[i][1], coordinates[i + 1][0], coordinates[i + 1][1])
+                for i in range(len(coordinates) - 1)
+            )
+        )
+        distance_latencies.append(elapsed)
+
+        _, elapsed = timed(db.get_track, phone_number_id, f"{date} 06:00:00", f"{date} 09:00:00")
+        track_latencies.append(elapsed)
+
+        lat, lon = coordinates[len(coordinates) // 2][:2]
+        _, elapsed = timed(db.query_bbox, lat - 0.01, lon - 0.01, lat + 0.01, lon + 0.01,
+                           f"{date} 06:00:00", f"{date} 09:00:00")
+        bbox_latencies.append(elapsed)
+
+    return {
+        "get_all_dates_for_number": summarize(date_latencies),
+        "get_coordinates_for_id_and_date": dict(summarize(route_latencies), mean_points=points / samples if samples else 0),
+        "distance_haversine": summarize(distance_latencies),
+        "get_track_3h": summarize(track_latencies),
+        "query_bbox_3h": summarize(bbox_latencies),
+    }
+
+
+def bench_geodesic(db, samples, rng):
+    try:
+        import geopy.distance
+    except ImportError:
+        return {"skipped": "geopy is not installed"}
+
+    phone_ids = [phone_number_id for phone_number_id, _ in db.get_all_phone_numbers_with_ids()]
+    latencies = []
+    for _ in range(samples):
+        phone_number_id = rng.choice(phone_ids)
+        date = rng.choice(db.get_all_dates_for_number(phone_number_id))
+        coordinates = db.get_coordinates_for_id_and_date(phone_number_id, date)
+        _, elapsed = timed(
+            lambda: sum(
+                geopy.distance.distance(coordinates[i][:2], coordinates[i + 1][:2]).km
+                for i in range(len(coordinates) - 1)
+            )
+        )
+        latencies.append(elapsed)
+    return summarize(latencies)
+
+
+def bench_export(db, directory):
+    results = {}
+    for name, compress in (("csv", False), ("csv_gzip", True)):
+        path = os.path.join(directory, "export.csv" + (".gz" if compress else ""))
+        rows, elapsed = timed(export_csv, db, path, compress=compress)
+        results[name] = {
+            "rows": rows,
+            "seconds": elapsed,
+            "rows_per_second": rows / elapsed if elapsed else None,
+            "bytes": os.path.getsize(path),
+        }
+    return results
+
+
+def run(vessels=10, days=7, fixes_per_day=500, seed=0, query_samples=50, directory=None):
+    """
+    Run the whole suite against temporary databases.
+
+    Args:
+        vessels (int): Number of synthetic vessels.
+        days (int): Days per vessel.
+        fixes_per_day (int): Fixes per vessel per day. Above 1440 the stored
+            one-minute timestamps wrap around midnight.
+        seed (int): Random seed for the fleet and the query samples.
+        query_samples (int): Number of random (vessel, day) pairs to query.
+        directory (str): Where to put the databases. Defaults to a temporary directory.
+
+    Returns:
+        dict: Machine-readable results.
+    """
+    fleet, generate_seconds = timed(generate_fleet, vessels, days, fixes_per_day, seed)
+    results = {
+        "config": {
+            "vessels": vessels,
+            "days": days,
+            "fixes_per_day": fixes_per_day,
+            "seed": seed,
+            "query_samples": query_samples,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "generate_seconds": generate_seconds,
+    }
+
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        results["ingest_insert_coordinates"] = bench_ingest_single(os.path.join(workdir, "single.db"), fleet)
+        results["ingest_batched"] = bench_ingest_batched(os.path.join(workdir, "batched.db"), fleet)
+        results["ingest_writer_thread"] = bench_ingest_writer_thread(os.path.join(workdir, "writer.db"), fleet)
+
+        db = GPSDatabase(os.path.join(workdir, "single.db"))
+        rng = random.Random(seed)
+        results["queries"] = bench_queries(db, query_samples, rng)
+        results["distance_geodesic"] = bench_geodesic(db, min(query_samples, 10), rng)
+        results["export"] = bench_export(db, workdir)
+        results["query_plans"] = {name: ok for name, (ok, _) in db.check_query_plans().items()}
+        db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GPSDatabase on a synthetic fleet.")
+    parser.add_argument("--vessels", type=int, default=10)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--fixes-per-day", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--query-samples", type=int, default=50)
+    parser.add_argument("--tmpdir", default=None, help="Directory for the temporary databases")
+    parser.add_argument("--output", default="gps_benchmark_results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    results = run(args.vessels, args.days, args.fixes_per_day, args.seed, args.query_samples, args.tmpdir)
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    print(f"Ingest (insert_coordinates): {results['ingest_insert_coordinates']['fixes_per_second']:.0f} fixes/s")
+    print(f"Ingest (batched):            {results['ingest_batched']['fixes_per_second']:.0f} fixes/s")
+    print(f"Ingest (IngestWriter):       {results['ingest_writer_thread']['fixes_per_second']:.0f} fixes/s")
+    for name, summary in results["queries"].items():
+        if summary.get("count"):
+            print(f"{name:32s} median {summary['median_ms']:.2f} ms, p95 {summary['p95_ms']:.2f} ms")
+    for name, summary in results["export"].items():
+        print(f"Export {name:25s} {summary['rows_per_second']:.0f} rows/s, {summary['bytes']} bytes")
+    print(f"Query plans OK: {all(results['query_plans'].values())}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import csv
+import gzip
+import os
+import threading
+
+
+CSV_HEADER = ["Phone Number", "Latitude", "Longitude", "Timestamp", "Date"]
+
+
+class ExportCancelled(Exception):
+    """Raised inside export_csv when the cancel event is set."""
+
+
+def export_csv(db, path, phone_number_ids=None, start_date=None, end_date=None,
+               compress=None, chunk_size=5000, progress=None, cancel_event=None):
+    """
+    Stream the stored coordinates into a CSV file using constant memory.
+
+    Rows are read in chunks from a dedicated read connection and written to
+    "<path>.part", which is renamed to path only once the export completes.
+
+    Args:
+        db (GPSDatabase): Database to export from.
+        path (str): Destination file.
+        phone_number_ids (list): Only export these phone number IDs. Defaults to all.
+        start_date (str): First date to export (YYYY-MM-DD), inclusive.
+        end_date (str): Last date to export (YYYY-MM-DD), inclusive.
+        compress (bool): Write gzip-compressed CSV. Defaults to True if path ends with ".gz".
+        chunk_size (int): Rows fetched from the database per chunk.
+        progress (callable): Called with (rows_written, total_rows) after each chunk.
+        cancel_event (threading.Event): Stops the export when set.
+
+    Returns:
+        int: Number of data rows written.
+
+    Raises:
+        ExportCancelled: If cancel_event was set before the export finished.
+    """
+    if compress is None:
+        compress = path.endswith(".gz")
+    total_rows = db.count_export_rows(phone_number_ids, start_date, end_date)
+    part_path = path + ".part"
+    rows_written = 0
+
+    try:
+        if compress:
+            csv_file = gzip.open(part_path, mode="wt", newline="")
+        else:
+            csv_file = open(part_path, mode="w", newline="")
+        with csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(CSV_HEADER)
+            if progress:
+                progress(rows_written, total_rows)
+            for chunk in db.iter_export_chunks(phone_number_ids, start_date, end_date, chunk_size):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ExportCancelled()
+                writer.writerows(chunk)
+                rows_written += len(chunk)
+                if progress:
+                    progress(rows_written, total_rows)
+        os.replace(part_path, path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return rows_written
+
+
+class CSVExportJob:
+    """
+    Runs export_csv on a background thread so the GUI stays responsive.
+
+    The GUI polls rows_written, total_rows and done (for example from a
+    Tk after() or Qt timer callback) rather than being called back from the
+    worker thread.
+    """
+
+    def __init__(self, db, path, phone_number_ids=None, start_date=None, end_date=None,
+                 compress=None, chunk_size=5000):
+        """
+        Args:
+            db (GPSDatabase): Database to export from.
+            path (str): Destination file.
+            phone_number_ids (list): Only export these phone number IDs. Defaults to all.
+            start_date (str): First date to export (YYYY-MM-DD), inclusive.
+            end_date (str): Last date to export (YYYY-MM-DD), inclusive.
+            compress (bool): Write gzip-compressed CSV. Defaults to True if path ends with ".gz".
+            chunk_size (int): Rows fetched from the database per chunk.
+        """
+        self.db = db
+        self.path = path
+        self.phone_number_ids = phone_number_ids
+        self.start_date = start_date
+        self.end_date = end_date
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.cancel_event = threading.Event()
+        self.thread = None
+        self.rows_written = 0
+        self.total_rows = 0
+        self.done = False
+        self.cancelled = False
+        self.error = None
+
+    def start(self):
+        """
+        Start the export thread.
+
+        Returns:
+            CSVExportJob: The job itself.
+        """
+        self.thread = threading.Thread(target=self._run, name="gps-csv-export", daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        """
+        Ask the export to stop after the current chunk. The partial file is removed.
+        """
+        self.cancel_event.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the export thread to finish.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if the job has finished.
+        """
+        if self.thread:
+            self.thread.join(timeout)
+        return self.done
+
+    def percent(self):
+        """
+        Returns:
+            int: Export progress from 0 to 100.
+        """
+        if not self.total_rows:
+            return 100 if self.done else 0
+        return min(100, self.rows_written * 100 // self.total_rows)
+
+    def _progress(self, rows_written, total_rows):
+        self.rows_written = rows_written
+        self.total_rows = total_rows
+
+    def _run(self):
+        try:
+            export_csv(
+                self.db,
+                self.path,
+                self.phone_number_ids,
+                self.start_date,
+                self.end_date,
+                compress=self.compress,
+                chunk_size=self.chunk_size,
+                progress=self._progress,
+                cancel_event=self.cancel_event,
+            )
+        except ExportCancelled:
+            self.cancelled = True
+        except Exception as e:
+            print(f"Error exporting database to CSV: {e}")
+            self.error = e
+        finally:
+            self.db.connections.release_reader()
+            self.done = True
@@ -1,6 +1,569 @@
+import calendar
+import math
 import sqlite3
+import threading
 import time
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# Queries on the ingest and route-display paths. They are kept here so that
+# check_query_plans() inspects exactly the SQL the methods below execute.
+SELECT_LAST_TIMESTAMP = """
+    SELECT timestamp
+    FROM coordinates
+    WHERE phone_number_id = ? AND date = ?
+    ORDER BY timestamp DESC
+    LIMIT 1
+"""
+
+SELECT_COORDINATES_FOR_DAY = """
+    SELECT latitude, longitude, timestamp
+    FROM coordinates
+    WHERE phone_number_id = ? AND date = ?
+    ORDER BY timestamp
+"""
+
+SELECT_DATES_FOR_NUMBER = """
+    SELECT date
+    FROM track_days
+    WHERE phone_number_id = ?
+    ORDER BY date
+"""
+
+SELECT_TRACK_DAY = """
+    SELECT phone_number_id, date, point_count, first_time, last_time,
+           min_lat, min_lon, max_lat, max_lon, distance_km, last_lat, last_lon
+    FROM track_days
+    WHERE phone_number_id = ? AND date = ?
+"""
+
+SELECT_TRACK = """
+    SELECT latitude, longitude, epoch
+    FROM coordinates
+    WHERE phone_number_id = ? AND epoch BETWEEN ? AND ?
+    ORDER BY epoch
+"""
+
+# R*Tree candidates are widened to float32 bounds, so matches are re-checked
+# exactly against the coordinates row they point at.
+SELECT_BBOX = """
+    SELECT coordinates.phone_number_id, coordinates.latitude, coordinates.longitude, coordinates.epoch
+    FROM coordinates_rtree
+    JOIN coordinates ON coordinates.rowid = coordinates_rtree.id
+    WHERE coordinates_rtree.max_lat >= :min_lat AND coordinates_rtree.min_lat <= :max_lat
+      AND coordinates_rtree.max_lon >= :min_lon AND coordinates_rtree.min_lon <= :max_lon
+      AND coordinates_rtree.max_epoch >= :start AND coordinates_rtree.min_epoch <= :end
+      AND coordinates.latitude BETWEEN :min_lat AND :max_lat
+      AND coordinates.longitude BETWEEN :min_lon AND :max_lon
+      AND coordinates.epoch BETWEEN :start AND :end
+    ORDER BY coordinates.phone_number_id, coordinates.epoch
+"""
+
+# Fallback when this SQLite build has no R*Tree module
+SELECT_BBOX_SCAN = """
+    SELECT phone_number_id, latitude, longitude, epoch
+    FROM coordinates
+    WHERE latitude BETWEEN :min_lat AND :max_lat
+      AND longitude BETWEEN :min_lon AND :max_lon
+      AND epoch BETWEEN :start AND :end
+    ORDER BY phone_number_id, epoch
+"""
+
+# Column order of track_days rows, as selected by SELECT_TRACK_DAY
+TRACK_DAY_COLUMNS = (
+    "phone_number_id", "date", "point_count", "first_time", "last_time",
+    "min_lat", "min_lon", "max_lat", "max_lon", "distance_km", "last_lat", "last_lon",
+)
+
+REPLACE_TRACK_DAY = """
+    INSERT OR REPLACE INTO track_days (
+        phone_number_id, date, point_count, first_time, last_time,
+        min_lat, min_lon, max_lat, max_lon, distance_km, last_lat, last_lon
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _migration_1_coordinates_index(cursor):
+    """Covering index for the per-vessel, per-day lookups."""
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_coordinates_phone_date_time
+        ON coordinates (phone_number_id, date, timestamp)
+    """)
+
+
+def _migration_2_track_days(cursor):
+    """Per-vessel daily summary table, backfilled from the stored fixes."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS track_days (
+            phone_number_id INTEGER,
+            date TEXT,
+            point_count INTEGER,
+            first_time TEXT,
+            last_time TEXT,
+            min_lat REAL,
+            min_lon REAL,
+            max_lat REAL,
+            max_lon REAL,
+            distance_km REAL,
+            last_lat REAL,
+            last_lon REAL,
+            PRIMARY KEY (phone_number_id, date)
+        ) WITHOUT ROWID
+    """)
+
+    # Fold the fixes in insertion order, like the ingest path does
+    days = {}
+    rows = cursor.connection.execute("""
+        SELECT phone_number_id, date, timestamp, latitude, longitude
+        FROM coordinates
+        ORDER BY rowid
+    """)
+    for phone_number_id, date, timestamp, lat, lon in rows:
+        key = (phone_number_id, date)
+        if key not in days:
+            days[key] = new_track_day(phone_number_id, date)
+        update_track_day(days[key], timestamp, lat, lon)
+    cursor.executemany(REPLACE_TRACK_DAY, [track_day_row(day) for day in days.values()])
+
+
+def _migration_3_epoch(cursor):
+    """Integer epoch-seconds column, backfilled from date and timestamp."""
+    cursor.execute("ALTER TABLE coordinates ADD COLUMN epoch INTEGER")
+    # strftime('%s') reads the stored wall-clock date and time as UTC, the same
+    # convention as to_epoch() on the ingest path
+    cursor.execute("""
+        UPDATE coordinates
+        SET epoch = CAST(strftime('%s', date || ' ' || timestamp) AS INTEGER)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_coordinates_phone_epoch
+        ON coordinates (phone_number_id, epoch)
+    """)
+
+
+def create_spatial_index(cursor):
+    """
+    Create the coordinates_rtree R*Tree over (latitude, longitude, epoch), the
+    triggers that keep it in sync with coordinates, and fill it from the
+    existing rows. Entries are keyed by coordinates.rowid, which stays stable
+    unless the file is VACUUMed; GPSDatabase.rebuild_spatial_index() re-syncs it.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor inside the caller's transaction.
+
+    Returns:
+        bool: False if this SQLite build has no R*Tree module.
+    """
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS coordinates_rtree USING rtree (
+                id,
+                min_lat, max_lat,
+                min_lon, max_lon,
+                min_epoch, max_epoch
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"Spatial index not available: {e}")
+        return False
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS coordinates_rtree_insert
+        AFTER INSERT ON coordinates
+        WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL AND new.epoch IS NOT NULL
+        BEGIN
+            INSERT INTO coordinates_rtree
+            VALUES (new.rowid, new.latitude, new.latitude, new.longitude, new.longitude, new.epoch, new.epoch);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS coordinates_rtree_delete
+        AFTER DELETE ON coordinates
+        BEGIN
+            DELETE FROM coordinates_rtree WHERE id = old.rowid;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS coordinates_rtree_update
+        AFTER UPDATE OF latitude, longitude, epoch ON coordinates
+        BEGIN
+            DELETE FROM coordinates_rtree WHERE id = old.rowid;
+            INSERT INTO coordinates_rtree
+            SELECT new.rowid, new.latitude, new.latitude, new.longitude, new.longitude, new.epoch, new.epoch
+            WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL AND new.epoch IS NOT NULL;
+        END
+    """)
+    cursor.execute("DELETE FROM coordinates_rtree")
+    cursor.execute("""
+        INSERT INTO coordinates_rtree
+        SELECT rowid, latitude, latitude, longitude, longitude, epoch, epoch
+        FROM coordinates
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND epoch IS NOT NULL
+    """)
+    return True
+
+
+def _migration_4_spatial_index(cursor):
+    """R*Tree spatial index for area and time-window queries."""
+    # Older firmware stored unpadded times such as "15:36:4", which SQLite's
+    # strftime() rejects, so migration 3 left their epoch NULL
+    rows = cursor.connection.execute("""
+        SELECT rowid, date, timestamp
+        FROM coordinates
+        WHERE epoch IS NULL
+    """).fetchall()
+    updates = []
+    for rowid, date, timestamp in rows:
+        try:
+            updates.append((date_to_epoch(date) + parse_time(timestamp), rowid))
+        except (TypeError, ValueError, AttributeError):
+            print(f"Skipping unparseable date/time {date} {timestamp}")
+    cursor.executemany("UPDATE coordinates SET epoch = ? WHERE rowid = ?", updates)
+
+    create_spatial_index(cursor)
+
+
+def _migration_5_journal_state(cursor):
+    """Sequence number of the last ingest journal record committed."""
+    cursor.execute("CREATE TABLE IF NOT EXISTS journal_state (last_seq INTEGER NOT NULL)")
+    cursor.execute("INSERT INTO journal_state (last_seq) VALUES (0)")
+
+
+def _migration_6_journal_applied(cursor):
+    """Ingest journal records committed ahead of an earlier record."""
+    cursor.execute("CREATE TABLE IF NOT EXISTS journal_applied (seq INTEGER PRIMARY KEY)")
+
+
+def mark_journal_applied(cursor, journal_seqs):
+    """
+    Record IngestJournal records as committed, in the caller's transaction.
+
+    journal_state.last_seq is a low watermark: every record up to it is
+    committed. A record committed while an earlier one is still missing, for
+    example because the earlier batch failed, waits in journal_applied until
+    the gap is filled, so the missing record is still replayed.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor inside the caller's transaction.
+        journal_seqs (list): Sequence numbers of the records committed.
+    """
+    cursor.executemany("INSERT OR IGNORE INTO journal_applied (seq) VALUES (?)", [(seq,) for seq in journal_seqs])
+    cursor.execute("SELECT last_seq FROM journal_state")
+    last_seq = cursor.fetchone()[0]
+    while True:
+        cursor.execute("SELECT 1 FROM journal_applied WHERE seq = ?", (last_seq + 1,))
+        if cursor.fetchone() is None:
+            break
+        last_seq += 1
+    cursor.execute("DELETE FROM journal_applied WHERE seq <= ?", (last_seq,))
+    cursor.execute("UPDATE journal_state SET last_seq = ?", (last_seq,))
+
+
+# Schema migrations, applied in order. The database's PRAGMA user_version
+# records how many of them have run, so existing .db files are upgraded in
+# place the next time they are opened. Only ever append to this list.
+MIGRATIONS = [
+    _migration_1_coordinates_index,
+    _migration_2_track_days,
+    _migration_3_epoch,
+    _migration_4_spatial_index,
+    _migration_5_journal_state,
+    _migration_6_journal_applied,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Index each hot query is expected to use, checked by check_query_plans().
+INDEXED_QUERIES = {
+    "last_timestamp": (SELECT_LAST_TIMESTAMP, (1, "1970-01-01"), "idx_coordinates_phone_date_time"),
+    "coordinates_for_day": (SELECT_COORDINATES_FOR_DAY, (1, "1970-01-01"), "idx_coordinates_phone_date_time"),
+    "dates_for_number": (SELECT_DATES_FOR_NUMBER, (1,), "PRIMARY KEY"),
+    "track_day": (SELECT_TRACK_DAY, (1, "1970-01-01"), "PRIMARY KEY"),
+    "track": (SELECT_TRACK, (1, 0, 86400), "idx_coordinates_phone_epoch"),
+}
+
+
+def parse_time(time_value):
+    """
+    Convert an "HH:MM:SS" string to seconds since midnight.
+
+    Args:
+        time_value (str): Time of day.
+
+    Returns:
+        int: Seconds since midnight.
+    """
+    hours, minutes, seconds = time_value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def format_time(seconds):
+    """
+    Convert seconds since midnight to an "HH:MM:SS" string, wrapping past midnight.
+
+    Args:
+        seconds (int): Seconds since midnight.
+
+    Returns:
+        str: Time of day.
+    """
+    seconds %= 86400
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def date_to_epoch(date):
+    """
+    Epoch seconds at the start of a "YYYY-MM-DD" date. Stored dates and times
+    are wall-clock values, and are converted as if they were UTC so that the
+    result does not depend on the local time zone or daylight saving.
+
+    Args:
+        date (str): Date.
+
+    Returns:
+        int: Epoch seconds at midnight of that date.
+    """
+    return calendar.timegm(time.strptime(date, "%Y-%m-%d"))
+
+
+def to_epoch(value):
+    """
+    Convert a time for get_track() to epoch seconds.
+
+    Args:
+        value (int | float | datetime | str): Epoch seconds, a naive datetime, or a
+            "YYYY-MM-DD HH:MM:SS" / "YYYY-MM-DD" string, all read as stored wall-clock time.
+
+    Returns:
+        int: Epoch seconds.
+    """
+    if isinstance(value, str):
+        date, _, time_value = value.strip().partition(" ")
+        return date_to_epoch(date) + (parse_time(time_value) if time_value else 0)
+    if isinstance(value, datetime):
+        return calendar.timegm(value.timetuple())
+    return int(value)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle (haversine) distance between two points.
+
+    Args:
+        lat1 (float): Latitude of the first point.
+        lon1 (float): Longitude of the first point.
+        lat2 (float): Latitude of the second point.
+        lon2 (float): Longitude of the second point.
+
+    Returns:
+        float: Distance in kilometres.
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * 6371.0088 * math.asin(min(1.0, math.sqrt(a)))
+
+
+def new_track_day(phone_number_id, date):
+    """
+    Create an empty track_days summary.
+
+    Args:
+        phone_number_id (int): ID of the phone number.
+        date (str): Date of the summary.
+
+    Returns:
+        dict: Summary keyed by TRACK_DAY_COLUMNS.
+    """
+    day = dict.fromkeys(TRACK_DAY_COLUMNS)
+    day.update(phone_number_id=phone_number_id, date=date, point_count=0, distance_km=0.0)
+    return day
+
+
+def update_track_day(day, timestamp, lat, lon):
+    """
+    Fold one fix into a track_days summary. The running distance follows the
+    order in which fixes are folded in.
+
+    Args:
+        day (dict): Summary to update in place.
+        timestamp (str): Stored "HH:MM:SS" timestamp of the fix.
+        lat (float): Latitude value.
+        lon (float): Longitude value.
+    """
+    if day["point_count"]:
+        day["distance_km"] += distance_km(day["last_lat"], day["last_lon"], lat, lon)
+        day["first_time"] = min(day["first_time"], timestamp)
+        day["last_time"] = max(day["last_time"], timestamp)
+        day["min_lat"] = min(day["min_lat"], lat)
+        day["min_lon"] = min(day["min_lon"], lon)
+        day["max_lat"] = max(day["max_lat"], lat)
+        day["max_lon"] = max(day["max_lon"], lon)
+    else:
+        day["first_time"] = day["last_time"] = timestamp
+        day["min_lat"] = day["max_lat"] = lat
+        day["min_lon"] = day["max_lon"] = lon
+    day["point_count"] += 1
+    day["last_lat"] = lat
+    day["last_lon"] = lon
+
+
+def track_day_row(day):
+    """
+    Convert a track_days summary to a row tuple for REPLACE_TRACK_DAY.
+
+    Args:
+        day (dict): Summary keyed by TRACK_DAY_COLUMNS.
+
+    Returns:
+        tuple: Column values in TRACK_DAY_COLUMNS order.
+    """
+    return tuple(day[column] for column in TRACK_DAY_COLUMNS)
+
+
+class ConnectionManager:
+    """
+    Hands out SQLite connections for a GPS database file running in WAL mode.
+
+    Every thread gets its own reader connection, and all writes go through one
+    long-lived writer connection guarded by a lock. With WAL, readers work on
+    a snapshot and never block the writer, so route queries and CSV exports
+    can run while fixes are being ingested.
+    """
+
+    def __init__(self, db_name, synchronous="NORMAL", cache_size_kib=16384,
+                 mmap_size=256 * 1024 * 1024, busy_timeout_ms=10000):
+        """
+        Args:
+            db_name (str): Path of the database file.
+            synchronous (str): PRAGMA synchronous level. NORMAL is durable against
+                application crashes in WAL mode and avoids an fsync per commit.
+            cache_size_kib (int): Page cache size per connection, in KiB.
+            mmap_size (int): Bytes of the database file to memory-map for reads.
+            busy_timeout_ms (int): How long a connection waits on a lock before failing.
+        """
+        self.db_name = db_name
+        self.pragmas = [
+            f"PRAGMA synchronous = {synchronous}",
+            f"PRAGMA cache_size = -{int(cache_size_kib)}",
+            f"PRAGMA mmap_size = {int(mmap_size)}",
+            f"PRAGMA busy_timeout = {int(busy_timeout_ms)}",
+            "PRAGMA temp_store = MEMORY",
+        ]
+        self.local = threading.local()
+        self.write_lock = threading.RLock()
+        self.writer_connection = None
+        self.connections = []
+        self.connections_lock = threading.Lock()
+
+    def open(self, check_same_thread=True):
+        """
+        Open a new connection with the WAL journal and tuned pragmas applied.
+
+        Args:
+            check_same_thread (bool): Passed through to sqlite3.connect.
+
+        Returns:
+            sqlite3.Connection: The new connection.
+        """
+        connection = sqlite3.connect(
+            self.db_name,
+            timeout=30,
+            check_same_thread=check_same_thread,
+        )
+        # journal_mode is stored in the file; setting it again is a no-op
+        connection.execute("PRAGMA journal_mode = WAL")
+        for pragma in self.pragmas:
+            connection.execute(pragma)
+        with self.connections_lock:
+            self.connections.append(connection)
+        return connection
+
+    def reader(self):
+        """
+        Return the calling thread's reader connection, opening it on first use.
+
+        Returns:
+            sqlite3.Connection: Connection owned by the current thread.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.open()
+            self.local.connection = connection
+            self.local.cursor = connection.cursor()
+        return connection
+
+    def reader_cursor(self):
+        """
+        Return the calling thread's cursor on its reader connection.
+
+        Returns:
+            sqlite3.Cursor: Cursor owned by the current thread.
+        """
+        self.reader()
+        return self.local.cursor
+
+    @contextmanager
+    def writer(self):
+        """
+        Context manager yielding the shared writer connection. The block runs
+        under the write lock and is committed on success or rolled back on error.
+
+        Yields:
+            sqlite3.Connection: The writer connection.
+        """
+        with self.write_lock:
+            if self.writer_connection is None:
+                # Only ever used while holding write_lock, from any thread
+                self.writer_connection = self.open(check_same_thread=False)
+            try:
+                yield self.writer_connection
+                self.writer_connection.commit()
+            except Exception:
+                self.writer_connection.rollback()
+                raise
+
+    def release(self, connection):
+        """
+        Close a connection obtained from open() that is no longer needed.
+
+        Args:
+            connection (sqlite3.Connection): Connection to close.
+        """
+        with self.connections_lock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+        connection.close()
+
+    def release_reader(self):
+        """
+        Close the calling thread's reader connection, if it has one. Worker
+        threads call this before exiting.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            self.local.connection = None
+            self.local.cursor = None
+            self.release(connection)
+
+    def close(self):
+        """
+        Close every connection handed out by this manager.
+        """
+        with self.write_lock, self.connections_lock:
+            for connection in self.connections:
+                try:
+                    connection.close()
+                except sqlite3.ProgrammingError:
+                    # Reader connections can only be closed by their own thread
+                    pass
+            self.connections = []
+            self.writer_connection = None
+        self.local = threading.local()
 
 
 class GPSDatabase:
@@ -12,36 +575,147 @@ class GPSDatabase:
             db_name (str): Name of the database file. Defaults to "gps_coordinates.db".
         """
         self.db_name = db_name
-        self.connection = sqlite3.connect(db_name, check_same_thread=False)
-        self.cursor = self.connection.cursor()
+        self.connections = ConnectionManager(db_name)
+        # Ingest caches, only touched while holding the write lock. They assume
+        # this object is the only writer to the database file.
+        self.phone_ids = {}
+        self.last_timestamps = {}
+        self.track_days = {}
         self.create_tables()
+        self.warm_cache()
+
+    @property
+    def connection(self):
+        """
+        sqlite3.Connection: Reader connection owned by the calling thread.
+        """
+        return self.connections.reader()
+
+    @property
+    def cursor(self):
+        """
+        sqlite3.Cursor: Cursor on the calling thread's reader connection.
+        """
+        return self.connections.reader_cursor()
+
+    def close(self):
+        """
+        Close all database connections.
+        """
+        self.connections.close()
 
     def create_tables(self):
         """
         Create tables for storing phone numbers and GPS coordinates if they do not already exist.
         """
-        # Create phone_numbers table
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS phone_numbers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                phone_number TEXT UNIQUE
+        with self.connections.writer() as connection:
+            # Create phone_numbers table
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS phone_numbers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    phone_number TEXT UNIQUE
+                )
+            """)
+
+            # Create coordinates table with a foreign key reference to phone_numbers
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS coordinates (
+                    phone_number_id INTEGER,
+                    timestamp TEXT,
+                    latitude REAL,
+                    longitude REAL,
+                    date TEXT,
+                    FOREIGN KEY (phone_number_id) REFERENCES phone_numbers(id)
+                )
+            """)
+        self.migrate()
+
+    def get_schema_version(self):
+        """
+        Return the schema version recorded in the database file.
+
+        Returns:
+            int: Number of migrations that have been applied.
+        """
+        self.cursor.execute("PRAGMA user_version")
+        return self.cursor.fetchone()[0]
+
+    def migrate(self):
+        """
+        Apply any pending schema migrations. Each migration runs in its own
+        transaction together with the user_version bump, so an interrupted
+        upgrade is retried from the same step on the next start.
+
+        Returns:
+            int: Schema version after migrating.
+        """
+        version = self.get_schema_version()
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(
+                f"{self.db_name} has schema version {version}, newer than the "
+                f"supported version {SCHEMA_VERSION}"
             )
-        """)
 
-        # Create coordinates table with a foreign key reference to phone_numbers
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS coordinates (
-                phone_number_id INTEGER,
-                timestamp TEXT,
-                latitude REAL,
-                longitude REAL,
-                date TEXT,
-                FOREIGN KEY (phone_number_id) REFERENCES phone_numbers(id)
+        for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            with self.connections.writer() as connection:
+                cursor = connection.cursor()
+                cursor.execute("BEGIN")
+                migration(cursor)
+                # PRAGMA does not accept bound parameters
+                cursor.execute(f"PRAGMA user_version = {target}")
+        if version < SCHEMA_VERSION:
+            print(f"Upgraded {self.db_name} from schema version {version} to {SCHEMA_VERSION}")
+        return SCHEMA_VERSION
+
+    def check_query_plans(self):
+        """
+        Run EXPLAIN QUERY PLAN on the hot queries and check that each one is
+        served by its index without a full scan or a temporary sort.
+
+        Returns:
+            dict: Maps query name to a (ok, plan) tuple, where plan is the list
+            of plan detail strings reported by SQLite.
+        """
+        results = {}
+        for name, (sql, params, index_name) in INDEXED_QUERIES.items():
+            self.cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = [row[-1] for row in self.cursor.fetchall()]
+            ok = (
+                any(index_name in detail for detail in plan)
+                and not any(detail.startswith("SCAN") for detail in plan)
+                and not any("TEMP B-TREE" in detail for detail in plan)
             )
-        """)
-        self.connection.commit()
+            results[name] = (ok, plan)
+        return results
 
-    def insert_coordinates(self, phone_number, time_value, lat, lon):
+    def warm_cache(self):
+        """
+        (Re)load the ingest caches: every phone number ID, and for the current
+        date the last timestamp (None if there is none) and track_days summary
+        of each phone number. Entries for other dates are read from the
+        database the first time they are needed.
+        """
+        date = time.strftime("%Y-%m-%d")
+        with self.connections.write_lock:
+            cursor = self.connections.reader_cursor()
+            cursor.execute("SELECT phone_number, id FROM phone_numbers")
+            self.phone_ids = dict(cursor.fetchall())
+            self.last_timestamps = {}
+            for phone_number_id in self.phone_ids.values():
+                cursor.execute(SELECT_LAST_TIMESTAMP, (phone_number_id, date))
+                row = cursor.fetchone()
+                self.last_timestamps[(phone_number_id, date)] = parse_time(row[0]) if row else None
+
+            self.track_days = {}
+            cursor.execute(
+                f"SELECT {', '.join(TRACK_DAY_COLUMNS)} FROM track_days WHERE date = ?",
+                (date,)
+            )
+            for row in cursor.fetchall():
+                day = dict(zip(TRACK_DAY_COLUMNS, row))
+                self.track_days[(day["phone_number_id"], date)] = day
+
+    def insert_coordinates(self, phone_number, time_value, lat, lon, date=None):
         """
         Insert GPS coordinates and associate them with a phone number. Updates the timestamp by 1 minute for each new entry.
 
@@ -50,89 +724,182 @@ class GPSDatabase:
             time_value (str): Initial timestamp for the coordinates.
             lat (float): Latitude value.
             lon (float): Longitude value.
+            date (str): Date to file the coordinates under (YYYY-MM-DD). Defaults to the current date.
 
         Returns:
             int: ID of the phone number in the database.
         """
-        with sqlite3.connect(self.db_name, check_same_thread=False) as connection:
-            cursor = connection.cursor()
+        return self.insert_coordinates_batch([(phone_number, time_value, lat, lon)], date)[0]
+
+    def get_journal_seq(self):
+        """
+        Returns:
+            int: Sequence number up to which every IngestJournal record is committed.
+        """
+        self.cursor.execute("SELECT last_seq FROM journal_state")
+        return self.cursor.fetchone()[0]
+
+    def get_journal_applied(self):
+        """
+        Returns:
+            tuple: (last_seq, seqs), get_journal_seq() and the set of records
+            committed after it while an earlier record was not.
+        """
+        last_seq = self.get_journal_seq()
+        self.cursor.execute("SELECT seq FROM journal_applied WHERE seq > ?", (last_seq,))
+        return last_seq, {row[0] for row in self.cursor.fetchall()}
+
+    def insert_coordinates_batch(self, fixes, date=None, journal_seqs=()):
+        """
+        Insert many GPS fixes in a single transaction. Timestamps follow the same
+        rule as insert_coordinates, applied to the fixes in order.
+
+        Args:
+            fixes (list): List of (phone_number, time_value, lat, lon) tuples.
+            date (str): Date to file the fixes under (YYYY-MM-DD). Defaults to the current date.
+            journal_seqs (list): Sequence numbers of the IngestJournal records the
+                fixes complete, marked as committed in the same transaction.
+
+        Returns:
+            list: Phone number ID assigned to each fix, in the same order.
+        """
+        if not fixes and not journal_seqs:
+            return []
+
+        if date is None:
             date = time.strftime("%Y-%m-%d")  # Get the current date
+        day_epoch = date_to_epoch(date)
+        with self.connections.write_lock:
+            # Cache updates are staged and only applied once the batch commits
+            new_phone_ids = {}
+            last_timestamps = {}
+            track_days = {}
+            with self.connections.writer() as connection:
+                cursor = connection.cursor()
+                rows = []
+                assigned_ids = []
+                for phone_number, time_value, lat, lon in fixes:
+                    phone_number_id = self.phone_ids.get(phone_number) or new_phone_ids.get(phone_number)
+                    if phone_number_id is None:
+                        # Insert phone number if it does not exist
+                        cursor.execute(
+                            "INSERT OR IGNORE INTO phone_numbers (phone_number) VALUES (?)",
+                            (phone_number,)
+                        )
+                        cursor.execute(
+                            "SELECT id FROM phone_numbers WHERE phone_number = ?",
+                            (phone_number,)
+                        )
+                        phone_number_id = cursor.fetchone()[0]
+                        new_phone_ids[phone_number] = phone_number_id
 
-            # Insert phone number if it does not exist
-            cursor.execute(
-                "INSERT OR IGNORE INTO phone_numbers (phone_number) VALUES (?)",
-                (phone_number,)
-            )
+                    key = (phone_number_id, date)
+                    if key in last_timestamps:
+                        last_timestamp = last_timestamps[key]
+                    elif key in self.last_timestamps:
+                        last_timestamp = self.last_timestamps[key]
+                    else:
+                        # First fix for this phone number and date since startup
+                        cursor.execute(SELECT_LAST_TIMESTAMP, key)
+                        row = cursor.fetchone()
+                        last_timestamp = parse_time(row[0]) if row else None
 
-            # Retrieve the ID of the phone number
-            cursor.execute(
-                "SELECT id FROM phone_numbers WHERE phone_number = ?",
-                (phone_number,)
-            )
-            phone_number_id = cursor.fetchone()[0]
+                    if last_timestamp is not None:
+                        new_timestamp = last_timestamp + 60
+                    else:
+                        # Use the provided timestamp if no previous record exists
+                        new_timestamp = parse_time(time_value)
+                    new_timestamp %= 86400
+                    last_timestamps[key] = new_timestamp
 
-            # Retrieve the latest timestamp for the same phone number and date
-            cursor.execute("""
-                SELECT timestamp
-                FROM coordinates
-                WHERE phone_number_id = ? AND date = ?
-                ORDER BY timestamp DESC
-                LIMIT 1
-            """, (phone_number_id, date))
-            last_timestamp_row = cursor.fetchone()
-
-            if last_timestamp_row:
-                last_timestamp = datetime.strptime(last_timestamp_row[0], "%H:%M:%S")
-                new_timestamp = last_timestamp + timedelta(minutes=1)
-            else:
-                # Use the provided timestamp if no previous record exists
-                new_timestamp = datetime.strptime(time_value, "%H:%M:%S")
-
-            # Insert GPS coordinates with the updated timestamp
-            cursor.execute("""
-                INSERT INTO coordinates (phone_number_id, latitude, longitude, timestamp, date)
-                VALUES (?, ?, ?, ?, ?)
-            """, (phone_number_id, lat, lon, new_timestamp.strftime("%H:%M:%S"), date))
-            connection.commit()
-            return phone_number_id
+                    if key not in track_days:
+                        # Work on a copy so a rollback leaves the cache untouched
+                        track_days[key] = dict(self.get_track_day_for_update(cursor, phone_number_id, date))
+                    update_track_day(track_days[key], format_time(new_timestamp), lat, lon)
 
-    def get_coordinates_for_id_and_date(self, phone_number_id, date):
+                    rows.append((phone_number_id, lat, lon, format_time(new_timestamp), date, day_epoch + new_timestamp))
+                    assigned_ids.append(phone_number_id)
+
+                cursor.executemany("""
+                    INSERT INTO coordinates (phone_number_id, latitude, longitude, timestamp, date, epoch)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, rows)
+                cursor.executemany(REPLACE_TRACK_DAY, [track_day_row(day) for day in track_days.values()])
+                if journal_seqs:
+                    mark_journal_applied(cursor, journal_seqs)
+
+            self.phone_ids.update(new_phone_ids)
+            self.last_timestamps.update(last_timestamps)
+            self.track_days.update(track_days)
+        return assigned_ids
+
+    def iter_coordinates_for_id_and_date(self, phone_number_id, date):
         """
-        Retrieve GPS coordinates for a specific phone number ID and date, updating timestamps to ensure uniqueness.
+        Stream GPS coordinates for a specific phone number ID and date, updating timestamps to ensure uniqueness.
+
+        A timestamp already handed out is moved forward 1 minute at a time until it
+        is free. Each taken slot remembers the next candidate after it, so runs of
+        identical timestamps are resolved in one pass instead of re-walking the run.
 
         Args:
             phone_number_id (int): ID of the phone number.
             date (str): Date to filter the coordinates.
 
-        Returns:
-            list: List of tuples containing latitude, longitude, and updated timestamps.
+        Yields:
+            tuple: Latitude, longitude and updated timestamp of each point, in time order.
         """
-        self.cursor.execute("""
-            SELECT latitude, longitude, timestamp 
-            FROM coordinates
-            WHERE phone_number_id = ? AND date = ?
-            ORDER BY timestamp
-        """, (phone_number_id, date))
-        results = self.cursor.fetchall()
-
-        if not results:
-            return []
+        # Own cursor, so the caller can keep using self.cursor while iterating
+        cursor = self.connection.cursor()
+        cursor.execute(SELECT_COORDINATES_FOR_DAY, (phone_number_id, date))
+
+        next_free = {}  # taken slot (seconds since midnight) -> next candidate slot
+        taken_per_second = [0] * 60  # a day has 1440 slots for each seconds value
+
+        for lat, lon, timestamp in cursor:
+            slot = parse_time(timestamp) % 86400
+            if taken_per_second[slot % 60] < 1440:
+                path = []
+                while slot in next_free:
+                    path.append(slot)
+                    slot = next_free[slot]
+                next_free[slot] = (slot + 60) % 86400
+                for taken in path:
+                    next_free[taken] = next_free[slot]
+                taken_per_second[slot % 60] += 1
+            yield lat, lon, format_time(slot)
 
-        updated_results = []
-        seen_timestamps = set()
+    def get_track_day_for_update(self, cursor, phone_number_id, date):
+        """
+        Return the cached track_days summary for a phone number and date, reading
+        it through the writer cursor on a cache miss. Must hold the write lock.
+
+        Args:
+            cursor (sqlite3.Cursor): Cursor on the writer connection.
+            phone_number_id (int): ID of the phone number.
+            date (str): Date of the summary.
 
-        for i, (lat, lon, timestamp) in enumerate(results):
-            # Parse the timestamp
-            ts = datetime.strptime(timestamp, "%H:%M:%S")
+        Returns:
+            dict: Summary keyed by TRACK_DAY_COLUMNS.
+        """
+        key = (phone_number_id, date)
+        if key not in self.track_days:
+            cursor.execute(SELECT_TRACK_DAY, key)
+            row = cursor.fetchone()
+            self.track_days[key] = dict(zip(TRACK_DAY_COLUMNS, row)) if row else new_track_day(phone_number_id, date)
+        return self.track_days[key]
 
-            # Ensure unique timestamps by adding 1 minute if needed
-            while ts.strftime("%H:%M:%S") in seen_timestamps:
-                ts += timedelta(minutes=1)
+    def get_coordinates_for_id_and_date(self, phone_number_id, date):
+        """
+        Retrieve GPS coordinates for a specific phone number ID and date, updating timestamps to ensure uniqueness.
 
-            updated_results.append((lat, lon, ts.strftime("%H:%M:%S")))
-            seen_timestamps.add(ts.strftime("%H:%M:%S"))
+        Args:
+            phone_number_id (int): ID of the phone number.
+            date (str): Date to filter the coordinates.
 
-        return updated_results
+        Returns:
+            list: List of tuples containing latitude, longitude, and updated timestamps.
+        """
+        return list(self.iter_coordinates_for_id_and_date(phone_number_id, date))
 
     def get_all_phone_numbers_with_ids(self):
         """
@@ -152,15 +919,193 @@ class GPSDatabase:
             phone_number_id (int): ID of the phone number.
 
         Returns:
-            list: List of dates (as strings) associated with the phone number.
+            list: List of dates (as strings) associated with the phone number, oldest first.
         """
-        self.cursor.execute("""
-            SELECT DISTINCT date 
-            FROM coordinates 
-            WHERE phone_number_id = ?
-        """, (phone_number_id,))
+        self.cursor.execute(SELECT_DATES_FOR_NUMBER, (phone_number_id,))
         return [row[0] for row in self.cursor.fetchall()]
 
+    def iter_track(self, phone_number_id, start, end):
+        """
+        Stream the fixes of a phone number between two times, using an index
+        range scan on the epoch column. The window may span several dates, so a
+        voyage that crosses midnight comes back as one track.
+
+        Args:
+            phone_number_id (int): ID of the phone number.
+            start (int | datetime | str): Start of the window, inclusive. See to_epoch().
+            end (int | datetime | str): End of the window, inclusive. See to_epoch().
+
+        Yields:
+            tuple: Latitude, longitude and epoch seconds of each fix, in time order.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(SELECT_TRACK, (phone_number_id, to_epoch(start), to_epoch(end)))
+        yield from cursor
+
+    def get_track(self, phone_number_id, start, end):
+        """
+        Retrieve the fixes of a phone number between two times.
+
+        Args:
+            phone_number_id (int): ID of the phone number.
+            start (int | datetime | str): Start of the window, inclusive. See to_epoch().
+            end (int | datetime | str): End of the window, inclusive. See to_epoch().
+
+        Returns:
+            list: List of tuples containing latitude, longitude and epoch seconds.
+        """
+        return list(self.iter_track(phone_number_id, start, end))
+
+    def has_spatial_index(self):
+        """
+        Returns:
+            bool: True if the coordinates_rtree spatial index exists.
+        """
+        self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'coordinates_rtree'"
+        )
+        return self.cursor.fetchone() is not None
+
+    def rebuild_spatial_index(self):
+        """
+        Recreate the spatial index from the coordinates table, for example after
+        a VACUUM or on a SQLite build that has gained R*Tree support.
+
+        Returns:
+            bool: False if this SQLite build has no R*Tree module.
+        """
+        with self.connections.writer() as connection:
+            return create_spatial_index(connection.cursor())
+
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon, start, end):
+        """
+        Find the fixes inside a latitude/longitude box and time window, for
+        example "which vessels were inside this harbour between 0600 and 0900".
+
+        Args:
+            min_lat (float): Southern edge of the box.
+            min_lon (float): Western edge of the box.
+            max_lat (float): Northern edge of the box.
+            max_lon (float): Eastern edge of the box.
+            start (int | datetime | str): Start of the window, inclusive. See to_epoch().
+            end (int | datetime | str): End of the window, inclusive. See to_epoch().
+
+        Returns:
+            dict: Maps phone number ID to its list of (latitude, longitude, epoch)
+            tuples inside the box, in time order.
+        """
+        params = {
+            "min_lat": min_lat,
+            "min_lon": min_lon,
+            "max_lat": max_lat,
+            "max_lon": max_lon,
+            "start": to_epoch(start),
+            "end": to_epoch(end),
+        }
+        cursor = self.connection.cursor()
+        cursor.execute(SELECT_BBOX if self.has_spatial_index() else SELECT_BBOX_SCAN, params)
+
+        vessels = {}
+        for phone_number_id, lat, lon, epoch in cursor:
+            vessels.setdefault(phone_number_id, []).append((lat, lon, epoch))
+        return vessels
+
+    def get_track_day(self, phone_number_id, date):
+        """
+        Retrieve the daily summary for a specific phone number ID and date.
+
+        Args:
+            phone_number_id (int): ID of the phone number.
+            date (str): Date of the summary.
+
+        Returns:
+            dict: Point count, first and last time, bounding box (min_lat, min_lon,
+            max_lat, max_lon), running distance_km and last position, or None if
+            there are no points for that day.
+        """
+        self.cursor.execute(SELECT_TRACK_DAY, (phone_number_id, date))
+        row = self.cursor.fetchone()
+        return dict(zip(TRACK_DAY_COLUMNS, row)) if row else None
+
+    def export_filters(self, phone_number_ids=None, start_date=None, end_date=None):
+        """
+        Build the WHERE clause shared by the export queries. Both coordinates and
+        track_days have phone_number_id and date columns, so it works for either.
+
+        Args:
+            phone_number_ids (list): Only include these phone number IDs. Defaults to all.
+            start_date (str): First date to include (YYYY-MM-DD), inclusive.
+            end_date (str): Last date to include (YYYY-MM-DD), inclusive.
+
+        Returns:
+            tuple: (where_sql, params), where where_sql is empty if there is no filter.
+        """
+        conditions = []
+        params = []
+        if phone_number_ids is not None:
+            phone_number_ids = list(phone_number_ids)
+            conditions.append(f"phone_number_id IN ({', '.join('?' * len(phone_number_ids))})")
+            params.extend(phone_number_ids)
+        if start_date is not None:
+            conditions.append("date >= ?")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("date <= ?")
+            params.append(end_date)
+        where_sql = "WHERE " + " AND ".join(conditions) if conditions else ""
+        return where_sql, params
+
+    def count_export_rows(self, phone_number_ids=None, start_date=None, end_date=None):
+        """
+        Count the coordinates matching the export filters, using the track_days
+        summaries instead of scanning the coordinates table.
+
+        Args:
+            phone_number_ids (list): Only count these phone number IDs. Defaults to all.
+            start_date (str): First date to count (YYYY-MM-DD), inclusive.
+            end_date (str): Last date to count (YYYY-MM-DD), inclusive.
+
+        Returns:
+            int: Number of matching coordinates.
+        """
+        where_sql, params = self.export_filters(phone_number_ids, start_date, end_date)
+        self.cursor.execute(f"SELECT COALESCE(SUM(point_count), 0) FROM track_days {where_sql}", params)
+        return self.cursor.fetchone()[0]
+
+    def iter_export_chunks(self, phone_number_ids=None, start_date=None, end_date=None, chunk_size=5000):
+        """
+        Stream coordinates joined with their phone numbers, in chunks, from a
+        dedicated read connection that is closed when the generator finishes.
+        Rows come in (phone_number_id, date, timestamp) index order.
+
+        Args:
+            phone_number_ids (list): Only include these phone number IDs. Defaults to all.
+            start_date (str): First date to include (YYYY-MM-DD), inclusive.
+            end_date (str): Last date to include (YYYY-MM-DD), inclusive.
+            chunk_size (int): Maximum rows per chunk.
+
+        Yields:
+            list: Tuples of phone number, latitude, longitude, timestamp and date.
+        """
+        where_sql, params = self.export_filters(phone_number_ids, start_date, end_date)
+        connection = self.connections.open()
+        try:
+            cursor = connection.execute(f"""
+                SELECT phone_numbers.phone_number, coordinates.latitude, coordinates.longitude,
+                       coordinates.timestamp, coordinates.date
+                FROM coordinates
+                JOIN phone_numbers ON coordinates.phone_number_id = phone_numbers.id
+                {where_sql}
+                ORDER BY coordinates.phone_number_id, coordinates.date, coordinates.timestamp
+            """, params)
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.connections.release(connection)
+
     def get_phone_number_by_id(self, phone_number_id):
         """
         Retrieve the phone number corresponding to a specific ID.
@@ -178,3 +1123,15 @@ class GPSDatabase:
         """, (phone_number_id,))
         result = self.cursor.fetchone()
         return result[0] if result else None
+
+
+if __name__ == "__main__":
+    # Query plan check: python gps_database4.py [database file]
+    import sys
+
+    db = GPSDatabase(sys.argv[1] if len(sys.argv) > 1 else "gps_coordinates (1).db")
+    failed = False
+    for name, (ok, plan) in db.check_query_plans().items():
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: {'; '.join(plan)}")
+        failed = failed or not ok
+    sys.exit(1 if failed else 0)
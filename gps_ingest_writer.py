@@ -0,0 +1,178 @@
+import queue
+import threading
+import time
+from concurrent import futures
+
+
+class IngestWriter:
+    """
+    Background writer that group-commits GPS fixes into a GPSDatabase.
+
+    Fixes submitted from any thread are collected by a single writer thread
+    and written with GPSDatabase.insert_coordinates_batch, one transaction per
+    flush window or per max_batch fixes, whichever comes first.
+    """
+
+    def __init__(self, db, max_batch=500, flush_interval=0.05, on_commit=None, journal=None):
+        """
+        Args:
+            db (GPSDatabase): Database the fixes are written to.
+            max_batch (int): Maximum number of fixes per transaction.
+            flush_interval (float): Seconds to keep collecting fixes after the first one arrives.
+            on_commit (callable): Optional callback called from the writer thread
+                with (fixes, phone_number_ids) after each committed batch.
+            journal (IngestJournal): Optional journal the submitted journal_seq
+                numbers come from, told about every record committed.
+        """
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.on_commit = on_commit
+        self.journal = journal
+        self.pending = queue.Queue()
+        self.thread = None
+        self.running = False
+        self.committed_fixes = 0
+        self.committed_batches = 0
+
+    def start(self):
+        """
+        Start the writer thread.
+
+        Returns:
+            IngestWriter: The writer itself, so it can be chained after construction.
+        """
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="gps-ingest-writer", daemon=True)
+            self.thread.start()
+        return self
+
+    def submit(self, phone_number, time_value, lat, lon, journal_seq=None):
+        """
+        Queue one fix for writing.
+
+        Args:
+            phone_number (str): Phone number to associate with the coordinates.
+            time_value (str): Initial timestamp for the coordinates.
+            lat (float): Latitude value.
+            lon (float): Longitude value.
+            journal_seq (int): IngestJournal record the fix came from. Submit
+                records in journal order, and a record's last fix last.
+
+        Returns:
+            Future: Resolves to the phone number ID once the fix is committed.
+        """
+        if not self.running:
+            raise RuntimeError("IngestWriter is not running")
+        future = futures.Future()
+        self.pending.put(((phone_number, time_value, lat, lon), future, journal_seq))
+        return future
+
+    def submit_many(self, fixes, journal_seq=None):
+        """
+        Queue several fixes for writing.
+
+        Args:
+            fixes (list): List of (phone_number, time_value, lat, lon) tuples.
+            journal_seq (int): IngestJournal record the fixes came from,
+                recorded with the batch that holds the last of them.
+
+        Returns:
+            list: One Future per fix, each resolving to its phone number ID.
+        """
+        last = len(fixes) - 1
+        return [
+            self.submit(*fix, journal_seq=journal_seq if number == last else None)
+            for number, fix in enumerate(fixes)
+        ]
+
+    def flush(self, timeout=None):
+        """
+        Block until every fix submitted so far has been committed.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if the writer caught up within the timeout.
+        """
+        marker = futures.Future()
+        self.pending.put((None, marker, None))
+        try:
+            marker.result(timeout)
+            return True
+        except futures.TimeoutError:
+            return False
+
+    def close(self, timeout=None):
+        """
+        Commit everything still queued and stop the writer thread.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for the thread.
+        """
+        if not self.running:
+            return
+        self.flush(timeout)
+        self.running = False
+        self.pending.put((None, None, None))
+        self.thread.join(timeout)
+
+    def _collect(self):
+        # Wait for the first fix, then keep collecting until the window closes
+        # or the batch is full.
+        batch = []
+        markers = []
+        item = self.pending.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            fix, future, journal_seq = item
+            if fix is None:
+                if future is None:
+                    break
+                # flush() marker: commit what we have right away
+                markers.append(future)
+                break
+            batch.append((fix, future, journal_seq))
+            if len(batch) >= self.max_batch:
+                break
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait()
+            except queue.Empty:
+                break
+        return batch, markers
+
+    def _run(self):
+        while self.running or not self.pending.empty():
+            batch, markers = self._collect()
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.set_result(None)
+
+    def _write(self, batch):
+        fixes = [fix for fix, _, _ in batch]
+        journal_seqs = [journal_seq for _, _, journal_seq in batch if journal_seq is not None]
+        try:
+            phone_number_ids = self.db.insert_coordinates_batch(fixes, journal_seqs=journal_seqs)
+        except Exception as e:
+            # The batch's records are not marked committed, so the journal
+            # keeps them and replays them on the next start
+            print(f"Error writing {len(fixes)} fixes: {e}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        self.committed_fixes += len(fixes)
+        self.committed_batches += 1
+        if self.journal and journal_seqs:
+            self.journal.applied(journal_seqs)
+        for (_, future, _), phone_number_id in zip(batch, phone_number_ids):
+            future.set_result(phone_number_id)
+        if self.on_commit:
+            try:
+                self.on_commit(fixes, phone_number_ids)
+            except Exception as e:
+                print(f"Error in ingest commit callback: {e}")
@@ -0,0 +1,258 @@
+"""
+Append-only journal of received messages, written before they are deleted
+from the SIM.
+
+Each record is one line, a CRC-32 of the JSON that follows it:
+
+    <crc32 hex> {"seq": 7, "date": "2025-01-01", "phone": "+91...", "locations": [[lat, lon, "HH:MM:SS"], ...]}
+
+Records are flushed to the operating system as they are appended, and
+fsync'd in groups: sync() makes everything appended so far durable with one
+fsync, however many modem threads are waiting for it. GPSDatabase records
+which records it has committed in the same transaction as the fixes, so
+replay() only applies the records that never reached the database and can
+safely be run again.
+
+Whoever commits the fixes reports the records to applied(). Once the
+committed records add up to compact_bytes, the journal is rewritten with
+only the records still waiting, so it stays small on a station that runs
+for weeks.
+"""
+import json
+import os
+import threading
+import time
+import zlib
+
+
+JOURNAL_COMPACT_BYTES = 1 << 20  # committed records kept in the file before it is rewritten
+
+class IngestJournal:
+    """
+    Crash-safe journal in front of the ingest path.
+
+    A torn last line, left by a crash in the middle of a write, fails its
+    CRC and is cut off when the journal is opened.
+    """
+
+    def __init__(self, path="gps_ingest.journal", compact_bytes=JOURNAL_COMPACT_BYTES):
+        """
+        Args:
+            path (str): Journal file. Created if it does not exist.
+            compact_bytes (int): Size of the committed records that triggers a rewrite.
+        """
+        self.path = path
+        self.compact_bytes = compact_bytes
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        # Lines of the records not known to be committed, by sequence number
+        self.pending = {}
+        self.pending_bytes = 0
+        self.size = 0
+        self.records = self._read()
+        self.last_seq = self.records[-1]["seq"] if self.records else 0
+        self.synced_seq = self.last_seq
+        # Messages of the previous run, in case the SIM still holds some of them
+        self.replayed = set()
+        self.appended = 0
+        self.syncs = 0
+        self.compactions = 0
+        self.file = open(path, "ab")
+
+    def _read(self):
+        # Returns the valid records, fills pending and cuts off a torn tail
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        good_length = 0
+        with open(self.path, "rb") as journal_file:
+            for line in journal_file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    checksum, data = line.rstrip(b"\n").split(b" ", 1)
+                    if int(checksum, 16) != zlib.crc32(data):
+                        raise ValueError("checksum mismatch")
+                    record = json.loads(data)
+                except ValueError as e:
+                    print(f"Discarding journal from offset {good_length}: {e}")
+                    break
+                records.append(record)
+                self.pending[record["seq"]] = line
+                self.pending_bytes += len(line)
+                good_length += len(line)
+        self.size = good_length
+        if good_length < os.path.getsize(self.path):
+            with open(self.path, "r+b") as journal_file:
+                journal_file.truncate(good_length)
+                os.fsync(journal_file.fileno())
+        return records
+
+    def append(self, phone_number, locations, date=None):
+        """
+        Append one received message. The record reaches the operating system
+        before this returns, so it survives the program crashing; call sync()
+        before deleting the message to survive a power failure as well.
+
+        Args:
+            phone_number (str): Sender of the message.
+            locations (list): (lat, lon, timestamp) tuples decoded from it.
+            date (str): Date the fixes are filed under (YYYY-MM-DD). Defaults to the current date.
+
+        Returns:
+            int: Sequence number of the record.
+        """
+        if date is None:
+            date = time.strftime("%Y-%m-%d")
+        with self.lock:
+            seq = self.last_seq + 1
+            data = json.dumps(
+                {"seq": seq, "date": date, "phone": phone_number, "locations": [list(fix) for fix in locations]},
+                separators=(",", ":"),
+            ).encode()
+            line = b"%08x %s\n" % (zlib.crc32(data), data)
+            self.file.write(line)
+            self.file.flush()
+            self.last_seq = seq
+            self.pending[seq] = line
+            self.pending_bytes += len(line)
+            self.size += len(line)
+            self.appended += 1
+        return seq
+
+    def sync(self):
+        """
+        Make every record appended so far durable. Concurrent callers share
+        one fsync: whoever gets the sync lock first syncs for everyone
+        waiting behind it.
+
+        Returns:
+            int: Sequence number of the last durable record.
+        """
+        with self.lock:
+            target = self.last_seq
+        if self.synced_seq >= target:
+            return self.synced_seq
+        with self.sync_lock:
+            if self.synced_seq >= target:
+                return self.synced_seq
+            with self.lock:
+                target = self.last_seq
+                self.file.flush()
+            os.fsync(self.file.fileno())
+            self.synced_seq = target
+            self.syncs += 1
+        return target
+
+    def applied(self, journal_seqs):
+        """
+        Forget records the database has committed, and compact the journal
+        once they add up to compact_bytes. Call it after the transaction that
+        marked them committed.
+
+        Args:
+            journal_seqs (list): Sequence numbers of the committed records.
+        """
+        with self.lock:
+            for seq in journal_seqs:
+                line = self.pending.pop(seq, None)
+                if line is not None:
+                    self.pending_bytes -= len(line)
+            due = self.size - self.pending_bytes >= self.compact_bytes
+        if due:
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite the journal with only the records still waiting to be
+        committed. The new file is fsync'd before it replaces the old one, so
+        a crash leaves one or the other.
+        """
+        with self.sync_lock, self.lock:
+            if self.pending:
+                temporary_path = self.path + ".tmp"
+                with open(temporary_path, "wb") as journal_file:
+                    journal_file.writelines(self.pending.values())
+                    journal_file.flush()
+                    os.fsync(journal_file.fileno())
+                # Windows cannot replace a file that is still open
+                self.file.close()
+                os.replace(temporary_path, self.path)
+                self.file = open(self.path, "ab")
+            else:
+                self.file.truncate(0)
+                os.fsync(self.file.fileno())
+            self.size = self.pending_bytes
+            # Every record still in the journal has just been written out
+            self.synced_seq = self.last_seq
+            self.compactions += 1
+
+    def was_replayed(self, phone_number, locations):
+        """
+        Check whether a message was already journaled by the previous run. A
+        crash between the journal sync and the SIM deletions leaves those
+        messages on the SIM, and they must not be stored twice.
+
+        Returns:
+            bool: True if replay() found the same message in the journal.
+        """
+        return (phone_number, tuple(tuple(fix) for fix in locations)) in self.replayed
+
+    def replay(self, db, max_batch=500):
+        """
+        Commit the records the database has not seen yet, then empty the
+        journal. Safe to run again after a crash at any point. Call it once,
+        before the first append().
+
+        Args:
+            db (GPSDatabase): Database to replay into.
+            max_batch (int): Fixes per transaction, at least one record each.
+
+        Returns:
+            int: Number of records replayed.
+
+        Raises:
+            RuntimeError: If records were appended since the journal was opened.
+        """
+        if self.appended:
+            raise RuntimeError("IngestJournal.replay() must run before append()")
+        applied_seq, applied_after = db.get_journal_applied()
+        pending = [
+            record for record in self.records
+            if record["seq"] > applied_seq and record["seq"] not in applied_after
+        ]
+        for record in self.records:
+            self.replayed.add((record["phone"], tuple(tuple(fix) for fix in record["locations"])))
+
+        # Consecutive records of the same date share a transaction
+        batch = []
+        batch_seqs = []
+        for number, record in enumerate(pending):
+            batch.extend((record["phone"], time_value, lat, lon) for lat, lon, time_value in record["locations"])
+            batch_seqs.append(record["seq"])
+            following = pending[number + 1] if number + 1 < len(pending) else None
+            if following is None or following["date"] != record["date"] or len(batch) >= max_batch:
+                db.insert_coordinates_batch(batch, record["date"], journal_seqs=batch_seqs)
+                batch = []
+                batch_seqs = []
+        if pending:
+            print(f"Replayed {len(pending)} journaled messages into {db.db_name}")
+
+        with self.lock:
+            # Keep numbering after the database, in case the journal was lost
+            self.last_seq = max([self.last_seq, applied_seq, *applied_after])
+            self.file.truncate(0)
+            os.fsync(self.file.fileno())
+            self.synced_seq = self.last_seq
+            self.pending.clear()
+            self.pending_bytes = 0
+            self.size = 0
+        self.records = []
+        return len(pending)
+
+    def close(self):
+        """
+        Sync and close the journal file.
+        """
+        self.sync()
+        self.file.close()
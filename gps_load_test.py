@@ -0,0 +1,235 @@
+"""
+End-to-end load test of the SMS ingest pipeline on simulated modems.
+
+Synthetic fleet traffic is delivered to ModemSimulator instances on
+pseudo-terminals at a fixed message rate. The messages go through the real
+pipeline (ModemPool, SerialCommunication, IngestWriter, GPSDatabase), and
+every fix is timed from the moment its SMS reaches the simulated SIM until
+its database row is committed. Linux only.
+
+    python gps_load_test.py --modems 2 --vessels 20 --messages 400 --rate 50 --output load.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import tempfile
+import threading
+import time
+
+from gps_benchmark import generate_fleet, summarize
+from gps_database4 import GPSDatabase
+from gps_ingest_writer import IngestWriter
+from gps_journal import IngestJournal
+from gps_payload import encode_payload
+from modem_pool import ModemPool
+from modem_simulator import ModemSimulator
+
+
+def build_messages(vessels, messages, fixes_per_message, payload="text", seed=0):
+    """
+    Cut a synthetic fleet's track into SMS messages.
+
+    Args:
+        vessels (int): Number of vessels.
+        messages (int): Total number of messages, spread evenly over the vessels.
+        fixes_per_message (int): Fixes per message, one minute apart.
+        payload (str): "text" for "HH:MM:SS; lat,lon; ..." or "compact" for gps_payload.
+        seed (int): Random seed for the fleet.
+
+    Returns:
+        list: (vessel index, phone_number, text, [(time_value, lat, lon), ...]) in
+        arrival order, the vessels taking turns.
+    """
+    rounds = math.ceil(messages / vessels)
+    fixes_per_vessel = rounds * fixes_per_message
+    if fixes_per_vessel > 1440:
+        raise ValueError("More than one day of fixes per vessel; lower --messages or --fixes-per-message")
+
+    tracks = {}
+    for phone_number, time_value, lat, lon in generate_fleet(vessels, 1, fixes_per_vessel, seed)[0][1]:
+        tracks.setdefault(phone_number, []).append((time_value, lat, lon))
+
+    result = []
+    for round_index in range(rounds):
+        for vessel, (phone_number, track) in enumerate(tracks.items()):
+            if len(result) == messages:
+                return result
+            fixes = track[round_index * fixes_per_message:(round_index + 1) * fixes_per_message]
+            if payload == "compact":
+                text = encode_payload([(lat, lon, time_value) for time_value, lat, lon in fixes])
+            else:
+                text = fixes[0][0] + "".join(f"; {lat},{lon}" for _, lat, lon in fixes)
+            result.append((vessel, phone_number, text, fixes))
+    return result
+
+
+def run(modems=2, vessels=20, messages=400, fixes_per_message=8, rate=50.0, payload="text",
+        pdu_mode=False, capacity=50, seed=0, timeout=120, directory=None, simulator_options=None,
+        journal=False):
+    """
+    Run one load test.
+
+    Args:
+        modems (int): Number of simulated modems; each vessel always uses the same one.
+        vessels (int): Number of vessels.
+        messages (int): Total number of messages.
+        fixes_per_message (int): Fixes per message.
+        rate (float): Messages per second offered to the modems; 0 delivers them all at once.
+        payload (str): "text" or "compact".
+        pdu_mode (bool): Read the modems in PDU mode.
+        capacity (int): SIM slots per modem.
+        seed (int): Random seed for the fleet.
+        timeout (float): Seconds to wait for the last fix to be committed.
+        directory (str): Where to put the database. Defaults to a temporary directory.
+        simulator_options (dict): Extra ModemSimulator arguments, such as command latencies.
+        journal (bool): Write every message to an IngestJournal before it is deleted.
+
+    Returns:
+        dict: Machine-readable results.
+    """
+    traffic = build_messages(vessels, messages, fixes_per_message, payload, seed)
+    total_fixes = sum(len(fixes) for _, _, _, fixes in traffic)
+    arrivals = {}
+    latencies = []
+    committed = [0]
+    last_commit = [None]
+    done = threading.Event()
+
+    def on_commit(fixes, phone_number_ids):
+        now = time.perf_counter()
+        for phone_number, time_value, _, _ in fixes:
+            arrived = arrivals.get((phone_number, time_value))
+            if arrived is not None:
+                latencies.append(now - arrived)
+        committed[0] += len(fixes)
+        last_commit[0] = now
+        if committed[0] >= total_fixes:
+            done.set()
+
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        db = GPSDatabase(os.path.join(workdir, "load.db"))
+        ingest_journal = IngestJournal(os.path.join(workdir, "load.journal")) if journal else None
+        writer = IngestWriter(db, on_commit=on_commit, journal=ingest_journal).start()
+
+        def store(phone_number, locations, journal_seq=None):
+            fixes = [(phone_number, time_value, lat, lon) for lat, lon, time_value in locations]
+            writer.submit_many(fixes, journal_seq)
+
+        simulators = [ModemSimulator(capacity, **(simulator_options or {})).start() for _ in range(modems)]
+        pool = ModemPool(store, pdu_mode=pdu_mode, journal=ingest_journal)
+        for simulator in simulators:
+            pool.add_port(simulator.port)
+        # Let the connect-time drain finish before the clock starts
+        time.sleep(0.5)
+
+        start = time.perf_counter()
+        for number, (vessel, phone_number, text, fixes) in enumerate(traffic):
+            if rate:
+                delay = start + number / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            arrived = time.perf_counter()
+            for time_value, _, _ in fixes:
+                arrivals[(phone_number, time_value)] = arrived
+            simulators[vessel % modems].deliver(phone_number, text)
+        offered_seconds = time.perf_counter() - start
+
+        finished = done.wait(timeout)
+        # The last drain may still be deleting messages; stopping the readers waits for it
+        port_stats = pool.close()
+        writer.close()
+        stored_rows = db.cursor.execute("SELECT COUNT(*) FROM coordinates").fetchone()[0]
+        journal_stats = None
+        if ingest_journal:
+            journal_stats = {
+                "records": ingest_journal.appended,
+                "syncs": ingest_journal.syncs,
+                "compactions": ingest_journal.compactions,
+                "committed_seq": db.get_journal_seq(),
+            }
+            ingest_journal.close()
+        db.close()
+        for simulator in simulators:
+            simulator.stop()
+
+    elapsed = (last_commit[0] or time.perf_counter()) - start
+    return {
+        "config": {
+            "modems": modems,
+            "vessels": vessels,
+            "messages": len(traffic),
+            "fixes_per_message": fixes_per_message,
+            "rate": rate,
+            "payload": payload,
+            "pdu_mode": pdu_mode,
+            "capacity": capacity,
+            "seed": seed,
+            "journal": journal,
+            "simulator_options": simulator_options or {},
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "completed": finished,
+        "fixes": total_fixes,
+        "committed_fixes": committed[0],
+        "stored_rows": stored_rows,
+        "offered_seconds": offered_seconds,
+        "seconds": elapsed,
+        "messages_per_second": len(traffic) / elapsed if elapsed else None,
+        "fixes_per_second": committed[0] / elapsed if elapsed else None,
+        "latency": summarize(latencies),
+        "batches": writer.committed_batches,
+        "journal": journal_stats,
+        "ports": {
+            port: {key: value for key, value in stats.items() if key != "last_message_at"}
+            for port, stats in port_stats.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the SMS ingest pipeline on simulated modems.")
+    parser.add_argument("--modems", type=int, default=2)
+    parser.add_argument("--vessels", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--fixes-per-message", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=50.0, help="Messages per second; 0 for a burst")
+    parser.add_argument("--payload", choices=("text", "compact"), default="text")
+    parser.add_argument("--pdu", action="store_true", help="Read the modems in PDU mode")
+    parser.add_argument("--journal", action="store_true", help="Journal messages before deleting them")
+    parser.add_argument("--capacity", type=int, default=50, help="SIM slots per modem")
+    parser.add_argument("--command-delay", type=float, default=0.01, help="Seconds per AT command")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--tmpdir", default=None, help="Directory for the temporary database")
+    parser.add_argument("--output", default="gps_load_test_results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    results = run(
+        args.modems, args.vessels, args.messages, args.fixes_per_message, args.rate, args.payload,
+        args.pdu, args.capacity, args.seed, args.timeout, args.tmpdir,
+        {"command_delay": args.command_delay}, args.journal,
+    )
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    latency = results["latency"]
+    print(f"Completed: {results['completed']} ({results['committed_fixes']}/{results['fixes']} fixes, "
+          f"{results['stored_rows']} rows)")
+    print(f"Throughput: {results['messages_per_second']:.1f} messages/s, {results['fixes_per_second']:.0f} fixes/s")
+    if latency.get("count"):
+        print(f"Arrival to row: median {latency['median_ms']:.0f} ms, p95 {latency['p95_ms']:.0f} ms, "
+              f"max {latency['max_ms']:.0f} ms")
+    if results["journal"]:
+        print(f"Journal: {results['journal']['records']} records, {results['journal']['syncs']} fsyncs")
+    for port, stats in results["ports"].items():
+        print(f"{port}: {stats['messages']} SMS in {stats['drains']} drains, {stats['errors']} errors")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Compact SMS payload for GPS fixes.
+
+The plain text format ("HH:MM:SS; lat,lon; lat,lon; ...") takes about 20
+characters per fix. The compact format stores fixed-point coordinates as
+deltas from the previous fix and each fix's time as its deviation from a
+regular interval, as variable-length numbers written with a 64-character
+alphabet that is in the GSM 7-bit default character set:
+
+    #1 <precision> <base time> <interval> <lat> <lon> {<dlat> <dlon> <dt>}...
+
+"#1" is the format marker and version; a "#" followed by any other digit is
+a version this code does not know, and is rejected rather than read as plain
+text. Every other field is a number, and the signed ones (coordinates,
+deltas, time deviations) are zigzag encoded.
+Each character carries 5 bits of the number plus a continuation bit, so a
+vessel moving a few hundred metres per minute costs about 5 characters per
+fix, and a 160-character SMS holds around 28 fixes.
+"""
+from gps_database4 import format_time, parse_time
+
+
+COMPACT_MARKER = "#1"
+VERSION_DIGITS = "0123456789"
+
+# 64 symbols from the GSM 7-bit default alphabet that need no escape sequence
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-."
+ALPHABET_VALUES = {symbol: value for value, symbol in enumerate(ALPHABET)}
+
+DEFAULT_PRECISION = 5  # decimal places, about 1 m
+DEFAULT_INTERVAL = 60  # seconds between fixes
+# Limits on the header fields, which come from the network: 10 ** precision
+# of an unchecked payload can take any amount of time and memory
+MAX_PRECISION = 9
+MAX_INTERVAL = 86400
+SMS_LENGTH = 160
+
+
+class PayloadError(ValueError):
+    """Raised when a compact payload is malformed."""
+
+
+def is_compact(message):
+    """
+    Returns:
+        bool: True if the message uses the compact format, of any version.
+    """
+    message = message.strip()
+    return len(message) >= 2 and message[0] == "#" and message[1] in VERSION_DIGITS
+
+
+def zigzag(value):
+    # 0, -1, 1, -2, 2 ... -> 0, 1, 2, 3, 4 ...
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value):
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def encode_number(value, out):
+    """
+    Append a non-negative integer to out as alphabet symbols, 5 bits per symbol,
+    least significant group first; bit 6 of a symbol means more follow.
+    """
+    while True:
+        group = value & 31
+        value >>= 5
+        if value:
+            out.append(ALPHABET[group | 32])
+        else:
+            out.append(ALPHABET[group])
+            return
+
+
+def decode_numbers(text):
+    """
+    Decode a run of encode_number output.
+
+    Args:
+        text (str): Alphabet symbols.
+
+    Returns:
+        list: The decoded non-negative integers.
+
+    Raises:
+        PayloadError: On a symbol outside the alphabet or a truncated number.
+    """
+    numbers = []
+    value = 0
+    shift = 0
+    for symbol in text:
+        try:
+            digit = ALPHABET_VALUES[symbol]
+        except KeyError:
+            raise PayloadError(f"Invalid character {symbol!r} in compact payload")
+        value |= (digit & 31) << shift
+        shift += 5
+        if not digit & 32:
+            numbers.append(value)
+            value = 0
+            shift = 0
+    if shift:
+        raise PayloadError("Compact payload ends in the middle of a number")
+    return numbers
+
+
+def _seconds(time_value):
+    return time_value if isinstance(time_value, int) else parse_time(time_value)
+
+
+def encode_payload(fixes, precision=DEFAULT_PRECISION, interval=DEFAULT_INTERVAL):
+    """
+    Encode fixes into one compact payload.
+
+    Args:
+        fixes (list): (lat, lon, time_value) tuples in the order they were taken,
+            where time_value is "HH:MM:SS" or seconds since midnight.
+        precision (int): Decimal places kept for the coordinates.
+        interval (int): Expected seconds between fixes; fixes taken exactly this
+            far apart cost one character for their time.
+
+    Returns:
+        str: The payload.
+
+    Raises:
+        ValueError: If there are no fixes, or precision or interval is out of range.
+    """
+    if not fixes:
+        raise ValueError("No fixes to encode")
+    if not 0 <= precision <= MAX_PRECISION:
+        raise ValueError(f"Precision must be between 0 and {MAX_PRECISION}")
+    if not 0 <= interval <= MAX_INTERVAL:
+        raise ValueError(f"Interval must be between 0 and {MAX_INTERVAL} seconds")
+    scale = 10 ** precision
+    out = [COMPACT_MARKER]
+    first_seconds = _seconds(fixes[0][2])
+    for number in (precision, first_seconds, interval):
+        encode_number(number, out)
+
+    previous_lat = previous_lon = 0
+    previous_seconds = first_seconds - interval
+    for lat, lon, time_value in fixes:
+        fixed_lat = round(lat * scale)
+        fixed_lon = round(lon * scale)
+        seconds = _seconds(time_value)
+        # The first fix is stored as a delta from zero, which is its absolute position
+        encode_number(zigzag(fixed_lat - previous_lat), out)
+        encode_number(zigzag(fixed_lon - previous_lon), out)
+        # Times wrap at midnight, so keep the deviation within half a day
+        deviation = (seconds - previous_seconds - interval + 43200) % 86400 - 43200
+        encode_number(zigzag(deviation), out)
+        previous_lat, previous_lon, previous_seconds = fixed_lat, fixed_lon, seconds
+    return "".join(out)
+
+
+def encode_messages(fixes, max_length=SMS_LENGTH, precision=DEFAULT_PRECISION, interval=DEFAULT_INTERVAL):
+    """
+    Split fixes into as few compact payloads as fit in max_length characters each.
+
+    Args:
+        fixes (list): (lat, lon, time_value) tuples, as for encode_payload.
+        max_length (int): Maximum payload length, 160 for a single SMS.
+        precision (int): Decimal places kept for the coordinates.
+        interval (int): Expected seconds between fixes.
+
+    Returns:
+        list: The payloads, in order.
+    """
+    payloads = []
+    start = 0
+    while start < len(fixes):
+        # Grow the message until the next fix no longer fits
+        end = start + 1
+        payload = encode_payload(fixes[start:end], precision, interval)
+        if len(payload) > max_length:
+            raise ValueError(f"A single fix does not fit in {max_length} characters")
+        while end < len(fixes):
+            candidate = encode_payload(fixes[start:end + 1], precision, interval)
+            if len(candidate) > max_length:
+                break
+            payload = candidate
+            end += 1
+        payloads.append(payload)
+        start = end
+    return payloads
+
+
+def decode_payload(message):
+    """
+    Decode a compact payload.
+
+    Args:
+        message (str): The payload, starting with "#1".
+
+    Returns:
+        list: (lat, lon, timestamp) tuples, timestamps as "HH:MM:SS".
+
+    Raises:
+        PayloadError: If the payload is malformed or of an unknown version.
+    """
+    message = message.strip()
+    if not is_compact(message):
+        raise PayloadError("Not a compact payload")
+    decoder = DECODERS.get(message[1])
+    if decoder is None:
+        raise PayloadError(f"Unknown compact payload version {message[1]}")
+    return decoder(decode_numbers(message[2:]))
+
+
+def _decode_version_1(numbers):
+    if len(numbers) < 3 or (len(numbers) - 3) % 3:
+        raise PayloadError(f"Compact payload has {len(numbers)} fields")
+
+    precision, seconds, interval = numbers[:3]
+    if precision > MAX_PRECISION:
+        raise PayloadError(f"Compact payload precision {precision} is out of range")
+    if interval > MAX_INTERVAL:
+        raise PayloadError(f"Compact payload interval {interval} is out of range")
+    scale = 10 ** precision
+    seconds -= interval
+    lat = lon = 0
+    fixes = []
+    for index in range(3, len(numbers), 3):
+        lat += unzigzag(numbers[index])
+        lon += unzigzag(numbers[index + 1])
+        seconds += interval + unzigzag(numbers[index + 2])
+        fixes.append((round(lat / scale, precision), round(lon / scale, precision), format_time(seconds)))
+    return fixes
+
+
+# Decoder of each payload version, by the digit after the "#"
+DECODERS = {"1": _decode_version_1}
@@ -12,6 +12,7 @@ import os
 import folium
 from gps_database4 import GPSDatabase
 from serial_comm_handler5t import SerialCommunication
+from tile_store import TileServer, open_tile_store
 
 class GPSMapApp(QMainWindow):
     def __init__(self):
@@ -26,6 +27,9 @@ class GPSMapApp(QMainWindow):
         self.serial_comm = None
         self.map_view = None
         self.map_file = "map.html"
+        # Tiles from the imported tile packs, served to the web view on 127.0.0.1
+        self.tile_store = open_tile_store()
+        self.tile_server = TileServer(self.tile_store).start() if self.tile_store else None
 
         self.init_ui()
 
@@ -210,14 +214,30 @@ class GPSMapApp(QMainWindow):
             else:
                 QMessageBox.warning(self, "Insufficient Data", "At least two points are required to calculate distance.")
 
+    def create_folium_map(self, location):
+        if self.tile_server is None:
+            return folium.Map(location=location, zoom_start=15)
+        folium_map = folium.Map(
+            location=location,
+            zoom_start=min(15, self.tile_store.max_zoom),
+            tiles=self.tile_server.url_template,
+            attr=self.tile_server.attribution,
+            min_zoom=self.tile_store.min_zoom,
+            max_zoom=self.tile_store.max_zoom,
+        )
+        # Leaflet and its plugins from map_assets/ where a copy was saved there
+        folium_map.default_js = [(name, self.tile_server.asset_url(url)) for name, url in folium_map.default_js]
+        folium_map.default_css = [(name, self.tile_server.asset_url(url)) for name, url in folium_map.default_css]
+        return folium_map
+
     def init_map(self):
-        folium_map = folium.Map(location=[17.4444, 78.3555], zoom_start=15)
+        folium_map = self.create_folium_map([17.4444, 78.3555])
         folium_map.save(self.map_file)
         self.map_view.setUrl(QUrl.fromLocalFile(os.path.abspath(self.map_file)))
 
     def update_map(self, coordinates):
         initial_location = (coordinates[0][0], coordinates[0][1])
-        folium_map = folium.Map(location=initial_location, zoom_start=15)
+        folium_map = self.create_folium_map(initial_location)
 
         for i, (lat, lon, timestamp) in enumerate(coordinates):
             if i == 0:
@@ -0,0 +1,462 @@
+"""
+Layers drawn on a TkinterMapView map widget.
+
+TkinterMapView draws a path as one canvas line and reprojects every vertex of
+it whenever the path changes, so a track that grows by one fix at a time
+costs O(n) per fix and O(n^2) over a day. The layers here keep that cost
+bounded, by splitting what they draw into small pieces and only touching the
+pieces that changed, or by drawing only the vertices visible at the current
+zoom level.
+"""
+import math
+import tkinter
+
+from tkintermapview.canvas_path import CanvasPath
+from tkintermapview.utility_functions import decimal_to_osm
+
+from gps_database4 import distance_km, parse_time
+
+
+TRACK_SEGMENT_SIZE = 64  # vertices per CanvasPath segment
+TRACK_COLOR = "#3E69CB"  # TkinterMapView's default path colour
+TRACK_WIDTH = 9
+
+ROUTE_TOLERANCE_PIXELS = 1.0  # how far the simplified route may stray from the fixes
+STOP_RADIUS_KM = 0.1
+STOP_MIN_SECONDS = 600
+
+CLUSTER_CELL_PIXELS = 60  # fixes closer than this on screen share a cluster marker
+CLUSTER_MAX_ZOOM = 16  # zoomed in further, every fix in view gets its own marker
+CLUSTER_COLOR = "#006b65"
+VIEWPORT_MARGIN = 0.25  # fraction of the view also rendered on each side, for panning
+VIEWPORT_POLL_MS = 100
+
+
+class TrackLayer:
+    """
+    A vessel's track, drawn as a chain of CanvasPath segments of at most
+    segment_size vertices. Each segment starts at the last vertex of the one
+    before it, so the chain looks like one line. New fixes are appended to
+    the last segment and only that segment is redrawn, which makes the cost
+    of a new fix constant however long the track already is. A full segment
+    is never touched again until the map is panned or zoomed.
+    """
+
+    def __init__(self, map_widget, segment_size=TRACK_SEGMENT_SIZE, color=TRACK_COLOR, width=TRACK_WIDTH):
+        """
+        Args:
+            map_widget (TkinterMapView): Map to draw on.
+            segment_size (int): Most vertices per segment, at least 2.
+            color (str): Line colour.
+            width (int): Line width in pixels.
+        """
+        if segment_size < 2:
+            raise ValueError("segment_size must be at least 2")
+        self.map_widget = map_widget
+        self.segment_size = segment_size
+        self.color = color
+        self.width = width
+        self.segments = []
+        self.last_position = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def positions(self):
+        """
+        Returns:
+            list: Every (lat, lon) vertex of the track, in order.
+        """
+        if not self.segments:
+            return [self.last_position] if self.last_position else []
+        result = list(self.segments[0].position_list)
+        for segment in self.segments[1:]:
+            result.extend(segment.position_list[1:])
+        return result
+
+    def append(self, lat, lon):
+        """
+        Add one vertex to the end of the track.
+        """
+        self.extend([(lat, lon)])
+
+    def extend(self, points):
+        """
+        Add vertices to the end of the track and redraw the segments they
+        landed in, each once.
+
+        Args:
+            points (list): (lat, lon) tuples, in order.
+        """
+        changed = []
+        for lat, lon in points:
+            position = (lat, lon)
+            if self.last_position is not None:
+                segment = self.segments[-1] if self.segments else None
+                if segment is None or len(segment.position_list) >= self.segment_size:
+                    # set_path draws the new two-vertex segment right away
+                    segment = self.map_widget.set_path(
+                        [self.last_position, position], color=self.color, width=self.width
+                    )
+                    self.segments.append(segment)
+                else:
+                    segment.position_list.append(position)
+                    if not changed or changed[-1] is not segment:
+                        changed.append(segment)
+            self.last_position = position
+            self.count += 1
+
+        for segment in changed:
+            segment.draw()
+
+    def clear(self):
+        """
+        Remove the track from the map.
+        """
+        for segment in self.segments:
+            segment.delete()
+        self.segments = []
+        self.last_position = None
+        self.count = 0
+
+
+def douglas_peucker_ranks(points):
+    """
+    Rank points by how much they matter to the shape of a line, so the line
+    can be simplified to any tolerance without running Douglas-Peucker again.
+
+    Args:
+        points (list): (x, y) tuples in a projected, equal-unit space.
+
+    Returns:
+        list: One value per point. Douglas-Peucker with tolerance t keeps
+        exactly the points whose value is greater than t; the first and last
+        points are always kept.
+    """
+    count = len(points)
+    ranks = [0.0] * count
+    if count == 0:
+        return ranks
+    ranks[0] = ranks[-1] = math.inf
+    # (first, last, rank of the split that produced this span)
+    stack = [(0, count - 1, math.inf)]
+    while stack:
+        first, last, parent_rank = stack.pop()
+        if last - first < 2:
+            continue
+        x1, y1 = points[first]
+        dx = points[last][0] - x1
+        dy = points[last][1] - y1
+        length2 = dx * dx + dy * dy
+        farthest = None
+        farthest_distance2 = -1.0
+        for index in range(first + 1, last):
+            x, y = points[index]
+            # Distance to the segment, not the infinite line, so a track that
+            # doubles back is kept
+            t = ((x - x1) * dx + (y - y1) * dy) / length2 if length2 else 0.0
+            t = min(1.0, max(0.0, t))
+            distance2 = (x - x1 - t * dx) ** 2 + (y - y1 - t * dy) ** 2
+            if distance2 > farthest_distance2:
+                farthest, farthest_distance2 = index, distance2
+        # A point is only reached if its parent split was kept at the same tolerance
+        rank = min(math.sqrt(farthest_distance2), parent_rank)
+        ranks[farthest] = rank
+        stack.append((first, farthest, rank))
+        stack.append((farthest, last, rank))
+    return ranks
+
+
+def find_stops(fixes, radius_km=STOP_RADIUS_KM, min_seconds=STOP_MIN_SECONDS):
+    """
+    Find where a vessel stayed put.
+
+    Args:
+        fixes (list): (lat, lon, time_value) tuples in time order.
+        radius_km (float): How far from the first fix of a stop the vessel may drift.
+        min_seconds (int): Shortest stay that counts as a stop.
+
+    Returns:
+        list: (lat, lon, start time, end time) per stop, at the stop's mean position.
+    """
+    stops = []
+    start = 0
+    while start < len(fixes):
+        lat, lon, start_time = fixes[start]
+        end = start
+        while end + 1 < len(fixes) and distance_km(lat, lon, fixes[end + 1][0], fixes[end + 1][1]) <= radius_km:
+            end += 1
+        end_time = fixes[end][2]
+        if (parse_time(end_time) - parse_time(start_time)) % 86400 >= min_seconds:
+            run = fixes[start:end + 1]
+            stops.append((
+                sum(fix[0] for fix in run) / len(run),
+                sum(fix[1] for fix in run) / len(run),
+                start_time,
+                end_time,
+            ))
+            start = end + 1
+        else:
+            start += 1
+    return stops
+
+
+class SimplifiedPath(CanvasPath):
+    """
+    A CanvasPath that shows only the vertices that matter at the current zoom
+    level. TkinterMapView redraws every path after a zoom, and that redraw
+    picks the vertices for the new level.
+    """
+
+    def __init__(self, map_widget, positions, tolerance_pixels=ROUTE_TOLERANCE_PIXELS, **kwargs):
+        """
+        Args:
+            map_widget (TkinterMapView): Map to draw on.
+            positions (list): Every (lat, lon) vertex of the line.
+            tolerance_pixels (float): Largest on-screen deviation from the full line.
+            **kwargs: CanvasPath options such as color and width.
+        """
+        super().__init__(map_widget, [], **kwargs)
+        self.positions = positions
+        self.tolerance_pixels = tolerance_pixels
+        # Zoom 0 tile coordinates, where the whole world is one unit wide
+        self.ranks = douglas_peucker_ranks([decimal_to_osm(lat, lon, 0) for lat, lon in positions])
+        self.level = None
+
+    def draw(self, move=False):
+        level = round(self.map_widget.zoom)
+        if level != self.level:
+            self.level = level
+            tolerance = self.tolerance_pixels / (self.map_widget.tile_size * 2 ** level)
+            self.position_list = [
+                position for position, rank in zip(self.positions, self.ranks) if rank > tolerance
+            ]
+            move = False
+        super().draw(move)
+
+
+class RouteLayer:
+    """
+    A stored day's route, drawn at once: one SimplifiedPath and markers only
+    at the start, the end and the stops.
+    """
+
+    def __init__(self, map_widget, color=TRACK_COLOR, width=TRACK_WIDTH):
+        """
+        Args:
+            map_widget (TkinterMapView): Map to draw on.
+            color (str): Line colour.
+            width (int): Line width in pixels.
+        """
+        self.map_widget = map_widget
+        self.color = color
+        self.width = width
+        self.path = None
+        self.markers = []
+        self.positions = []
+
+    def show(self, fixes):
+        """
+        Replace the route on the map and fit the map to it.
+
+        Args:
+            fixes (list): (lat, lon, time_value) tuples in time order.
+        """
+        self.clear()
+        if not fixes:
+            return
+        self.positions = [(lat, lon) for lat, lon, _ in fixes]
+
+        if len(self.positions) >= 2:
+            self.path = SimplifiedPath(self.map_widget, self.positions, color=self.color, width=self.width)
+            self.path.draw()
+            self.map_widget.canvas_path_list.append(self.path)
+
+        for lat, lon, start_time, end_time in find_stops(fixes):
+            self.markers.append(self.map_widget.set_marker(lat, lon, text=f"Stop {start_time}-{end_time}"))
+        start_lat, start_lon, start_time = fixes[0]
+        self.markers.append(self.map_widget.set_marker(start_lat, start_lon, text=f"Start {start_time}"))
+        if len(fixes) > 1:
+            end_lat, end_lon, end_time = fixes[-1]
+            self.markers.append(self.map_widget.set_marker(end_lat, end_lon, text=f"End {end_time}"))
+
+        lats = [lat for lat, _ in self.positions]
+        lons = [lon for _, lon in self.positions]
+        if max(lats) > min(lats) and max(lons) > min(lons):
+            self.map_widget.fit_bounding_box((max(lats), min(lons)), (min(lats), max(lons)))
+        else:
+            self.map_widget.set_position(start_lat, start_lon)
+            self.map_widget.set_zoom(15)
+
+    def clear(self):
+        """
+        Remove the route and its markers from the map.
+        """
+        if self.path:
+            self.path.delete()
+            self.path = None
+        for marker in self.markers:
+            marker.delete()
+        self.markers = []
+        self.positions = []
+
+
+class MarkerLayer:
+    """
+    Markers for many fixes, of which only those in view are on the map.
+
+    The fixes are kept in a grid per zoom level, with cells of cell_pixels
+    on screen, so the cells in view are found by direct lookup whatever the
+    number of fixes. Up to max_cluster_zoom, a cell with several fixes is
+    drawn as one cluster marker at their mean position; further in, every
+    fix in view gets its own marker. The layer follows panning and zooming
+    by checking the view every poll_interval milliseconds, and only adds or
+    removes the markers that changed.
+    """
+
+    def __init__(self, map_widget, text=None, cell_pixels=CLUSTER_CELL_PIXELS,
+                 max_cluster_zoom=CLUSTER_MAX_ZOOM, poll_interval=VIEWPORT_POLL_MS):
+        """
+        Args:
+            map_widget (TkinterMapView): Map to draw on.
+            text (str): Label of the single-fix markers.
+            cell_pixels (int): Cluster cell size on screen.
+            max_cluster_zoom (int): Highest zoom level at which fixes are clustered.
+            poll_interval (int): Milliseconds between checks of the view.
+        """
+        self.map_widget = map_widget
+        self.text = text
+        self.cell_pixels = cell_pixels
+        self.max_cluster_zoom = max_cluster_zoom
+        self.poll_interval = poll_interval
+        self.positions = []
+        # Zoom 0 tile coordinates of each fix, where the whole world is one unit wide
+        self.tile_positions = []
+        # zoom -> {cell: [count, lat sum, lon sum, fix indices]}, built when first shown
+        self.grids = {}
+        # key -> marker on the map; a key is a fix index or a cluster tuple
+        self.markers = {}
+        # (zoom, x0, y0, x1, y1) of the area the markers cover, in zoom 0 tile units
+        self.rendered = None
+        self.poll_job = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def extend(self, points):
+        """
+        Add fixes and update the markers in view.
+
+        Args:
+            points (list): (lat, lon) tuples.
+        """
+        for lat, lon in points:
+            index = len(self.positions)
+            self.positions.append((lat, lon))
+            self.tile_positions.append(decimal_to_osm(lat, lon, 0))
+            for zoom, grid in self.grids.items():
+                self._add_to_grid(grid, zoom, index)
+        self.refresh(force=True)
+        if self.poll_job is None:
+            self.poll_job = self.map_widget.after(self.poll_interval, self._poll)
+
+    def clear(self):
+        """
+        Remove every fix and marker.
+        """
+        for marker in self.markers.values():
+            marker.delete()
+        self.markers = {}
+        self.positions = []
+        self.tile_positions = []
+        self.grids = {}
+        self.rendered = None
+        if self.poll_job is not None:
+            self.map_widget.after_cancel(self.poll_job)
+            self.poll_job = None
+
+    def _cell_size(self, zoom):
+        return self.cell_pixels / (self.map_widget.tile_size * 2 ** zoom)
+
+    def _add_to_grid(self, grid, zoom, index):
+        size = self._cell_size(zoom)
+        x, y = self.tile_positions[index]
+        lat, lon = self.positions[index]
+        cell = grid.setdefault((int(x // size), int(y // size)), [0, 0.0, 0.0, []])
+        cell[0] += 1
+        cell[1] += lat
+        cell[2] += lon
+        cell[3].append(index)
+
+    def _grid(self, zoom):
+        grid = self.grids.get(zoom)
+        if grid is None:
+            grid = self.grids[zoom] = {}
+            for index in range(len(self.positions)):
+                self._add_to_grid(grid, zoom, index)
+        return grid
+
+    def refresh(self, force=False):
+        """
+        Bring the markers in line with the current view. Does nothing if the
+        view is still inside the area rendered last time, unless forced.
+
+        Args:
+            force (bool): Render even if the view has not changed.
+        """
+        zoom = round(self.map_widget.zoom)
+        scale = 2 ** zoom
+        x0 = self.map_widget.upper_left_tile_pos[0] / scale
+        y0 = self.map_widget.upper_left_tile_pos[1] / scale
+        x1 = self.map_widget.lower_right_tile_pos[0] / scale
+        y1 = self.map_widget.lower_right_tile_pos[1] / scale
+        if not force and self.rendered and self.rendered[0] == zoom:
+            _, rx0, ry0, rx1, ry1 = self.rendered
+            if rx0 <= x0 and ry0 <= y0 and x1 <= rx1 and y1 <= ry1:
+                return
+        margin_x = (x1 - x0) * VIEWPORT_MARGIN
+        margin_y = (y1 - y0) * VIEWPORT_MARGIN
+        x0, y0, x1, y1 = x0 - margin_x, y0 - margin_y, x1 + margin_x, y1 + margin_y
+
+        level = min(zoom, self.max_cluster_zoom)
+        grid = self._grid(level)
+        size = self._cell_size(level)
+        wanted = {}
+        for cell_x in range(int(x0 // size), int(x1 // size) + 1):
+            for cell_y in range(int(y0 // size), int(y1 // size) + 1):
+                cell = grid.get((cell_x, cell_y))
+                if cell is None:
+                    continue
+                count, lat_sum, lon_sum, indices = cell
+                if count > 1 and zoom <= self.max_cluster_zoom:
+                    # The count is part of the key, so a cluster that grows is redrawn
+                    wanted[(level, cell_x, cell_y, count)] = (lat_sum / count, lon_sum / count)
+                    continue
+                for index in indices:
+                    x, y = self.tile_positions[index]
+                    if x0 <= x <= x1 and y0 <= y <= y1:
+                        wanted[index] = self.positions[index]
+
+        for key in [key for key in self.markers if key not in wanted]:
+            self.markers.pop(key).delete()
+        for key, (lat, lon) in wanted.items():
+            if key in self.markers:
+                continue
+            if isinstance(key, tuple):
+                self.markers[key] = self.map_widget.set_marker(
+                    lat, lon, text=f"{key[3]} fixes",
+                    marker_color_circle="white", marker_color_outside=CLUSTER_COLOR,
+                )
+            else:
+                self.markers[key] = self.map_widget.set_marker(lat, lon, text=self.text)
+        self.rendered = (zoom, x0, y0, x1, y1)
+
+    def _poll(self):
+        try:
+            self.refresh()
+        except tkinter.TclError:
+            # The map widget was destroyed
+            self.poll_job = None
+            return
+        self.poll_job = self.map_widget.after(self.poll_interval, self._poll)
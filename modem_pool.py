@@ -0,0 +1,225 @@
+import threading
+import time
+
+from serial_comm_handler5t import SerialCommunication
+from serial_reader import SerialReader
+
+
+class ModemPort:
+    """
+    One modem in a ModemPool: its connection, its reader thread and its
+    statistics. The counters are only written by the port's own reader thread.
+    """
+
+    def __init__(self, port, serial_comm, reader):
+        """
+        Args:
+            port (str): Serial port name, for example "COM3" or "/dev/ttyUSB0".
+            serial_comm (SerialCommunication): Connected modem.
+            reader (SerialReader): Reader thread for the modem.
+        """
+        self.port = port
+        self.serial_comm = serial_comm
+        self.reader = reader
+        self.connected_at = time.time()
+        self.healthy = True
+        self.messages = 0
+        self.fixes = 0
+        self.drains = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_message_at = None
+
+    def stats(self):
+        """
+        Returns:
+            dict: Health and throughput of the port.
+        """
+        minutes = max(time.time() - self.connected_at, 1) / 60
+        return {
+            "port": self.port,
+            "healthy": self.healthy,
+            "messages": self.messages,
+            "fixes": self.fixes,
+            "drains": self.drains,
+            "errors": self.errors,
+            "last_error": str(self.last_error) if self.last_error else None,
+            "last_message_at": self.last_message_at,
+            "messages_per_minute": self.messages / minutes,
+            "fixes_per_minute": self.fixes / minutes,
+        }
+
+
+class ModemPool:
+    """
+    Several GSM modems received in parallel, each on its own SerialReader
+    thread, all handing their fixes to one shared store callback.
+
+    A modem that fails or is unplugged is marked unhealthy and closed; the
+    other ports keep running. Its statistics stay available until the port is
+    removed or connected again.
+
+    With a journal, every message is appended to it before it is handed to
+    store, and the journal is synced before the messages are deleted from the
+    SIM, so a crash cannot lose a message that has left the modem.
+    """
+
+    def __init__(self, store, on_port_error=None, pdu_mode=False, journal=None):
+        """
+        Args:
+            store (callable): Called with (phone_number, locations) for every
+                received message, from the reader thread of the port that
+                received it. It must be thread-safe, for example queue.Queue.put
+                or IngestWriter.submit. With a journal it is called with
+                (phone_number, locations, journal_seq), in journal order.
+            on_port_error (callable): Optional callback called from the failing
+                port's reader thread with (port, error).
+            pdu_mode (bool): Read messages as PDUs, to reassemble concatenated messages.
+            journal (IngestJournal): Optional journal, already replayed.
+        """
+        self.store = store
+        self.on_port_error = on_port_error
+        self.pdu_mode = pdu_mode
+        self.journal = journal
+        self.modems = {}
+        self.lock = threading.Lock()
+        # Keeps journal order and store order the same across reader threads
+        self.journal_lock = threading.Lock()
+
+    def add_port(self, port):
+        """
+        Connect a modem, drain the messages already on its SIM and start
+        listening for new ones.
+
+        Args:
+            port (str): Serial port name.
+
+        Returns:
+            ModemPort: The connected port.
+
+        Raises:
+            ValueError: If the port is already connected and healthy.
+            serial.SerialException: If the port cannot be opened.
+        """
+        with self.lock:
+            existing = self.modems.get(port)
+            if existing is not None and existing.healthy:
+                raise ValueError(f"{port} is already connected")
+
+        serial_comm = SerialCommunication(port, self.pdu_mode)
+        try:
+            serial_comm.configure_for_sms()
+        except Exception:
+            serial_comm.serial_port.close()
+            raise
+
+        modem = ModemPort(port, serial_comm, SerialReader(serial_comm))
+        # One drain lists every unread message, however many +CMTI are queued
+        modem.reader.on_urc("+CMTI", lambda line: self._drain(modem, "REC UNREAD"), coalesce=True)
+        modem.reader.on_error = lambda error: self._port_failed(modem, error)
+        with self.lock:
+            self.modems[port] = modem
+        modem.reader.start()
+        # Pick up anything that arrived while disconnected, read or not
+        modem.reader.call_soon(self._drain, modem, "ALL")
+        return modem
+
+    def remove_port(self, port, timeout=2):
+        """
+        Stop and close one modem. The other ports are not affected.
+
+        Args:
+            port (str): Serial port name.
+            timeout (float): Maximum number of seconds to wait for its reader thread.
+
+        Returns:
+            bool: True if the port was in the pool.
+        """
+        with self.lock:
+            modem = self.modems.pop(port, None)
+        if modem is None:
+            return False
+        modem.reader.stop(timeout)
+        modem.serial_comm.serial_port.close()
+        return True
+
+    def ports(self):
+        """
+        Returns:
+            list: Names of the ports in the pool, healthy or not.
+        """
+        with self.lock:
+            return sorted(self.modems)
+
+    def healthy_ports(self):
+        """
+        Returns:
+            list: Names of the ports that are connected and working.
+        """
+        with self.lock:
+            return sorted(port for port, modem in self.modems.items() if modem.healthy)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Statistics of every port, by port name.
+        """
+        with self.lock:
+            modems = list(self.modems.values())
+        return {modem.port: modem.stats() for modem in modems}
+
+    def close(self, timeout=2):
+        """
+        Stop and close every modem.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for each reader thread.
+
+        Returns:
+            dict: Final statistics of every port, by port name, taken once its
+            reader thread has stopped and any drain it was running has finished.
+        """
+        with self.lock:
+            modems = list(self.modems.values())
+        for modem in modems:
+            self.remove_port(modem.port, timeout)
+        return {modem.port: modem.stats() for modem in modems}
+
+    def _drain(self, modem, status):
+        # Runs on the modem's own reader thread
+        def store(phone_number, locations):
+            if self.journal is None:
+                self.store(phone_number, locations)
+            elif self.journal.was_replayed(phone_number, locations):
+                print(f"Skipping SMS from {phone_number} already replayed from the journal")
+                return
+            else:
+                with self.journal_lock:
+                    seq = self.journal.append(phone_number, locations)
+                    self.store(phone_number, locations, seq)
+            # Counted as each message is stored, not when the drain returns
+            modem.messages += 1
+            modem.fixes += len(locations)
+            modem.last_message_at = time.time()
+
+        commit = self.journal.sync if self.journal else None
+        try:
+            modem.serial_comm.drain_sms(store, status, commit)
+            modem.drains += 1
+        except Exception as e:
+            # A serial error here also stops the reader, which reports the port as failed
+            modem.errors += 1
+            modem.last_error = e
+            print(f"Error draining SMS on {modem.port}: {e}")
+
+    def _port_failed(self, modem, error):
+        modem.healthy = False
+        modem.errors += 1
+        modem.last_error = error
+        print(f"Modem on {modem.port} failed: {error}")
+        try:
+            modem.serial_comm.serial_port.close()
+        except Exception:
+            pass
+        if self.on_port_error:
+            self.on_port_error(modem.port, error)
@@ -0,0 +1,274 @@
+"""
+Simulated GSM modem on a Linux pseudo-terminal.
+
+The simulator owns the master side of a pty; SerialCommunication, ModemPool
+or AsyncModem open the slave side (ModemSimulator.port) as if it were a USB
+modem. It implements the AT subset the project uses: AT+CNMI, AT+CMGF,
+AT+CMGR, AT+CMGL, AT+CMGD and the +CMTI notification, with configurable
+command latencies and a SIM of limited capacity.
+
+    simulator = ModemSimulator().start()
+    modem = SerialCommunication(simulator.port)
+    simulator.deliver("+919000000001", "10:00:00; 17.68,83.21")
+"""
+import os
+import pty
+import select
+import threading
+import time
+import tty
+from collections import deque
+
+from sms_pdu import PDU_STATUS, decode_deliver_pdu, encode_deliver_pdus
+
+
+TEXT_STATUS = {0: "REC UNREAD", 1: "REC READ"}
+
+
+class ModemSimulator:
+    """
+    A fake GSM modem answering AT commands on a pseudo-terminal.
+
+    Delivered messages go to the SIM and raise +CMTI once AT+CNMI has enabled
+    notifications. When the SIM is full, further messages wait in the
+    simulated network and are delivered as soon as a slot is freed, like an
+    SMSC retrying.
+
+    Like a real SIM, a slot keeps the message itself, and AT+CMGR and AT+CMGL
+    render it in the mode selected when they are answered. A long message
+    delivered in PDU mode takes one slot per concatenated part; in text mode
+    it is kept whole in one slot, and listed as one oversized PDU if the
+    client switches to PDU mode.
+    """
+
+    def __init__(self, capacity=50, command_delay=0.01, read_delay=0.02,
+                 list_delay_per_message=0.002, delete_delay=0.03):
+        """
+        Args:
+            capacity (int): Number of SIM slots.
+            command_delay (float): Seconds before answering any command.
+            read_delay (float): Extra seconds for AT+CMGR.
+            list_delay_per_message (float): Extra seconds per message listed by AT+CMGL.
+            delete_delay (float): Extra seconds for AT+CMGD.
+        """
+        self.capacity = capacity
+        self.command_delay = command_delay
+        self.read_delay = read_delay
+        self.list_delay_per_message = list_delay_per_message
+        self.delete_delay = delete_delay
+
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        # Keep the slave open so the pty survives clients closing and reopening it
+        self.slave = slave
+
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        # index -> [status, sender, text, delivered at, reference, part, parts]
+        self.sim = {}
+        self.network = deque()
+        self.echo = True
+        self.pdu_mode = False
+        self.notify = False
+        self.reference = 0
+        self.thread = None
+        self.running = False
+
+        self.commands = 0
+        self.delivered = 0
+        self.deleted = 0
+
+    def start(self):
+        """
+        Start answering commands.
+
+        Returns:
+            ModemSimulator: The simulator itself.
+        """
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="modem-simulator", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=2):
+        """
+        Stop the simulator and close the pty.
+        """
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout)
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def deliver(self, sender, text):
+        """
+        Receive a message from the network. In PDU mode a text longer than one
+        SMS arrives as concatenated parts, each taking a SIM slot.
+
+        Args:
+            sender (str): Sender phone number.
+            text (str): Message text.
+        """
+        with self.lock:
+            self.network.append((sender, text))
+            notifications = self._store_waiting()
+        self._write(notifications)
+
+    def stored(self):
+        """
+        Returns:
+            int: Number of messages (or parts) on the SIM.
+        """
+        with self.lock:
+            return len(self.sim)
+
+    def waiting(self):
+        """
+        Returns:
+            int: Messages held back by the network because the SIM is full.
+        """
+        with self.lock:
+            return len(self.network)
+
+    def _store_waiting(self):
+        # Called with the lock held; returns the +CMTI notifications to send
+        notifications = ""
+        while self.network:
+            sender, text = self.network[0]
+            reference = (self.reference + 1) % 256
+            # The network splits a long message into parts; text mode keeps it whole
+            parts = len(encode_deliver_pdus(sender, text, reference)) if self.pdu_mode else 1
+            free = [index for index in range(1, self.capacity + 1) if index not in self.sim]
+            if len(free) < parts:
+                break
+            self.network.popleft()
+            self.reference = reference
+            delivered_at = time.time()
+            for part, index in enumerate(free[:parts], 1):
+                self.sim[index] = [0, sender, text, delivered_at, reference, part, parts]
+                if self.notify:
+                    notifications += f'\r\n+CMTI: "SM",{index}\r\n'
+            self.delivered += 1
+        return notifications
+
+    def _write(self, text):
+        # Responses and notifications are written whole, never interleaved
+        if text and self.running:
+            with self.write_lock:
+                try:
+                    os.write(self.master, text.encode())
+                except OSError:
+                    pass
+
+    def _run(self):
+        buffer = b""
+        while self.running:
+            try:
+                readable, _, _ = select.select([self.master], [], [], 0.2)
+                if not readable:
+                    continue
+                buffer += os.read(self.master, 4096)
+            except OSError:
+                break
+            while b"\r" in buffer:
+                line, buffer = buffer.split(b"\r", 1)
+                command = line.decode(errors="replace").strip()
+                if command:
+                    self._write(self._answer(command))
+
+    def _answer(self, command):
+        # The reply is prepared under the lock, the modem's processing time is
+        # simulated afterwards so deliveries are not held up
+        self.commands += 1
+        reply = command + "\r\r\n" if self.echo else ""
+        upper = command.upper()
+        delay = self.command_delay
+        notifications = ""
+        with self.lock:
+            if upper in ("ATE0", "ATE1"):
+                self.echo = upper == "ATE1"
+                body = "OK"
+            elif upper.startswith("AT+CNMI="):
+                self.notify = upper.split("=")[1].split(",")[1:2] != ["0"]
+                body = "OK"
+            elif upper.startswith("AT+CMGF="):
+                self.pdu_mode = upper.endswith("=0")
+                body = "OK"
+            elif upper.startswith("AT+CMGR="):
+                delay += self.read_delay
+                body = self._read(command.split("=", 1)[1])
+            elif upper.startswith("AT+CMGL"):
+                body, listed = self._list(command.split("=", 1)[1] if "=" in command else "")
+                delay += self.list_delay_per_message * listed
+            elif upper.startswith("AT+CMGD="):
+                delay += self.delete_delay
+                body = self._delete(command.split("=", 1)[1])
+                # A freed slot lets the network deliver a waiting message
+                notifications = self._store_waiting()
+            else:
+                body = "OK"
+        time.sleep(delay)
+        return reply + "\r\n" + body + "\r\n" + notifications
+
+    def _render(self, index, slot):
+        # Header details and body of a slot in the current mode
+        status, sender, text, delivered_at, reference, part, parts = slot
+        stamp = time.strftime("%y/%m/%d,%H:%M:%S", time.localtime(delivered_at))
+        pdu = encode_deliver_pdus(sender, text, reference, stamp, split=parts > 1)[part - 1]
+        if self.pdu_mode:
+            # Length is the TPDU length, without the SMSC address
+            details, body = f"{status},,{len(pdu) // 2 - 1}", pdu
+        else:
+            details = f'"{TEXT_STATUS[status]}","{sender}","","{stamp}+22"'
+            body = decode_deliver_pdu(pdu).text if parts > 1 else text
+        return (details if index is None else f"{index},{details}"), body
+
+    def _read(self, argument):
+        try:
+            slot = self.sim[int(argument)]
+        except (ValueError, KeyError):
+            return "+CMS ERROR: 321"
+        details, body = self._render(None, slot)
+        lines = f"+CMGR: {details}\r\n{body}\r\n"
+        slot[0] = 1
+        return lines + "\r\nOK"
+
+    def _list(self, argument):
+        argument = argument.strip().strip('"').upper()
+        if self.pdu_mode:
+            statuses = {PDU_STATUS["REC UNREAD"]: (0,), PDU_STATUS["REC READ"]: (1,), PDU_STATUS["ALL"]: (0, 1)}
+            try:
+                wanted = statuses.get(int(argument or 0), ())
+            except ValueError:
+                # A text-mode status in PDU mode, as a real modem answers it
+                return "+CMS ERROR: 302", 0
+        else:
+            wanted = {"REC UNREAD": (0,), "REC READ": (1,), "ALL": (0, 1)}.get(argument or "REC UNREAD", ())
+        lines = ""
+        listed = 0
+        for index in sorted(self.sim):
+            slot = self.sim[index]
+            if slot[0] in wanted:
+                details, body = self._render(index, slot)
+                lines += f"+CMGL: {details}\r\n{body}\r\n"
+                slot[0] = 1
+                listed += 1
+        return (lines + "\r\nOK" if lines else "OK"), listed
+
+    def _delete(self, argument):
+        index, _, flag = argument.partition(",")
+        if flag.strip() == "4":
+            self.deleted += len(self.sim)
+            self.sim.clear()
+            return "OK"
+        try:
+            del self.sim[int(index)]
+        except (ValueError, KeyError):
+            return "+CMS ERROR: 321"
+        self.deleted += 1
+        return "OK"
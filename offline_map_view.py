@@ -0,0 +1,78 @@
+"""
+TkinterMapView drawing its tiles from the offline MBTiles store.
+"""
+import io
+
+from PIL import Image, ImageTk
+from tkintermapview import TkinterMapView
+
+from tile_store import TILE_CACHE_SIZE, TileCache
+
+
+# Tiles decoded for any OfflineMapView, shared by every vessel tab
+shared_tile_cache = TileCache(TILE_CACHE_SIZE)
+
+
+class OfflineMapView(TkinterMapView):
+    """
+    A TkinterMapView that reads its tiles from an MBTilesStore instead of the
+    tile server, and never opens a network connection.
+
+    Decoded tiles are kept in a TileCache shared by every map, so a tile that
+    one vessel tab has shown is drawn in the others without being read or
+    decoded again, and memory stays bounded however many tabs are open. The
+    widget's own tile_image_cache and its pre-caching thread are not used: a
+    tile comes off the local disk in about a millisecond, and pre-caching 17 x 17
+    tiles around every position would only push the visible ones out of the
+    cache.
+
+    Without a store it behaves exactly like TkinterMapView.
+    """
+
+    def __init__(self, *args, tile_store=None, tile_cache=None, **kwargs):
+        """
+        Args:
+            tile_store (MBTilesStore): Offline tiles. None for the online tile server.
+            tile_cache (TileCache): Cache of decoded tiles. Defaults to the one
+                shared by all OfflineMapView widgets.
+        """
+        # Set before the base class starts its loading threads
+        self.tile_store = tile_store
+        self.tile_cache = tile_cache if tile_cache is not None else shared_tile_cache
+        if tile_store is not None:
+            kwargs.setdefault("max_zoom", tile_store.max_zoom)
+        super().__init__(*args, **kwargs)
+
+    def pre_cache(self):
+        if self.tile_store is None:
+            super().pre_cache()
+
+    def get_tile_image_from_cache(self, zoom, x, y):
+        if self.tile_store is None:
+            return super().get_tile_image_from_cache(zoom, x, y)
+        image = self.tile_cache.get((zoom, x, y))
+        if image is None:
+            return False
+        return self.empty_tile_image if image is False else image
+
+    def request_image(self, zoom, x, y, db_cursor=None):
+        if self.tile_store is None:
+            return super().request_image(zoom, x, y, db_cursor)
+
+        image = self.get_tile_image_from_cache(zoom, x, y)
+        if image is not False:
+            return image
+        try:
+            data = self.tile_store.get_tile(zoom, x, y)
+            if data is None:
+                # Outside the imported area; remembered so the store is not asked again
+                self.tile_cache.put((zoom, x, y), False)
+                return self.empty_tile_image
+            if not self.running:
+                return self.empty_tile_image
+            image = ImageTk.PhotoImage(Image.open(io.BytesIO(data)))
+        except Exception as e:
+            print(f"Error loading offline tile {zoom}/{x}/{y}: {e}")
+            return self.empty_tile_image
+        self.tile_cache.put((zoom, x, y), image)
+        return image
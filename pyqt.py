@@ -5,14 +5,22 @@ from PyQt5.QtGui import QPixmap
 from PyQt5.QtCore import Qt
 from PIL import Image
 from gps_database4 import GPSDatabase
-from serial_comm_handler5t import SerialCommunication
-import re
+from gps_journal import IngestJournal
+from gps_csv_export import CSVExportJob
+from modem_pool import ModemPool
 import geopy.distance
 import queue
 import serial.tools.list_ports
-import csv
 import os
-import threading
+import time
+
+
+# Most fixes written and drawn per process_queue tick. The rest wait for the
+# next tick, so the window keeps handling events during a burst of messages.
+MAX_FIXES_PER_TICK = 1000
+# Ticks a message that fails to save is retried for, about five seconds. After
+# that it is left in the journal, which replays it on the next start.
+MAX_SAVE_ATTEMPTS = 50
 
 
 class ToolTip:
@@ -65,13 +73,26 @@ class GPSMapApp(QtWidgets.QMainWindow):
         self.create_menu()
 
         self.db = GPSDatabase()
-        self.serial_comm = None
+        self.export_job = None
 
-        self.sms_queue = queue.Queue()
+        # Messages that were received but not saved before the last exit
+        self.journal = IngestJournal()
+        self.journal.replay(self.db)
 
+        self.sms_queue = queue.Queue()
+        # (message, attempts) pairs that failed to save, retried ahead of new messages
+        self.retry_messages = []
+        # Every connected modem feeds the same queue, through the journal
+        self.modem_pool = ModemPool(self.enqueue_locations, journal=self.journal)
+
+        # (phone_number_id, date) pairs already in the date menu, and the
+        # phone number IDs in the phone number menu
+        self.known_days = set()
+        self.menu_phone_ids = set()
         self.update_phone_number_menu()
 
         self.process_queue()
+        self.update_modem_status()
 
     def add_logos(self):
         logo1_label = QLabel(self)
@@ -132,6 +153,9 @@ class GPSMapApp(QtWidgets.QMainWindow):
         self.com_port_frame.layout().addWidget(self.disconnect_button)
         ToolTip(self.disconnect_button, "Disconnect from the serial port")
 
+        self.modem_status_label = QLabel("No modems connected", self.com_port_frame)
+        self.com_port_frame.layout().addWidget(self.modem_status_label)
+
         self.tracking_frame = QFrame(self.com_tracking_frame)
         self.tracking_frame.setLayout(QVBoxLayout())
         self.com_tracking_frame.layout().addWidget(self.tracking_frame)
@@ -209,38 +233,109 @@ class GPSMapApp(QtWidgets.QMainWindow):
         QMessageBox.information(self, "Phone Numbers", phone_numbers_list)
 
     def process_queue(self):
+        # Retry what failed to save first, then take everything that arrived
+        # since the last tick, up to MAX_FIXES_PER_TICK
+        messages = self.retry_messages
+        self.retry_messages = []
+        fix_count = sum(len(message[1]) for message, _ in messages)
         try:
-            while True:
-                phone_number, time_value, lat, lon = self.sms_queue.get_nowait()
-                if lat is not None and lon is not None and (lat != 0.0 or lon != 0.0):
-                    phone_number_id = self.db.insert_coordinates(phone_number, time_value, lat, lon)
-                    self.update_map(phone_number_id, lat, lon)
-                    self.update_phone_number_menu()
-                    self.update_date_menu()
+            while fix_count < MAX_FIXES_PER_TICK:
+                message = self.sms_queue.get_nowait()
+                messages.append((message, 0))
+                fix_count += len(message[1])
         except queue.Empty:
             pass
-        QtCore.QTimer.singleShot(100, self.process_queue)
+
+        if messages:
+            try:
+                self.apply_messages(messages)
+            except Exception as e:
+                # Keep the queue running; whatever was not saved is in retry_messages
+                print(f"Error applying {len(messages)} messages: {e}")
+        # Come back sooner while a burst is still queued
+        QtCore.QTimer.singleShot(10 if fix_count >= MAX_FIXES_PER_TICK else 100, self.process_queue)
+
+    def apply_messages(self, messages):
+        date = time.strftime("%Y-%m-%d")
+        # One transaction for the whole tick
+        saved = self.save_messages([message for message, _ in messages], date)
+        if saved is None:
+            # One transaction per message, in order, to save the messages ahead of
+            # the one that fails. It and everything after it are retried next tick,
+            # still in order, until it has used up its attempts.
+            saved = []
+            for number, (message, attempts) in enumerate(messages):
+                message_saved = self.save_messages([message], date)
+                if message_saved is not None:
+                    saved.extend(message_saved)
+                    continue
+                if attempts + 1 < MAX_SAVE_ATTEMPTS:
+                    self.retry_messages.append((message, attempts + 1))
+                else:
+                    print(f"Giving up on the SMS from {message[0]} until the next start, which replays it from the journal")
+                self.retry_messages.extend(messages[number + 1:])
+                break
+
+        points = {}
+        for (_, _, lat, lon), phone_number_id in saved:
+            points.setdefault(phone_number_id, []).append((lat, lon))
+        for phone_number_id, vessel_points in points.items():
+            self.add_fixes(phone_number_id, vessel_points)
+
+        # The menus only change when a vessel or a day shows up for the first time
+        new_days = {(phone_number_id, date) for phone_number_id in points} - self.known_days
+        if new_days:
+            self.known_days |= new_days
+            if any(phone_number_id not in self.menu_phone_ids for phone_number_id, _ in new_days):
+                self.update_phone_number_menu()
+            else:
+                self.update_date_menu()
+        self.update()
+
+    def save_messages(self, messages, date):
+        # Returns [(fix, phone_number_id), ...], or None if the transaction failed
+        fixes = [
+            (phone_number, time_value, lat, lon)
+            for phone_number, locations, _ in messages
+            for lat, lon, time_value in locations
+            if lat is not None and lon is not None and (lat != 0.0 or lon != 0.0)
+        ]
+        journal_seqs = [journal_seq for _, _, journal_seq in messages if journal_seq is not None]
+        try:
+            phone_number_ids = self.db.insert_coordinates_batch(fixes, date, journal_seqs=journal_seqs)
+        except Exception as e:
+            print(f"Error saving {len(fixes)} fixes: {e}")
+            return None
+        self.journal.applied(journal_seqs)
+        return list(zip(fixes, phone_number_ids))
 
     def download_database_csv(self):
+        # A second click while an export is running cancels it
+        if self.export_job and not self.export_job.done:
+            self.export_job.cancel()
+            return
+
         desktop_path = os.path.join(os.path.expanduser("~"), "Desktop/gps")
         csv_file_path = os.path.join(desktop_path, "gps_coordinates.csv")
 
-        try:
-            with open(csv_file_path, mode='w', newline='') as csv_file:
-                writer = csv.writer(csv_file)
-                writer.writerow(["Phone Number", "Latitude", "Longitude", "Timestamp", "Date"])
-                self.db.cursor.execute("""
-                    SELECT phone_numbers.phone_number, coordinates.latitude, coordinates.longitude, coordinates.timestamp, coordinates.date 
-                    FROM coordinates
-                    JOIN phone_numbers ON coordinates.phone_number_id = phone_numbers.id
-                """)
-                rows = self.db.cursor.fetchall()
-                for row in rows:
-                    writer.writerow(row)
-
-            QMessageBox.information(self, "Success", f"Database successfully exported to CSV at {csv_file_path}")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Error exporting database to CSV: {e}")
+        # Export on a background thread and poll its progress from the Qt loop
+        self.export_job = CSVExportJob(self.db, csv_file_path).start()
+        QtCore.QTimer.singleShot(200, self.poll_export_job)
+
+    def poll_export_job(self):
+        job = self.export_job
+        if not job.done:
+            self.download_csv_button.setText(f"Exporting... {job.percent()}% (click to cancel)")
+            QtCore.QTimer.singleShot(200, self.poll_export_job)
+            return
+
+        self.download_csv_button.setText("Download CSV")
+        if job.cancelled:
+            QMessageBox.information(self, "Cancelled", "CSV export was cancelled.")
+        elif job.error:
+            QMessageBox.critical(self, "Error", f"Error exporting database to CSV: {job.error}")
+        else:
+            QMessageBox.information(self, "Success", f"Database successfully exported to CSV at {job.path}")
 
     def create_map_tab(self, phone_number_id):
         tab = QWidget()
@@ -262,19 +357,25 @@ class GPSMapApp(QtWidgets.QMainWindow):
         return self.create_map_tab(phone_number_id)
 
     def update_map(self, phone_number_id, lat, lon):
+        self.add_fixes(phone_number_id, [(lat, lon)])
+        self.update()
+
+    def add_fixes(self, phone_number_id, points):
+        # Draw several new fixes of one vessel with a single re-centre and polyline update
         map_widget = self.get_map_widget(phone_number_id)
 
         if phone_number_id not in self.map_markers:
             self.map_markers[phone_number_id] = []
             self.polylines[phone_number_id] = None
 
-        # Set the map position and zoom level
+        # Centre on the latest fix
         # Assuming you have a method to set the position and zoom level in your map widget
-        # map_widget.set_position(lat, lon)
+        # map_widget.set_position(*points[-1])
         # map_widget.set_zoom(15)
 
-        marker = None  # Replace with actual marker creation logic
-        self.map_markers[phone_number_id].append(marker)
+        for lat, lon in points:
+            marker = None  # Replace with actual marker creation logic
+            self.map_markers[phone_number_id].append(marker)
 
         self.update_polyline(phone_number_id)
 
@@ -282,8 +383,6 @@ class GPSMapApp(QtWidgets.QMainWindow):
         if phone_number_id in self.date_labels:
             self.date_labels[phone_number_id].setText(f"Date: {date}")
 
-        self.update()
-
     def update_polyline(self, phone_number_id):
         map_widget = self.get_map_widget(phone_number_id)
 
@@ -386,6 +485,7 @@ class GPSMapApp(QtWidgets.QMainWindow):
 
     def update_phone_number_menu(self):
         phone_numbers_with_ids = self.db.get_all_phone_numbers_with_ids()
+        self.menu_phone_ids = {phone_id for phone_id, _ in phone_numbers_with_ids}
         if phone_numbers_with_ids:
             self.phone_number_var = phone_numbers_with_ids[0][0]  # Set the variable directly
             self.phone_number_menu.setCurrentText(self.phone_number_var)  # Update the QComboBox
@@ -423,22 +523,10 @@ class GPSMapApp(QtWidgets.QMainWindow):
 
         print(f"Updated date menu for phone_number_id {phone_number_id}: {dates}")
 
-    def wait_for_sms(self):
-        while True:
-            if self.serial_comm and self.serial_comm.serial_port.in_waiting > 0:
-                response = self.serial_comm.serial_port.read(
-                    self.serial_comm.serial_port.in_waiting
-                ).decode("utf-8")
-                match = re.search(r'\+CMTI: "SM",(\d+)', response)
-                if match:
-                    index = match.group(1)
-                    phone_number, time_value, locations = self.serial_comm.read_sms(index)
-
-                    if phone_number and locations:
-                        for lat, lon in locations:
-                            self.sms_queue.put((phone_number, time_value, lat, lon))
-
-                        self.serial_comm.delete_all_sms()
+    def enqueue_locations(self, phone_number, locations, journal_seq):
+        # Called from the reader thread of whichever modem received the message,
+        # after it was written to the journal
+        self.sms_queue.put((phone_number, locations, journal_seq))
 
     def update_com_port_menu(self):
         ports = serial.tools.list_ports.comports()
@@ -457,15 +545,15 @@ class GPSMapApp(QtWidgets.QMainWindow):
             self.com_port_menu.addItem("No COM ports available")
 
     def connect_to_serial(self):
-        com_port = self.com_port_var
+        # The combo box selection, so a second modem can be picked and added
+        com_port = self.com_port_menu.currentText() or self.com_port_var
         if com_port and com_port != "No COM ports available":
             try:
-                self.serial_comm = SerialCommunication(com_port)
-                self.serial_comm.configure_for_sms()
-                threading.Thread(target=self.wait_for_sms, daemon=True).start()
-                self.connect_button.setEnabled(False)
+                # Each port gets its own reader; connect again to add more modems
+                self.modem_pool.add_port(com_port)
                 self.disconnect_button.setEnabled(True)
-                QMessageBox.information(self, "Connected", "Serial Connection is established.")
+                self.update_modem_status(reschedule=False)
+                QMessageBox.information(self, "Connected", f"Serial Connection is established on {com_port}.")
             except Exception as e:
                 QMessageBox.critical(
                     self,
@@ -476,19 +564,34 @@ class GPSMapApp(QtWidgets.QMainWindow):
             QMessageBox.critical(self, "Error", "No COM port selected or available.")
 
     def disconnect_serial(self):
-        if self.serial_comm:
-            try:
-                self.serial_comm.serial_port.close()
-                self.serial_comm = None
-                self.connect_button.setEnabled(True)
+        com_port = self.com_port_menu.currentText() or self.com_port_var
+        if com_port not in self.modem_pool.ports():
+            QMessageBox.critical(self, "Error", f"{com_port} is not connected.")
+            return
+        try:
+            self.modem_pool.remove_port(com_port)
+            if not self.modem_pool.ports():
                 self.disconnect_button.setEnabled(False)
-                QMessageBox.information(self, "Disconnected", "Serial connection closed.")
-            except Exception as e:
-                QMessageBox.critical(
-                    self,
-                    "Error",
-                    f"Failed to disconnect properly.\n\nError: {e}",
-                )
+            self.update_modem_status(reschedule=False)
+            QMessageBox.information(self, "Disconnected", f"Serial connection on {com_port} closed.")
+        except Exception as e:
+            QMessageBox.critical(
+                self,
+                "Error",
+                f"Failed to disconnect properly.\n\nError: {e}",
+            )
+
+    def update_modem_status(self, reschedule=True):
+        # One line per modem; a failed modem stays listed until it is disconnected
+        lines = []
+        for port, stats in self.modem_pool.stats().items():
+            if stats["healthy"]:
+                lines.append(f"{port}: {stats['messages']} SMS, {stats['fixes_per_minute']:.1f} fixes/min")
+            else:
+                lines.append(f"{port}: FAILED ({stats['last_error']})")
+        self.modem_status_label.setText("\n".join(lines) or "No modems connected")
+        if reschedule:
+            QtCore.QTimer.singleShot(1000, self.update_modem_status)
 
 
 if __name__ == "__main__":
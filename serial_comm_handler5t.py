@@ -1,25 +1,143 @@
+import json
+import os
 import serial
 import time
-import re
+from collections import deque
 from datetime import datetime, timedelta
 
+from at_stream_parser import ATStreamParser, CommandResponse, UnsolicitedResult
+from gps_payload import PayloadError, decode_payload, is_compact
+from sms_pdu import PDU_STATUS, PDUError, SMSReassembler, decode_deliver_pdu
+
+# Seconds to wait for the final result code, by command prefix
+COMMAND_TIMEOUTS = {
+    'AT+CMGR': 5,
+    'AT+CMGL': 30,
+    'AT+CMGD': 25,
+}
+DEFAULT_COMMAND_TIMEOUT = 5
+# Messages without coordinates, such as operator texts, are kept here before
+# they are deleted from the SIM
+UNPARSED_SMS_LOG = "unparsed_sms.log"
+
 class SerialCommunication:
-    def __init__(self, port):
+    def __init__(self, port, pdu_mode=False):
+        """
+        Args:
+            port (str): Serial port name.
+            pdu_mode (bool): Read messages as PDUs (AT+CMGF=0), which is needed to
+                reassemble concatenated messages. Text mode is left as configured
+                on the modem otherwise.
+        """
         self.serial_port = serial.Serial(
             port=port,
             baudrate=115200,
             timeout=5
         )
+        self.pdu_mode = pdu_mode
+        # Parts of concatenated messages that are still incomplete
+        self.reassembler = SMSReassembler()
+        # Turns the received bytes into events; shared with SerialReader
+        self.parser = ATStreamParser()
+        # URC lines not yet dispatched by SerialReader
+        self.unsolicited = deque()
+        # Command responses not yet claimed by read_response
+        self.responses = deque()
+        self.unparsed_log = UNPARSED_SMS_LOG
 
     def configure_for_sms(self):
+        if self.pdu_mode:
+            self.send_command('AT+CMGF=0')
         self.send_command('AT+CNMI=2,1,0,0,0')
 
-    def send_command(self, command):
+    def send_command(self, command, timeout=None):
+        """
+        Send an AT command and wait for its final result code (OK, ERROR,
+        +CMS ERROR, ...), returning as soon as the modem has answered.
+
+        Args:
+            command (str): AT command without the trailing carriage return.
+            timeout (float): Seconds to wait for the final result code. Defaults
+                to the COMMAND_TIMEOUTS entry for the command.
+
+        Returns:
+            str: Everything the modem sent in reply, including the final result code,
+            or an empty string if the command timed out.
+        """
+        response = self.run_command(command, timeout)
+        text = ''.join(line + '\r\n' for line in response.lines) if response else ''
+        print(f"Sent: {command}, Received: {text}")  # Debugging
+        return text
+
+    def run_command(self, command, timeout=None):
+        """
+        Send an AT command and wait for its parsed response.
+
+        Args:
+            command (str): AT command without the trailing carriage return.
+            timeout (float): Seconds to wait for the final result code. Defaults
+                to the COMMAND_TIMEOUTS entry for the command.
+
+        Returns:
+            CommandResponse: The response lines, final result code and any SMS
+            messages it contained, or None if the command timed out.
+        """
+        if timeout is None:
+            timeout = next(
+                (seconds for prefix, seconds in COMMAND_TIMEOUTS.items() if command.startswith(prefix)),
+                DEFAULT_COMMAND_TIMEOUT
+            )
+        # A response that arrived after its command timed out is not ours
+        self.responses.clear()
         self.serial_port.write((command + '\r').encode())
-        time.sleep(1)
-        response = self.serial_port.read(self.serial_port.in_waiting).decode()
-        print(f"Sent: {command}, Received: {response}")  # Debugging
-        return response
+        return self.read_response(timeout)
+
+    def receive(self, timeout):
+        """
+        Wait for bytes from the port and feed them to the parser. URCs are queued
+        in unsolicited and command responses in responses.
+
+        Args:
+            timeout (float): Seconds to block waiting for the first byte.
+
+        Returns:
+            int: Number of bytes received.
+        """
+        self.serial_port.timeout = timeout
+        # Blocks until at least one byte arrives, then takes the rest
+        data = self.serial_port.read(1)
+        if data and self.serial_port.in_waiting:
+            data += self.serial_port.read(self.serial_port.in_waiting)
+        for event in self.parser.feed(data):
+            if isinstance(event, UnsolicitedResult):
+                self.unsolicited.append(event.line)
+            elif isinstance(event, CommandResponse):
+                self.responses.append(event)
+        return len(data)
+
+    def read_response(self, timeout):
+        """
+        Wait until a complete command response has been parsed or the timeout expires.
+
+        Args:
+            timeout (float): Seconds to wait for the final result code.
+
+        Returns:
+            CommandResponse: The response, or None on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        previous_timeout = self.serial_port.timeout
+        try:
+            while not self.responses:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"Timed out waiting for a final result code after {timeout}s")  # Debugging
+                    self.parser.abort()
+                    return None
+                self.receive(remaining)
+        finally:
+            self.serial_port.timeout = previous_timeout
+        return self.responses.popleft()
 
     def increment_timestamps(self, initial_timestamp, count):
         """
@@ -41,14 +159,23 @@ class SerialCommunication:
 
     def parse_message(self, message):
         """
-        Parse the plaintext message to extract time and coordinates.
+        Parse the message to extract time and coordinates.
 
         Args:
-            message (str): The plaintext message in the format "HH:MM:SS; lat,lon; lat,lon; ..."
+            message (str): The plaintext message in the format "HH:MM:SS; lat,lon; lat,lon; ...",
+                or a compact payload (see gps_payload).
 
         Returns:
             tuple: (time_value, coords) where coords is a list of (lat, lon) tuples.
+            For a compact payload time_value is the time of the first fix; use
+            decode_message to get the time of every fix.
         """
+        if is_compact(message):
+            locations = self.decode_message(message)
+            if not locations:
+                return None, []
+            return locations[0][2], [(lat, lon) for lat, lon, _ in locations]
+
         try:
             message = message.strip()
             parts = message.split(';')
@@ -69,28 +196,217 @@ class SerialCommunication:
             print(f"Error parsing message: {e}")
             return None, []
 
+    def decode_message(self, message_body):
+        """
+        Decode a message body in either format into timestamped coordinates.
+
+        Plaintext messages carry one time and fixes one minute apart; compact
+        payloads carry the time of every fix.
+
+        Args:
+            message_body (str): Plaintext message or compact payload.
+
+        Returns:
+            list: (lat, lon, timestamp) tuples, empty if the message holds no coordinates.
+        """
+        if is_compact(message_body):
+            try:
+                fixes = decode_payload(message_body)
+            except PayloadError as e:
+                print(f"Error parsing message: {e}")
+                return []
+            # As in plaintext messages, a zero coordinate means the device had no fix
+            return [(lat, lon, ts) for lat, lon, ts in fixes if lat != 0.0 and lon != 0.0]
+
+        time_value, coords = self.parse_message(message_body)
+        if not (time_value and coords):
+            return []
+        # Increment timestamps for each coordinate
+        try:
+            timestamps = self.increment_timestamps(time_value, len(coords))
+        except ValueError as e:
+            print(f"Error parsing message time {time_value!r}: {e}")
+            return []
+        return [(lat, lon, ts) for (lat, lon), ts in zip(coords, timestamps)]
+
+    def log_unparsed(self, phone_number, message_body):
+        """
+        Append a message without coordinates to unparsed_log, so it can be
+        deleted from the SIM without being lost.
+
+        Args:
+            phone_number (str): Sender of the message.
+            message_body (str): Text of the message.
+
+        Returns:
+            bool: True once the message is on disk.
+        """
+        line = json.dumps(
+            {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "phone": phone_number, "text": message_body},
+            ensure_ascii=False,
+        )
+        try:
+            with open(self.unparsed_log, "a", encoding="utf-8") as log_file:
+                log_file.write(line + "\n")
+                log_file.flush()
+                os.fsync(log_file.fileno())
+        except OSError as e:
+            print(f"Error logging SMS from {phone_number}: {e}")
+            return False
+        return True
+
     def read_sms(self, index):
         command = f'AT+CMGR={index}'
-        response = self.send_command(command)
+        response = self.run_command(command)
         print(f"Read SMS response: {response}")  # Debugging
 
-        match = re.search(r'\+CMGR: "REC UNREAD","(\+?\d+)".*\r\n(.+)\r\n', response)
-        if match:
-            phone_number = match.group(1)
-            message_body = match.group(2).strip()
+        messages = response.messages if response else []
+        if self.pdu_mode and messages and messages[0].status == str(PDU_STATUS["REC UNREAD"]):
+            # CMGR does not repeat the index, so pass it along
+            messages = [messages[0]._replace(index=int(index))]
+            assembled = self.assemble_messages(messages)
+            if assembled:
+                _, phone_number, message_body = assembled[0]
+                print(f"Extracted message body: {message_body}")  # Debugging
+                locations = self.decode_message(message_body)
+                if locations:
+                    return phone_number, locations
+        elif messages and messages[0].status == "REC UNREAD":
+            phone_number = messages[0].phone_number
+            message_body = messages[0].body
             print(f"Extracted message body: {message_body}")  # Debugging
 
-            # Parse the message
-            time_value, coords = self.parse_message(message_body)
-
-            if time_value and coords:
-                # Increment timestamps for each coordinate
-                timestamps = self.increment_timestamps(time_value, len(coords))
-                coords_with_timestamps = [(lat, lon, ts) for (lat, lon), ts in zip(coords, timestamps)]
-                return phone_number, coords_with_timestamps
+            locations = self.decode_message(message_body)
+            if locations:
+                return phone_number, locations
 
         return None, []
 
+    def list_command(self, status):
+        """
+        Returns:
+            str: The AT+CMGL command for a status name such as "REC UNREAD" or "ALL".
+        """
+        if self.pdu_mode:
+            return f'AT+CMGL={PDU_STATUS[status]}'
+        return f'AT+CMGL="{status}"'
+
+    def assemble_messages(self, messages):
+        """
+        Turn listed messages into complete message bodies. In PDU mode the PDUs
+        are decoded and the parts of concatenated messages are buffered in
+        reassembler until the last part arrives.
+
+        Args:
+            messages (list): SMSMessage events from a +CMGL or +CMGR response.
+
+        Returns:
+            list: (indices, phone_number, message_body) tuples, where indices are
+            the SIM indices of every part of the message.
+        """
+        if not self.pdu_mode:
+            return [([message.index], message.phone_number, message.body) for message in messages]
+
+        assembled = []
+        for message in messages:
+            try:
+                delivered = decode_deliver_pdu(message.body)
+            except PDUError as e:
+                print(f"Skipping SMS {message.index}: {e}")
+                continue
+            if delivered.parts is None:
+                assembled.append(([message.index], delivered.sender, delivered.text))
+                continue
+            complete = self.reassembler.add(message.index, delivered)
+            if complete:
+                assembled.append(complete)
+        return assembled
+
+    def list_sms(self, status="REC UNREAD"):
+        """
+        List the messages on the SIM with a single AT+CMGL command.
+
+        Args:
+            status (str): "REC UNREAD" for new messages only, or "ALL".
+
+        Returns:
+            list: (indices, phone_number, message_body) tuples in SIM order; see
+            assemble_messages.
+        """
+        response = self.run_command(self.list_command(status))
+        if response is None:
+            return []
+        print(f"Listed {len(response.messages)} SMS messages, result {response.result}")  # Debugging
+        return self.assemble_messages(response.messages)
+
+    def delete_sms(self, index):
+        """
+        Delete one message from the SIM.
+
+        Args:
+            index (int): SIM storage index of the message.
+
+        Returns:
+            bool: True if the modem confirmed the deletion.
+        """
+        response = self.run_command(f'AT+CMGD={index}')
+        return response is not None and response.result == 'OK'
+
+    def drain_sms(self, store, status="REC UNREAD", commit=None):
+        """
+        Read every waiting message with one AT+CMGL, hand the coordinates to
+        store and delete the messages that were stored.
+
+        A message is left on the SIM when store raises, so it is picked up again
+        by the next drain with status "ALL" (for example on connect). Messages
+        without coordinates, such as operator and promotional texts, are written
+        to unparsed_log and deleted, so they cannot fill the SIM. The
+        parts of a concatenated message are deleted together once it has been
+        stored; parts of a message that never completes are deleted when the
+        reassembler evicts them.
+
+        Args:
+            store (callable): Called with (phone_number, locations) for each message,
+                where locations is a list of (lat, lon, timestamp) tuples.
+            status (str): "REC UNREAD" for new messages only, or "ALL".
+            commit (callable): Optional, called once after the messages are stored
+                and before any is deleted, for example IngestJournal.sync. If it
+                raises, nothing is deleted.
+
+        Returns:
+            int: Number of messages stored.
+        """
+        stored = 0
+        deletable = []
+        for indices, phone_number, message_body in self.list_sms(status):
+            locations = self.decode_message(message_body)
+            if not locations:
+                print(f"SMS {indices} from {phone_number} has no coordinates, moving it to {self.unparsed_log}")
+                if self.log_unparsed(phone_number, message_body):
+                    deletable.extend(indices)
+                continue
+            try:
+                store(phone_number, locations)
+            except Exception as e:
+                print(f"Error storing SMS {indices}: {e}")
+                continue
+            stored += 1
+            deletable.extend(indices)
+        if stored and commit:
+            try:
+                commit()
+            except Exception as e:
+                print(f"Error committing SMS, keeping them on the SIM: {e}")
+                return stored
+        deletable.extend(self.reassembler.expire())
+
+        for index in deletable:
+            if self.delete_sms(index):
+                self.reassembler.deleted(index)
+            else:
+                print(f"Failed to delete SMS {index}.")
+        return stored
+
     def delete_all_sms(self):
         # Send the command to delete all SMS from the SIM card
         response = self.send_command('AT+CMGD=1,4')
@@ -0,0 +1,153 @@
+import queue
+import threading
+
+import serial
+
+
+class SerialReader:
+    """
+    Background reader for a SerialCommunication port.
+
+    Blocks on the port with a timeout instead of polling in_waiting, so an idle
+    modem costs no CPU. Incoming bytes are split into lines in the modem's
+    receive buffer, and unsolicited result codes such as +CMTI are dispatched
+    to the callbacks registered for their prefix. Callbacks run on the reader
+    thread, which has the port to itself while they run, so they may send AT
+    commands through the same SerialCommunication.
+    """
+
+    def __init__(self, serial_comm, read_timeout=0.5):
+        """
+        Args:
+            serial_comm (SerialCommunication): Connected modem.
+            read_timeout (float): Seconds a blocking read waits before checking
+                whether the reader has been stopped.
+        """
+        self.serial_comm = serial_comm
+        self.read_timeout = read_timeout
+        self.callbacks = {}
+        self.coalesced = set()
+        self.on_error = None
+        self.pending_calls = queue.Queue()
+        self.thread = None
+        self.running = False
+
+    def on_urc(self, prefix, callback, coalesce=False):
+        """
+        Register a callback for unsolicited result codes.
+
+        Args:
+            prefix (str): Start of the line to match, for example "+CMTI".
+            callback (callable): Called with the decoded line.
+            coalesce (bool): Call the prefix's callbacks once per process() pass,
+                with the last of its lines, however many of them were queued.
+                For notifications that all lead to the same work, like +CMTI
+                and a drain of the SIM.
+        """
+        self.callbacks.setdefault(prefix, []).append(callback)
+        if coalesce:
+            self.coalesced.add(prefix)
+
+    def call_soon(self, function, *args):
+        """
+        Run a function on the reader thread, for work that sends AT commands
+        from outside a URC callback (for example draining the SIM on connect).
+
+        Args:
+            function (callable): Called with args before the next blocking read.
+        """
+        self.pending_calls.put((function, args))
+
+    def start(self):
+        """
+        Start the reader thread.
+
+        Returns:
+            SerialReader: The reader itself.
+        """
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="serial-reader", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Stop the reader thread. It exits within read_timeout seconds.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for the thread.
+        """
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def process(self):
+        """
+        Dispatch every URC the modem's parser has queued, including those that
+        arrived while a command was running. URCs that arrive while the
+        callbacks send commands are left for the next pass.
+        """
+        lines = list(self.serial_comm.unsolicited)
+        self.serial_comm.unsolicited.clear()
+        # Position of the last line of each coalesced prefix
+        last = {}
+        for number, line in enumerate(lines):
+            for prefix in self.coalesced:
+                if line.startswith(prefix):
+                    last[prefix] = number
+        for number, line in enumerate(lines):
+            if all(last.get(prefix, number) == number for prefix in self.coalesced if line.startswith(prefix)):
+                self.dispatch(line)
+        # No command is waiting at this point, so a response here is a late reply
+        # to a command that already timed out
+        while self.serial_comm.responses:
+            print(f"Discarding late response: {self.serial_comm.responses.popleft().lines}")
+
+    def dispatch(self, line):
+        """
+        Call the callbacks registered for the line's prefix.
+
+        Args:
+            line (str): One decoded line from the modem.
+        """
+        for prefix, callbacks in self.callbacks.items():
+            if line.startswith(prefix):
+                for callback in callbacks:
+                    try:
+                        callback(line)
+                    except Exception as e:
+                        print(f"Error handling {prefix}: {e}")
+
+    def _run_pending_calls(self):
+        while True:
+            try:
+                function, args = self.pending_calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                function(*args)
+            except Exception as e:
+                print(f"Error in serial reader call: {e}")
+
+    def _run(self):
+        while self.running:
+            self._run_pending_calls()
+            # A call that sent commands may have queued URCs, and the modem may
+            # send nothing more to wake the read below (for example a full SIM)
+            self.process()
+            if self.serial_comm.unsolicited:
+                # Queued during the pass; go round again without blocking
+                continue
+            try:
+                # Sleeps in the driver until a byte arrives or the timeout expires
+                if not self.serial_comm.receive(self.read_timeout):
+                    continue
+            except (serial.SerialException, OSError, TypeError) as e:
+                # TypeError/OSError: the port was closed under us on disconnect
+                if self.running:
+                    print(f"Serial reader stopped: {e}")
+                    if self.on_error:
+                        self.on_error(e)
+                self.running = False
+                break
@@ -0,0 +1,356 @@
+"""
+SMS-DELIVER PDU decoding and reassembly of concatenated (multi-part) SMS.
+
+In text mode most modems hide the user data header, so the parts of a long
+message arrive as unrelated fragments. In PDU mode (AT+CMGF=0) every message
+is listed as hex, and the concatenation header (IEI 0x00 with an 8-bit
+reference, IEI 0x08 with a 16-bit reference) tells which parts belong
+together.
+"""
+import time
+from collections import namedtuple
+
+
+# GSM 03.38 default alphabet; 0x1B escapes into the extension table
+GSM7_BASIC = (
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENSION = {
+    0x0A: "\f", 0x14: "^", 0x28: "{", 0x29: "}", 0x2F: "\\",
+    0x3C: "[", 0x3D: "~", 0x3E: "]", 0x40: "|", 0x65: "€",
+}
+GSM7_ESCAPE = 0x1B
+GSM7_ENCODE = {char: (septet,) for septet, char in enumerate(GSM7_BASIC) if septet != GSM7_ESCAPE}
+GSM7_ENCODE.update({char: (GSM7_ESCAPE, septet) for septet, char in GSM7_EXTENSION.items()})
+
+# Information elements of the user data header that mark a concatenated message
+IEI_CONCATENATED_8BIT = 0x00
+IEI_CONCATENATED_16BIT = 0x08
+
+# AT+CMGL status values in PDU mode
+PDU_STATUS = {"REC UNREAD": 0, "REC READ": 1, "STO UNSENT": 2, "STO SENT": 3, "ALL": 4}
+
+# A decoded SMS-DELIVER. reference, part and parts are None unless the
+# message is one part of a concatenated message; part counts from 1.
+DeliveredSMS = namedtuple("DeliveredSMS", ["sender", "timestamp", "text", "reference", "part", "parts"])
+
+
+class PDUError(ValueError):
+    """Raised when a PDU cannot be decoded."""
+
+
+def unpack_septets(data, count, skip_bits=0):
+    """
+    Unpack GSM 7-bit septets, least significant bit first.
+
+    Args:
+        data (bytes): Packed user data.
+        count (int): Number of septets to read.
+        skip_bits (int): Bits to skip first (the user data header and its fill bits).
+
+    Returns:
+        list: Septet values.
+    """
+    bits = int.from_bytes(data, "little")
+    return [(bits >> (skip_bits + 7 * index)) & 0x7F for index in range(count)]
+
+
+def pack_septets(septets, skip_bits=0):
+    """
+    Pack GSM 7-bit septets, the inverse of unpack_septets.
+
+    Returns:
+        bytes: Packed data, skip_bits zero bits first.
+    """
+    bits = 0
+    for index, septet in enumerate(septets):
+        bits |= septet << (skip_bits + 7 * index)
+    return bits.to_bytes((skip_bits + 7 * len(septets) + 7) // 8, "little")
+
+
+def gsm7_decode(septets):
+    text = []
+    escaped = False
+    for septet in septets:
+        if escaped:
+            text.append(GSM7_EXTENSION.get(septet, " "))
+            escaped = False
+        elif septet == GSM7_ESCAPE:
+            escaped = True
+        else:
+            text.append(GSM7_BASIC[septet])
+    return "".join(text)
+
+
+def gsm7_encode(text):
+    septets = []
+    for char in text:
+        try:
+            septets.extend(GSM7_ENCODE[char])
+        except KeyError:
+            raise PDUError(f"{char!r} is not in the GSM 7-bit alphabet")
+    return septets
+
+
+def decode_semi_octets(data):
+    # Each octet holds two decimal digits, low nibble first; F pads odd lengths
+    digits = "".join(f"{octet & 0x0F:X}{octet >> 4:X}" for octet in data)
+    return digits.rstrip("F")
+
+
+def encode_semi_octets(digits):
+    if len(digits) % 2:
+        digits += "F"
+    return bytes(int(digits[index + 1] + digits[index], 16) for index in range(0, len(digits), 2))
+
+
+def decode_deliver_pdu(pdu):
+    """
+    Decode an SMS-DELIVER PDU as listed by AT+CMGL/AT+CMGR in PDU mode.
+
+    Args:
+        pdu (str): The PDU in hex, including the SMSC address.
+
+    Returns:
+        DeliveredSMS: The sender, timestamp, text and concatenation header.
+
+    Raises:
+        PDUError: If the PDU is malformed or not an SMS-DELIVER.
+    """
+    try:
+        data = bytes.fromhex(pdu.strip())
+    except ValueError:
+        raise PDUError("PDU is not hex")
+    try:
+        return _decode_deliver(data)
+    except IndexError:
+        raise PDUError("PDU is truncated")
+
+
+def _decode_deliver(data):
+    position = 1 + data[0]  # skip the SMSC address
+    first_octet = data[position]
+    if first_octet & 0x03 != 0:
+        raise PDUError("PDU is not an SMS-DELIVER")
+    has_header = bool(first_octet & 0x40)
+
+    address_digits = data[position + 1]
+    address_type = data[position + 2]
+    address_octets = (address_digits + 1) // 2
+    address = data[position + 3:position + 3 + address_octets]
+    if len(address) < address_octets:
+        raise IndexError()
+    if address_type & 0x70 == 0x50:
+        # Alphanumeric sender, for example an operator name
+        sender = gsm7_decode(unpack_septets(address, address_digits * 4 // 7))
+    else:
+        sender = decode_semi_octets(address)
+        if address_type & 0x70 == 0x10:
+            sender = "+" + sender
+    position += 3 + address_octets
+
+    coding = data[position + 1]
+    stamp = decode_semi_octets(data[position + 2:position + 9])
+    timestamp = f"{stamp[0:2]}/{stamp[2:4]}/{stamp[4:6]},{stamp[6:8]}:{stamp[8:10]}:{stamp[10:12]}"
+    length = data[position + 9]
+    user_data = data[position + 10:]
+
+    if coding & 0xC0 == 0x00:
+        alphabet = (coding >> 2) & 0x03
+    elif coding & 0xF0 == 0xF0:
+        alphabet = (coding >> 2) & 0x01
+    elif coding & 0xF0 == 0xE0:
+        alphabet = 2
+    else:
+        alphabet = 0
+
+    reference = part = parts = None
+    header_octets = 0
+    if has_header:
+        header_length = user_data[0]
+        header_octets = header_length + 1
+        offset = 1
+        while offset < header_octets:
+            element, element_length = user_data[offset], user_data[offset + 1]
+            value = user_data[offset + 2:offset + 2 + element_length]
+            if element == IEI_CONCATENATED_8BIT and element_length == 3:
+                reference, parts, part = value[0], value[1], value[2]
+            elif element == IEI_CONCATENATED_16BIT and element_length == 4:
+                reference, parts, part = (value[0] << 8) | value[1], value[2], value[3]
+            offset += 2 + element_length
+
+    if alphabet == 0:
+        # length counts septets, including the header and the fill bits after it
+        header_septets = (header_octets * 8 + 6) // 7
+        septets = unpack_septets(user_data, length - header_septets, header_septets * 7)
+        text = gsm7_decode(septets)
+    else:
+        body = user_data[header_octets:length]
+        text = body.decode("utf-16-be", errors="replace") if alphabet == 2 else body.decode("latin-1")
+
+    if parts is not None and not 1 <= part <= parts:
+        raise PDUError(f"Invalid part {part} of {parts}")
+    if parts == 1:
+        reference = part = parts = None
+    return DeliveredSMS(sender, timestamp, text, reference, part, parts)
+
+
+def encode_deliver_pdus(sender, text, reference=0, timestamp="25/01/01,00:00:00", split=True):
+    """
+    Encode text as one SMS-DELIVER PDU, or as concatenated PDUs with an 8-bit
+    reference if it does not fit in 160 septets. For simulators and tests.
+
+    Args:
+        sender (str): Sender number, "+" for international format.
+        text (str): Message text in the GSM 7-bit alphabet.
+        reference (int): Concatenation reference number (0-255).
+        timestamp (str): Service centre timestamp, "YY/MM/DD,hh:mm:ss".
+        split (bool): False encodes up to 255 septets as one oversized PDU,
+            which no network sends, for a simulated SIM slot holding a long
+            message whole.
+
+    Returns:
+        list: PDUs in hex, in part order.
+
+    Raises:
+        ValueError: If split is False and the text is longer than 255 septets.
+    """
+    septets = gsm7_encode(text)
+    if not split and len(septets) > 255:
+        raise ValueError(f"{len(septets)} septets do not fit in one PDU")
+    if len(septets) <= 160 or not split:
+        chunks = [septets]
+    else:
+        # 153 septets per part; an escape sequence is never split
+        chunks = []
+        start = 0
+        while start < len(septets):
+            end = min(start + 153, len(septets))
+            if end < len(septets) and septets[end - 1] == GSM7_ESCAPE:
+                end -= 1
+            chunks.append(septets[start:end])
+            start = end
+
+    digits = sender.lstrip("+")
+    address = bytes([len(digits), 0x91 if sender.startswith("+") else 0x81]) + encode_semi_octets(digits)
+    stamp = encode_semi_octets(timestamp.replace("/", "").replace(",", "").replace(":", "") + "00")
+
+    pdus = []
+    for number, chunk in enumerate(chunks, 1):
+        if len(chunks) == 1:
+            first_octet, header = 0x04, b""
+        else:
+            first_octet = 0x44
+            header = bytes([5, IEI_CONCATENATED_8BIT, 3, reference & 0xFF, len(chunks), number])
+        header_septets = (len(header) * 8 + 6) // 7
+        user_data = pack_septets(chunk, header_septets * 7)
+        user_data = header + user_data[len(header):]
+        pdu = bytes([0x00, first_octet]) + address + bytes([0x00, 0x00]) + stamp
+        pdu += bytes([header_septets + len(chunk)]) + user_data
+        pdus.append(pdu.hex().upper())
+    return pdus
+
+
+class SMSReassembler:
+    """
+    Collects the parts of concatenated messages until each is complete.
+
+    Parts are grouped by (sender, reference, parts). A complete message is
+    returned once, with the SIM indices of all its parts, so they can be
+    deleted together after it has been stored; report each deletion to
+    deleted(). Groups that stay incomplete
+    for longer than timeout, or that are pushed out by max_messages newer
+    groups, are evicted; their indices are returned by expire().
+    """
+
+    def __init__(self, timeout=3600, max_messages=32):
+        """
+        Args:
+            timeout (float): Seconds to wait for the missing parts of a message.
+            max_messages (int): Most incomplete messages buffered at once.
+        """
+        self.timeout = timeout
+        self.max_messages = max_messages
+        # key -> (first seen, {part: (index, timestamp, text)})
+        self.pending = {}
+        # key -> (completed at, {index: (part, timestamp, text)}) of delivered
+        # messages whose parts are not deleted yet, to recognise them if they
+        # are listed again
+        self.completed = {}
+        self.evicted = []
+
+    def add(self, index, message, now=None):
+        """
+        Add one part.
+
+        Args:
+            index (int): SIM storage index of the part.
+            message (DeliveredSMS): The decoded part.
+            now (float): Current time, for tests. Defaults to time.time().
+
+        Returns:
+            tuple: (indices, sender, text) once the message is complete, else None.
+        """
+        now = time.time() if now is None else now
+        key = (message.sender, message.reference, message.parts)
+        completed = self.completed.get(key)
+        if completed and completed[1].get(index) == (message.part, message.timestamp, message.text):
+            # Already delivered; its deletion must have failed, so try again.
+            # The content is compared too: the SIM reuses free indices and the
+            # reference wraps, so a new message can share the key and index.
+            self.evicted.append(index)
+            return None
+
+        first_seen, parts = self.pending.setdefault(key, (now, {}))
+        parts[message.part] = (index, message.timestamp, message.text)
+        if len(parts) < message.parts:
+            while len(self.pending) > self.max_messages:
+                oldest = min(self.pending, key=lambda pending_key: self.pending[pending_key][0])
+                self._evict(oldest)
+            return None
+
+        del self.pending[key]
+        indices = [parts[number][0] for number in sorted(parts)]
+        self.completed[key] = (
+            now, {parts[number][0]: (number, parts[number][1], parts[number][2]) for number in parts}
+        )
+        text = "".join(parts[number][2] for number in sorted(parts))
+        return indices, message.sender, text
+
+    def deleted(self, index):
+        """
+        Forget a part of a delivered message once it has been deleted from the
+        SIM, so that a new message stored at the same index is not taken for it.
+
+        Args:
+            index (int): SIM storage index of the deleted part.
+        """
+        for key, (_, indices) in list(self.completed.items()):
+            if indices.pop(index, None) is not None and not indices:
+                del self.completed[key]
+
+    def expire(self, now=None):
+        """
+        Evict the messages that waited longer than timeout for their missing parts.
+
+        Args:
+            now (float): Current time, for tests. Defaults to time.time().
+
+        Returns:
+            list: SIM indices of every part evicted since the last call.
+        """
+        now = time.time() if now is None else now
+        for key, (first_seen, _) in list(self.pending.items()):
+            if now - first_seen > self.timeout:
+                self._evict(key)
+        for key, (completed_at, _) in list(self.completed.items()):
+            if now - completed_at > self.timeout:
+                del self.completed[key]
+        evicted, self.evicted = self.evicted, []
+        return evicted
+
+    def _evict(self, key):
+        _, parts = self.pending.pop(key)
+        print(f"Dropping incomplete message {key[1]} from {key[0]}: {len(parts)} of {key[2]} parts")
+        self.evicted.extend(index for index, _, _ in parts.values())
@@ -0,0 +1,82 @@
+import random
+
+from at_stream_parser import ATStreamParser, CommandResponse, SMSMessage, UnsolicitedResult
+
+
+STREAM = (
+    b'\r\n+CMTI: "SM",3\r\n'
+    b'\r\n+CMGL: 1,"REC UNREAD","+919876543210",,"25/01/01,10:00:00+22"\r\n'
+    b'OK\r\n'
+    b'+CMTI: "SM",4\r\n'
+    b'+CMGL: 2,"REC UNREAD","+919876543211",,"25/01/01,10:01:00+22"\r\n'
+    b'10:00:00; 17.1,83.2\r\n'
+    b'10:01:00; 17.2,83.3\r\n'
+    b'\r\nOK\r\n'
+    b'\r\n+CMGL: 5,0,,23\r\n'
+    b'07911326040000F0040B911346610089F60000208062917314080CC8F71D14969741F977FD07\r\n'
+    b'\r\nOK\r\n'
+    b'\r\n+CMS ERROR: 321\r\n'
+)
+
+
+def expected_events():
+    first = SMSMessage(1, "REC UNREAD", "+919876543210", "OK", '+CMGL: 1,"REC UNREAD","+919876543210",,"25/01/01,10:00:00+22"')
+    second = SMSMessage(
+        2, "REC UNREAD", "+919876543211", "10:00:00; 17.1,83.2\n10:01:00; 17.2,83.3",
+        '+CMGL: 2,"REC UNREAD","+919876543211",,"25/01/01,10:01:00+22"',
+    )
+    pdu = SMSMessage(5, "0", None, "07911326040000F0040B911346610089F60000208062917314080CC8F71D14969741F977FD07", "+CMGL: 5,0,,23")
+    return [
+        UnsolicitedResult('+CMTI: "SM",3'),
+        # A +CMTI in the middle of the response is dispatched on its own
+        UnsolicitedResult('+CMTI: "SM",4'),
+        first,
+        second,
+        CommandResponse(
+            [first.header, "OK", second.header, "10:00:00; 17.1,83.2", "10:01:00; 17.2,83.3", "", "OK"],
+            "OK", [first, second],
+        ),
+        pdu,
+        CommandResponse([pdu.header, pdu.body, "", "OK"], "OK", [pdu]),
+        CommandResponse(["+CMS ERROR: 321"], "+CMS ERROR: 321", []),
+    ]
+
+
+def test_single_feed():
+    assert ATStreamParser().feed(STREAM) == expected_events()
+
+
+def test_body_line_reading_ok_does_not_end_the_response():
+    events = ATStreamParser().feed(STREAM)
+    responses = [event for event in events if isinstance(event, CommandResponse)]
+    assert responses[0].messages[0].body == "OK"
+    assert len(responses[0].messages) == 2
+
+
+def test_chunks_of_any_size():
+    stream = STREAM * 50
+    expected = expected_events() * 50
+    rng = random.Random(0)
+    for _ in range(200):
+        parser = ATStreamParser()
+        events = []
+        position = 0
+        while position < len(stream):
+            size = rng.randint(1, 40)
+            events.extend(parser.feed(stream[position:position + size]))
+            position += size
+        assert events == expected
+        assert parser.buffer == b""
+
+
+def test_partial_line_is_kept_for_the_next_feed():
+    parser = ATStreamParser()
+    assert parser.feed(b'+CMTI: "SM"') == []
+    assert parser.feed(b',7\r\n+CMTI: "SM",8\r\n') == [UnsolicitedResult('+CMTI: "SM",7'), UnsolicitedResult('+CMTI: "SM",8')]
+
+
+def test_abort_drops_the_partial_response():
+    parser = ATStreamParser()
+    parser.feed(b'+CMGL: 1,"REC UNREAD","+919876543210",,"25/01/01,10:00:00+22"\r\n')
+    parser.abort()
+    assert parser.feed(b'\r\nOK\r\n') == [CommandResponse(["OK"], "OK", [])]
@@ -0,0 +1,59 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from gps_database4 import SCHEMA_VERSION, GPSDatabase
+
+
+LEGACY_DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gps_coordinates (1).db")
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = GPSDatabase(str(tmp_path / "gps.db"))
+    yield database
+    database.close()
+
+
+def assert_query_plans_ok(database):
+    failed = {name: plan for name, (ok, plan) in database.check_query_plans().items() if not ok}
+    assert not failed, f"Queries not served by their index: {failed}"
+
+
+def test_query_plans_use_indexes(db):
+    assert_query_plans_ok(db)
+
+
+def test_query_plans_use_indexes_with_data(db):
+    # The planner's choice can change once the tables hold rows and ANALYZE has run
+    fixes = [(f"+9190000000{vessel:02d}", "10:00:00", 17.0 + vessel / 100, 83.0) for vessel in range(20)]
+    for _ in range(50):
+        db.insert_coordinates_batch(fixes, "2025-01-01")
+    db.cursor.execute("ANALYZE")
+    assert_query_plans_ok(db)
+
+
+def test_migrate_upgrades_legacy_database_in_place(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    shutil.copyfile(LEGACY_DATABASE, path)
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("PRAGMA user_version").fetchone()[0] == 0
+        rows = connection.execute("SELECT phone_number_id, timestamp, date, latitude, longitude FROM coordinates ORDER BY rowid").fetchall()
+
+    database = GPSDatabase(path)
+    try:
+        assert database.get_schema_version() == SCHEMA_VERSION
+        database.cursor.execute("SELECT phone_number_id, timestamp, date, latitude, longitude FROM coordinates ORDER BY rowid")
+        assert database.cursor.fetchall() == rows
+        assert_query_plans_ok(database)
+    finally:
+        database.close()
+
+    # Opening it again finds nothing left to migrate
+    database = GPSDatabase(path)
+    try:
+        assert database.migrate() == SCHEMA_VERSION
+    finally:
+        database.close()
@@ -0,0 +1,123 @@
+import os
+import shutil
+
+import pytest
+
+from gps_database4 import GPSDatabase
+from gps_journal import IngestJournal
+
+
+DATE = "2025-01-01"
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = GPSDatabase(str(tmp_path / "gps.db"))
+    yield database
+    database.close()
+
+
+def message(number):
+    # One vessel per message, so every record is easy to find in the database
+    return f"+9190000000{number:02d}", [(17.0 + number / 100, 83.0, "10:00:00")]
+
+
+def append_messages(journal, count):
+    return [journal.append(*message(number), DATE) for number in range(count)]
+
+
+def commit(db, journal, seq):
+    # What IngestWriter does with the record of message seq - 1
+    phone_number, locations = message(seq - 1)
+    fixes = [(phone_number, time_value, lat, lon) for lat, lon, time_value in locations]
+    db.insert_coordinates_batch(fixes, DATE, journal_seqs=[seq])
+    journal.applied([seq])
+
+
+def stored_phones(db):
+    db.cursor.execute(
+        "SELECT phone_number FROM coordinates JOIN phone_numbers ON phone_numbers.id = phone_number_id ORDER BY phone_number"
+    )
+    return [row[0] for row in db.cursor.fetchall()]
+
+
+def test_replay_fills_a_gap(tmp_path, db):
+    path = str(tmp_path / "ingest.journal")
+    journal = IngestJournal(path)
+    assert append_messages(journal, 3) == [1, 2, 3]
+    journal.sync()
+    # The batch holding record 2 failed; records 1 and 3 were committed
+    commit(db, journal, 1)
+    commit(db, journal, 3)
+    journal.file.close()
+    assert db.get_journal_applied() == (1, {3})
+
+    journal = IngestJournal(path)
+    assert journal.replay(db) == 1
+    assert stored_phones(db) == ["+919000000000", "+919000000001", "+919000000002"]
+    assert db.get_journal_applied() == (3, set())
+    # Numbering carries on after the records already in the database
+    assert journal.append("+919000000099", [(18.0, 84.0, "11:00:00")], DATE) == 4
+    journal.close()
+
+
+def test_replay_is_idempotent(tmp_path, db):
+    path = str(tmp_path / "ingest.journal")
+    journal = IngestJournal(path)
+    append_messages(journal, 3)
+    journal.close()
+    # A crash after the replayed records commit but before the journal is emptied
+    shutil.copyfile(path, path + ".copy")
+    journal = IngestJournal(path)
+    assert journal.replay(db) == 3
+    journal.close()
+    assert os.path.getsize(path) == 0
+    shutil.copyfile(path + ".copy", path)
+
+    journal = IngestJournal(path)
+    assert journal.replay(db) == 0
+    assert journal.was_replayed(*message(1))
+    journal.close()
+    assert len(stored_phones(db)) == 3
+
+
+def test_torn_last_record_is_cut_off(tmp_path):
+    path = str(tmp_path / "ingest.journal")
+    journal = IngestJournal(path)
+    append_messages(journal, 3)
+    journal.close()
+    with open(path, "rb") as journal_file:
+        lines = journal_file.readlines()
+    with open(path, "r+b") as journal_file:
+        journal_file.truncate(len(lines[0]) + len(lines[1]) + len(lines[2]) // 2)
+
+    journal = IngestJournal(path)
+    assert [record["seq"] for record in journal.records] == [1, 2]
+    assert os.path.getsize(path) == len(lines[0]) + len(lines[1])
+    # The torn record's number is reused and the file stays readable
+    assert journal.append("+919000000099", [(18.0, 84.0, "11:00:00")], DATE) == 3
+    journal.close()
+    journal = IngestJournal(path)
+    assert [record["seq"] for record in journal.records] == [1, 2, 3]
+    journal.close()
+
+
+def test_compaction_keeps_only_uncommitted_records(tmp_path, db):
+    path = str(tmp_path / "ingest.journal")
+    journal = IngestJournal(path, compact_bytes=1)
+    append_messages(journal, 5)
+    journal.sync()
+    for seq in (1, 2, 4):
+        commit(db, journal, seq)
+    assert journal.compactions == 3
+    assert sorted(journal.pending) == [3, 5]
+    assert os.path.getsize(path) == journal.size == journal.pending_bytes
+    # Appends after a compaction go to the new file
+    assert journal.append("+919000000099", [(18.0, 84.0, "11:00:00")], DATE) == 6
+    journal.close()
+
+    journal = IngestJournal(path)
+    assert [record["seq"] for record in journal.records] == [3, 5, 6]
+    assert journal.replay(db) == 3
+    journal.close()
+    assert len(stored_phones(db)) == 6
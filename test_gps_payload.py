@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from gps_payload import PayloadError, decode_payload, encode_messages, encode_payload, is_compact
+
+
+def test_round_trip_across_midnight():
+    fixes = [
+        (17.71234, 83.24567, "23:58:00"),
+        (17.71301, 83.24611, "23:59:00"),
+        (17.71402, 83.24702, "00:00:05"),
+        (17.71399, 83.24698, "00:01:05"),
+        (-33.86882, 151.20929, "00:30:00"),
+    ]
+    assert decode_payload(encode_payload(fixes)) == fixes
+
+
+def test_round_trip_split_into_messages():
+    fixes = [(17.7 + step / 1000, 83.2 - step / 2000, (86400 - 600 + step * 60) % 86400) for step in range(100)]
+    payloads = encode_messages(fixes)
+    assert len(payloads) > 1
+    assert all(len(payload) <= 160 for payload in payloads)
+    decoded = [fix for payload in payloads for fix in decode_payload(payload)]
+    assert [(lat, lon) for lat, lon, _ in decoded] == [(round(lat, 5), round(lon, 5)) for lat, lon, _ in fixes]
+    assert decoded[10][2] == "00:00:00"
+
+
+def test_out_of_range_header_is_rejected_quickly():
+    start = time.perf_counter()
+    with pytest.raises(PayloadError, match="precision"):
+        decode_payload("#1Wsnx20y1000")
+    assert time.perf_counter() - start < 0.1
+    # Precision 5, time 0, interval 86401, one fix
+    with pytest.raises(PayloadError, match="interval"):
+        decode_payload("#150Xiq2000")
+    with pytest.raises(ValueError):
+        encode_payload([(17.1, 83.2, "10:00:00")], precision=10)
+
+
+def test_unknown_version_is_compact_but_rejected():
+    assert is_compact(" #2abc")
+    assert not is_compact("10:00:00; 17.1,83.2")
+    assert not is_compact("#x")
+    with pytest.raises(PayloadError, match="version 2"):
+        decode_payload("#2abc")
@@ -0,0 +1,102 @@
+import random
+
+from gps_payload import decode_payload, encode_payload
+from sms_pdu import DeliveredSMS, SMSReassembler, decode_deliver_pdu, encode_deliver_pdus
+
+
+def part(number, text, reference=7, parts=2, timestamp="25/01/01,10:00:00"):
+    return DeliveredSMS("+919876543210", timestamp, text, reference, number, parts)
+
+
+def test_decode_published_vector():
+    # The SMS-DELIVER example from "SMS and the PDU format" (dreamfabric.com)
+    message = decode_deliver_pdu("07917283010010F5040BC87238880900F10000993092516195800AE8329BFD4697D9EC37")
+    assert message == DeliveredSMS("27838890001", "99/03/29,15:16:59", "hellohello", None, None, None)
+
+
+def test_encode_decode_round_trip():
+    assert decode_deliver_pdu(encode_deliver_pdus("+919876543210", "10:00:00; 17.1,83.2")[0]) == DeliveredSMS(
+        "+919876543210", "25/01/01,00:00:00", "10:00:00; 17.1,83.2", None, None, None
+    )
+
+    # Escape sequences on either side of a part boundary
+    text = "x" * 152 + "{[~]}" * 40
+    pdus = encode_deliver_pdus("+919876543210", text, reference=200, timestamp="25/06/30,23:59:59")
+    messages = [decode_deliver_pdu(pdu) for pdu in pdus]
+    assert len(messages) > 1
+    assert {(message.reference, message.parts) for message in messages} == {(200, len(pdus))}
+    assert [message.part for message in messages] == list(range(1, len(pdus) + 1))
+    assert all(message.timestamp == "25/06/30,23:59:59" for message in messages)
+    assert "".join(message.text for message in messages) == text
+
+
+def test_reassemble_shuffled_and_duplicated_parts():
+    fixes = [(17.7 + step / 1000, 83.2 + step / 1000, (36000 + step * 60) % 86400) for step in range(200)]
+    payload = encode_payload(fixes)
+    pdus = encode_deliver_pdus("+919876543210", payload, reference=42)
+    assert len(pdus) == 7
+
+    listed = list(enumerate(pdus, 1))
+    listed += listed[:3]
+    random.Random(0).shuffle(listed)
+    reassembler = SMSReassembler()
+    delivered = []
+    for index, pdu in listed:
+        result = reassembler.add(index, decode_deliver_pdu(pdu), now=0)
+        if result:
+            delivered.append(result)
+
+    assert len(delivered) == 1
+    indices, sender, text = delivered[0]
+    assert indices == list(range(1, 8))
+    assert sender == "+919876543210"
+    assert len(decode_payload(text)) == 200
+
+
+def test_delivered_part_listed_again_is_deleted_not_delivered():
+    reassembler = SMSReassembler()
+    reassembler.add(1, part(1, "a1"), now=0)
+    assert reassembler.add(2, part(2, "a2"), now=0) == ([1, 2], "+919876543210", "a1a2")
+    # Deleting index 1 failed, so the next drain lists it again
+    reassembler.deleted(2)
+    assert reassembler.add(1, part(1, "a1"), now=1) is None
+    assert reassembler.expire(now=1) == [1]
+    reassembler.deleted(1)
+    assert reassembler.completed == {}
+
+
+def test_incomplete_messages_are_evicted():
+    reassembler = SMSReassembler(timeout=60, max_messages=2)
+    for reference, now in ((1, 0), (2, 10), (3, 20)):
+        assert reassembler.add(reference, part(1, "p1", reference=reference), now=now) is None
+    # The oldest group made room for the newest
+    assert sorted(reassembler.pending) == [("+919876543210", 2, 2), ("+919876543210", 3, 2)]
+    assert reassembler.expire(now=20) == [1]
+    assert reassembler.expire(now=75) == [2]
+    assert reassembler.expire(now=75) == []
+    assert reassembler.add(13, part(2, "p2", reference=3), now=76) == ([3, 13], "+919876543210", "p1p2")
+
+
+def test_new_message_reusing_reference_and_indices():
+    reassembler = SMSReassembler()
+    reassembler.add(1, part(1, "a1"), now=0)
+    reassembler.add(2, part(2, "a2"), now=0)
+    reassembler.deleted(1)
+    reassembler.deleted(2)
+    # The SIM hands out the same indices and the reference has wrapped
+    reassembler.add(1, part(1, "b1", timestamp="25/01/01,10:05:00"), now=10)
+    assert reassembler.add(2, part(2, "b2", timestamp="25/01/01,10:05:00"), now=10) == (
+        [1, 2], "+919876543210", "b1b2"
+    )
+
+
+def test_new_message_at_an_index_whose_deletion_failed():
+    reassembler = SMSReassembler()
+    reassembler.add(1, part(1, "a1"), now=0)
+    reassembler.add(2, part(2, "a2"), now=0)
+    reassembler.deleted(2)
+    # Index 1 is still recorded as delivered, but holds a different part now
+    reassembler.add(2, part(1, "c1", timestamp="25/01/01,10:05:00"), now=10)
+    assert reassembler.add(1, part(2, "c2", timestamp="25/01/01,10:05:00"), now=10) == (
+        [2, 1], "+919876543210", "c1c2"
+    )
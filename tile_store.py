@@ -0,0 +1,528 @@
+"""
+Offline map tiles, kept in one MBTiles file.
+
+MBTiles is an SQLite database with a tiles table and a metadata table
+(https://github.com/mapbox/mbtiles-spec). Tiles are stored by zoom level,
+column and row, with the rows counted from the south (TMS); everything else
+in the project uses the XYZ tile numbering of the tile servers, counted from
+the north, and MBTilesStore converts between the two.
+
+Both front-ends read the same file without touching the network:
+tkintercode.py draws its TkinterMapView tabs straight from it through
+OfflineMapView, and gpsexcutable17.py points its folium maps at a TileServer
+on 127.0.0.1.
+
+Tile packs downloaded beforehand, as a {z}/{x}/{y}.png directory tree, a
+TkinterMapView OfflineLoader database or another MBTiles file, are merged
+into the store with:
+
+    python tile_store.py import tiles_pack/ --output offline_tiles.mbtiles
+    python tile_store.py info --output offline_tiles.mbtiles
+"""
+import argparse
+import math
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+TILE_DATABASE = "offline_tiles.mbtiles"
+# Local copies of the scripts and stylesheets a web map loads from a CDN,
+# such as leaflet.js, served by TileServer under /assets/
+MAP_ASSETS = "map_assets"
+TILE_CACHE_SIZE = 512  # tiles kept in memory; a decoded 256 px tile is 256 KB in Tk
+TILE_ATTRIBUTION = "&copy; OpenStreetMap contributors"
+TILE_EXTENSIONS = {".png": "png", ".jpg": "jpg", ".jpeg": "jpg", ".webp": "webp"}
+CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp"}
+ASSET_CONTENT_TYPES = {
+    ".js": "application/javascript", ".css": "text/css", ".png": "image/png", ".svg": "image/svg+xml",
+    ".woff": "font/woff", ".woff2": "font/woff2", ".ttf": "font/ttf",
+}
+
+CREATE_TILES = """
+    CREATE TABLE IF NOT EXISTS tiles (
+        zoom_level INTEGER NOT NULL,
+        tile_column INTEGER NOT NULL,
+        tile_row INTEGER NOT NULL,
+        tile_data BLOB NOT NULL
+    )
+"""
+
+CREATE_TILE_INDEX = """
+    CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)
+"""
+
+CREATE_METADATA = """
+    CREATE TABLE IF NOT EXISTS metadata (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    )
+"""
+
+SELECT_TILE = """
+    SELECT tile_data
+    FROM tiles
+    WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?
+"""
+
+INSERT_TILE = """
+    INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data)
+    VALUES (?, ?, ?, ?)
+"""
+
+
+def tile_to_lat_lon(x, y, zoom):
+    """
+    Convert the north-west corner of an XYZ tile to degrees.
+
+    Returns:
+        tuple: (lat, lon) of the corner.
+    """
+    n = 2 ** zoom
+    lon = x / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return lat, lon
+
+
+def sniff_format(data):
+    """
+    Returns:
+        str: "png", "jpg" or "webp" from the first bytes of a tile, or None.
+    """
+    if data.startswith(b"\x89PNG"):
+        return "png"
+    if data.startswith(b"\xff\xd8"):
+        return "jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+class TileCache:
+    """
+    Least-recently-used cache of tiles, safe to share between threads. The
+    tile server keeps encoded tiles in it and OfflineMapView decoded ones.
+    """
+
+    def __init__(self, max_items=TILE_CACHE_SIZE):
+        """
+        Args:
+            max_items (int): Number of tiles kept before the least recently used is dropped.
+        """
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns:
+            The cached value, or None if the key is not cached.
+        """
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+
+class MBTilesStore:
+    """
+    An MBTiles file. One connection is shared by every thread that reads
+    tiles, behind a lock; a tile is a single indexed lookup.
+    """
+
+    def __init__(self, path=TILE_DATABASE, create=False):
+        """
+        Args:
+            path (str): MBTiles file.
+            create (bool): Open for writing, creating the file if needed. Otherwise
+                the file is opened read-only and must exist.
+
+        Raises:
+            FileNotFoundError: If the file does not exist and create is False.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        if create:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute(CREATE_TILES)
+            self.connection.execute(CREATE_TILE_INDEX)
+            self.connection.execute(CREATE_METADATA)
+            self.connection.commit()
+        else:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"No tile database at {path}")
+            uri = pathlib.Path(path).resolve().as_uri() + "?mode=ro"
+            self.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.metadata = dict(self.connection.execute("SELECT name, value FROM metadata"))
+
+    @property
+    def format(self):
+        return self.metadata.get("format", "png")
+
+    @property
+    def min_zoom(self):
+        return int(self.metadata.get("minzoom", 0))
+
+    @property
+    def max_zoom(self):
+        return int(self.metadata.get("maxzoom", 19))
+
+    def get_tile(self, zoom, x, y):
+        """
+        Args:
+            zoom (int): Zoom level.
+            x (int): XYZ tile column.
+            y (int): XYZ tile row, counted from the north.
+
+        Returns:
+            bytes: The encoded tile, or None if the store does not have it.
+        """
+        with self.lock:
+            row = self.connection.execute(SELECT_TILE, (zoom, x, (1 << zoom) - 1 - y)).fetchone()
+        return row[0] if row else None
+
+    def put_tiles(self, tiles):
+        """
+        Write tiles in one transaction, replacing tiles already stored.
+
+        Args:
+            tiles (list): (zoom, x, y, data) tuples in XYZ numbering.
+        """
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(
+                    INSERT_TILE, ((zoom, x, (1 << zoom) - 1 - y, data) for zoom, x, y, data in tiles)
+                )
+
+    def set_metadata(self, values):
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                    ((name, str(value)) for name, value in values.items()),
+                )
+        self.metadata.update((name, str(value)) for name, value in values.items())
+
+    def update_metadata(self):
+        """
+        Recompute the zoom range, bounds and format from the stored tiles, after
+        an import.
+        """
+        with self.lock:
+            count, min_zoom, max_zoom = self.connection.execute(
+                "SELECT COUNT(*), MIN(zoom_level), MAX(zoom_level) FROM tiles"
+            ).fetchone()
+            if not count:
+                return
+            min_x, max_x, min_row, max_row = self.connection.execute(
+                "SELECT MIN(tile_column), MAX(tile_column), MIN(tile_row), MAX(tile_row) FROM tiles WHERE zoom_level = ?",
+                (min_zoom,),
+            ).fetchone()
+            sample = self.connection.execute("SELECT tile_data FROM tiles LIMIT 1").fetchone()[0]
+
+        last = (1 << min_zoom) - 1
+        north, west = tile_to_lat_lon(min_x, last - max_row, min_zoom)
+        south, east = tile_to_lat_lon(max_x + 1, last - min_row + 1, min_zoom)
+        values = {
+            "minzoom": min_zoom,
+            "maxzoom": max_zoom,
+            "bounds": f"{west:.6f},{south:.6f},{east:.6f},{north:.6f}",
+        }
+        tile_format = sniff_format(sample)
+        if tile_format:
+            values["format"] = tile_format
+        values.setdefault("name", self.metadata.get("name", os.path.splitext(os.path.basename(self.path))[0]))
+        self.set_metadata(values)
+
+    def tile_count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def open_tile_store(path=TILE_DATABASE):
+    """
+    Open the offline tiles, if they have been imported.
+
+    Returns:
+        MBTilesStore: The store, or None if there is no tile database at path.
+    """
+    try:
+        store = MBTilesStore(path)
+    except (FileNotFoundError, sqlite3.Error) as e:
+        print(f"Offline tiles not available, using the online tile server: {e}")
+        return None
+    print(f"Using offline tiles from {path}, zoom {store.min_zoom}-{store.max_zoom}")
+    return store
+
+
+def _read_directory(directory):
+    # Yields (zoom, x, y, data) for every {z}/{x}/{y}.<ext> file under directory
+    for zoom_name in os.listdir(directory):
+        zoom_path = os.path.join(directory, zoom_name)
+        if not zoom_name.isdigit() or not os.path.isdir(zoom_path):
+            continue
+        for x_name in os.listdir(zoom_path):
+            x_path = os.path.join(zoom_path, x_name)
+            if not x_name.isdigit() or not os.path.isdir(x_path):
+                continue
+            for file_name in os.listdir(x_path):
+                y_name, extension = os.path.splitext(file_name)
+                if not y_name.isdigit() or extension.lower() not in TILE_EXTENSIONS:
+                    continue
+                with open(os.path.join(x_path, file_name), "rb") as tile_file:
+                    yield int(zoom_name), int(x_name), int(y_name), tile_file.read()
+
+
+def _read_database(path, tile_server=None):
+    # Yields (zoom, x, y, data) from an MBTiles file or a TkinterMapView OfflineLoader database
+    connection = sqlite3.connect(path)
+    try:
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(tiles)")]
+        if "tile_data" in columns:
+            rows = connection.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles")
+            for zoom, x, row, data in rows:
+                yield zoom, x, (1 << zoom) - 1 - row, data
+        elif "tile_image" in columns:
+            if tile_server is None:
+                rows = connection.execute("SELECT zoom, x, y, tile_image FROM tiles")
+            else:
+                rows = connection.execute("SELECT zoom, x, y, tile_image FROM tiles WHERE server = ?", (tile_server,))
+            yield from rows
+        else:
+            raise ValueError(f"{path} is neither an MBTiles file nor a TkinterMapView tile database")
+    finally:
+        connection.close()
+
+
+def import_tiles(store, source, tile_server=None, batch_size=500):
+    """
+    Merge a tile pack into a store. Tiles already in the store are replaced.
+
+    Args:
+        store (MBTilesStore): Store opened with create=True.
+        source (str): A {z}/{x}/{y}.png directory tree, an MBTiles file or a
+            TkinterMapView OfflineLoader database.
+        tile_server (str): Only import this server's tiles from a TkinterMapView
+            database, which can hold several. Defaults to all of them.
+        batch_size (int): Tiles per transaction.
+
+    Returns:
+        int: Number of tiles imported.
+    """
+    if os.path.isdir(source):
+        tiles = _read_directory(source)
+    else:
+        tiles = _read_database(source, tile_server)
+
+    imported = 0
+    batch = []
+    for tile in tiles:
+        batch.append(tile)
+        if len(batch) >= batch_size:
+            store.put_tiles(batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        store.put_tiles(batch)
+        imported += len(batch)
+    store.update_metadata()
+    return imported
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    # Serves GET /{z}/{x}/{y}.<ext> and /assets/<name> from self.server.tile_server
+
+    def do_GET(self):
+        tile_server = self.server.tile_server
+        if self.path.startswith("/assets/"):
+            self.send_asset(tile_server, self.path[len("/assets/"):].split("?", 1)[0])
+            return
+        try:
+            zoom, x, y = (int(part) for part in os.path.splitext(self.path.split("?", 1)[0])[0].strip("/").split("/"))
+        except ValueError:
+            self.send_error(400, "Expected /{z}/{x}/{y}.png")
+            return
+
+        data = tile_server.get_tile(zoom, x, y)
+        if data is None:
+            self.send_error(404, "Tile not in the offline store")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES.get(tile_server.store.format, "application/octet-stream"))
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "max-age=86400")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_asset(self, tile_server, name):
+        # Only plain file names, nothing outside the assets directory
+        path = tile_server.asset_path(name)
+        if path is None:
+            self.send_error(404, "Asset not available offline")
+            return
+        with open(path, "rb") as asset_file:
+            data = asset_file.read()
+        self.send_response(200)
+        self.send_header("Content-Type", ASSET_CONTENT_TYPES.get(os.path.splitext(name)[1].lower(), "application/octet-stream"))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TileServer:
+    """
+    HTTP tile server on 127.0.0.1 for map front-ends that fetch tiles by URL,
+    such as the folium (Leaflet) maps of gpsexcutable17.py.
+
+        server = TileServer(open_tile_store()).start()
+        folium.Map(tiles=server.url_template, attr=server.attribution, max_zoom=server.store.max_zoom)
+
+    It also serves the files of an assets directory, so that the page can load
+    Leaflet itself from local copies; see asset_url().
+    """
+
+    def __init__(self, store, host="127.0.0.1", port=0, cache_size=TILE_CACHE_SIZE, assets_directory=MAP_ASSETS):
+        """
+        Args:
+            store (MBTilesStore): Tiles to serve.
+            host (str): Address to listen on. Keep it on the loopback interface.
+            port (int): Port to listen on; 0 picks a free one.
+            cache_size (int): Encoded tiles kept in memory.
+            assets_directory (str): Directory of local copies of web map assets.
+        """
+        self.store = store
+        self.assets_directory = assets_directory
+        self.cache = TileCache(cache_size)
+        self.httpd = ThreadingHTTPServer((host, port), TileRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.tile_server = self
+        self.host, self.port = self.httpd.server_address[:2]
+        self.thread = None
+        self.requests = 0
+
+    @property
+    def url_template(self):
+        return f"http://{self.host}:{self.port}/{{z}}/{{x}}/{{y}}.{self.store.format}"
+
+    @property
+    def attribution(self):
+        return self.store.metadata.get("attribution", TILE_ATTRIBUTION)
+
+    def asset_path(self, name):
+        """
+        Returns:
+            str: Path of the local copy of an asset, or None if there is none.
+        """
+        if not name or name != os.path.basename(name) or name.startswith("."):
+            return None
+        path = os.path.join(self.assets_directory, name)
+        return path if os.path.isfile(path) else None
+
+    def asset_url(self, url):
+        """
+        Map a CDN URL to the local copy of the same file, if one was saved in
+        the assets directory under its file name.
+
+        Returns:
+            str: The local URL, or url unchanged.
+        """
+        name = url.split("?", 1)[0].rsplit("/", 1)[-1]
+        if self.asset_path(name) is None:
+            return url
+        return f"http://{self.host}:{self.port}/assets/{name}"
+
+    def get_tile(self, zoom, x, y):
+        """
+        Returns:
+            bytes: The encoded tile, from memory if it was served recently, or None.
+        """
+        self.requests += 1
+        data = self.cache.get((zoom, x, y))
+        if data is None:
+            data = self.store.get_tile(zoom, x, y)
+            if data is not None:
+                self.cache.put((zoom, x, y), data)
+        return data
+
+    def start(self):
+        """
+        Start serving on a background thread.
+
+        Returns:
+            TileServer: The server itself.
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.httpd.serve_forever, name="tile-server", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread = None
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the offline map tiles.")
+    parser.add_argument("command", choices=("import", "info", "serve"))
+    parser.add_argument("sources", nargs="*", help="Tile packs to import: directories, .mbtiles or .db files")
+    parser.add_argument("--output", default=TILE_DATABASE, help="MBTiles file")
+    parser.add_argument("--tile-server", default=None, help="Server URL to import from a TkinterMapView database")
+    parser.add_argument("--port", type=int, default=8089, help="Port for serve")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        store = MBTilesStore(args.output, create=True)
+        for source in args.sources:
+            start = time.perf_counter()
+            imported = import_tiles(store, source, args.tile_server)
+            print(f"Imported {imported} tiles from {source} in {time.perf_counter() - start:.1f} s")
+        store.close()
+
+    store = MBTilesStore(args.output)
+    print(f"{args.output}: {store.tile_count()} tiles, zoom {store.min_zoom}-{store.max_zoom}, "
+          f"format {store.format}, bounds {store.metadata.get('bounds')}")
+    if args.command == "serve":
+        server = TileServer(store, port=args.port)
+        print(f"Serving {server.url_template}")
+        try:
+            server.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.httpd.server_close()
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
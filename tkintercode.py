@@ -1,11 +1,13 @@
 import tkinter as tk
 from ttkthemes import ThemedTk
-from tkintermapview import TkinterMapView
-import threading
 #from a import GPSDatabase,SerialCommunication
 from gps_database4 import GPSDatabase
-from serial_comm_handler5t import SerialCommunication
-import re
+from gps_journal import IngestJournal
+from gps_csv_export import CSVExportJob
+from map_layers import MarkerLayer, RouteLayer, TrackLayer
+from modem_pool import ModemPool
+from offline_map_view import OfflineMapView
+from tile_store import open_tile_store
 import tkinter.messagebox as tk_messagebox
 import geopy.distance
 import queue
@@ -14,8 +16,16 @@ import serial.tools.list_ports
 from tkinter import PhotoImage
 from PIL import Image, ImageTk
 from tkinter import filedialog, ttk, messagebox
-import csv
 import os
+import time
+
+
+# Most fixes written and drawn per process_queue tick. The rest wait for the
+# next tick, so the window keeps handling events during a burst of messages.
+MAX_FIXES_PER_TICK = 1000
+# Ticks a message that fails to save is retried for, about five seconds. After
+# that it is left in the journal, which replays it on the next start.
+MAX_SAVE_ATTEMPTS = 50
 
 
 class ToolTip:
@@ -72,20 +82,36 @@ class GPSMapApp:
         self.date_var = tk.StringVar()
         self.map_markers = {}
         self.polylines = {}
+        self.routes = {}
         self.time_labels = {}
         self.date_labels = {}
+        # Map tiles from the imported tile packs; None falls back to the online tile server
+        self.tile_store = open_tile_store()
 
         self.create_widgets()
         self.create_menu()
 
         self.db = GPSDatabase()
-        self.serial_comm = None
+        self.export_job = None
 
-        self.sms_queue = queue.Queue()
+        # Messages that were received but not saved before the last exit
+        self.journal = IngestJournal()
+        self.journal.replay(self.db)
 
+        self.sms_queue = queue.Queue()
+        # (message, attempts) pairs that failed to save, retried ahead of new messages
+        self.retry_messages = []
+        # Every connected modem feeds the same queue, through the journal
+        self.modem_pool = ModemPool(self.enqueue_locations, journal=self.journal)
+
+        # (phone_number_id, date) pairs already in the date menu, and the
+        # phone number IDs in the phone number menu
+        self.known_days = set()
+        self.menu_phone_ids = set()
         self.update_phone_number_menu()
 
         self.root.after(100, self.process_queue)
+        self.root.after(1000, self.update_modem_status)
 
 
     def add_logos(self):
@@ -167,6 +193,9 @@ class GPSMapApp:
      self.disconnect_button.pack(pady=5, anchor="w")
      ToolTip(self.disconnect_button, "Disconnect from the serial port")
 
+     self.modem_status_label = ttk.Label(self.com_port_frame, text="No modems connected", justify="left")
+     self.modem_status_label.pack(pady=5, anchor="w")
+
     # Tracking Options Frame
      self.tracking_frame = ttk.LabelFrame(self.com_tracking_frame, text="Tracking Options", padding="10")
      self.tracking_frame.pack(pady=5, fill="x")
@@ -261,63 +290,126 @@ class GPSMapApp:
         tk_messagebox.showinfo("Phone Numbers", phone_numbers_list)
 
     def process_queue(self):
+     # Retry what failed to save first, then take everything that arrived
+     # since the last tick, up to MAX_FIXES_PER_TICK
+     messages = self.retry_messages
+     self.retry_messages = []
+     fix_count = sum(len(message[1]) for message, _ in messages)
      try:
-        while True:
-            phone_number, time_value, lat, lon = self.sms_queue.get_nowait()
-            if lat is not None and lon is not None and (lat != 0.0 or lon != 0.0):
-                # Pass time_value to insert_coordinates
-                phone_number_id = self.db.insert_coordinates(phone_number, time_value, lat, lon)
-                self.update_map(phone_number_id, lat, lon)
-                self.update_phone_number_menu() 
-                self.update_date_menu() 
+        while fix_count < MAX_FIXES_PER_TICK:
+            message = self.sms_queue.get_nowait()
+            messages.append((message, 0))
+            fix_count += len(message[1])
      except queue.Empty:
         pass
-     self.root.after(100, self.process_queue)
+
+     if messages:
+        try:
+            self.apply_messages(messages)
+        except Exception as e:
+            # Keep the queue running; whatever was not saved is in retry_messages
+            print(f"Error applying {len(messages)} messages: {e}")
+     # Come back sooner while a burst is still queued
+     self.root.after(10 if fix_count >= MAX_FIXES_PER_TICK else 100, self.process_queue)
+
+    def apply_messages(self, messages):
+     date = time.strftime("%Y-%m-%d")
+     # One transaction for the whole tick
+     saved = self.save_messages([message for message, _ in messages], date)
+     if saved is None:
+        # One transaction per message, in order, to save the messages ahead of
+        # the one that fails. It and everything after it are retried next tick,
+        # still in order, until it has used up its attempts.
+        saved = []
+        for number, (message, attempts) in enumerate(messages):
+            message_saved = self.save_messages([message], date)
+            if message_saved is not None:
+                saved.extend(message_saved)
+                continue
+            if attempts + 1 < MAX_SAVE_ATTEMPTS:
+                self.retry_messages.append((message, attempts + 1))
+            else:
+                print(f"Giving up on the SMS from {message[0]} until the next start, which replays it from the journal")
+            self.retry_messages.extend(messages[number + 1:])
+            break
+
+     points = {}
+     for (_, _, lat, lon), phone_number_id in saved:
+        points.setdefault(phone_number_id, []).append((lat, lon))
+     for phone_number_id, vessel_points in points.items():
+        self.add_fixes(phone_number_id, vessel_points)
+
+     # The menus only change when a vessel or a day shows up for the first time
+     new_days = {(phone_number_id, date) for phone_number_id in points} - self.known_days
+     if new_days:
+        self.known_days |= new_days
+        if any(phone_number_id not in self.menu_phone_ids for phone_number_id, _ in new_days):
+            self.update_phone_number_menu()
+        else:
+            self.update_date_menu()
+     self.root.update_idletasks()
 
 
 
+    def save_messages(self, messages, date):
+     # Returns [(fix, phone_number_id), ...], or None if the transaction failed
+     fixes = [
+        (phone_number, time_value, lat, lon)
+        for phone_number, locations, _ in messages
+        for lat, lon, time_value in locations
+        if lat is not None and lon is not None and (lat != 0.0 or lon != 0.0)
+     ]
+     journal_seqs = [journal_seq for _, _, journal_seq in messages if journal_seq is not None]
+     try:
+        phone_number_ids = self.db.insert_coordinates_batch(fixes, date, journal_seqs=journal_seqs)
+     except Exception as e:
+        print(f"Error saving {len(fixes)} fixes: {e}")
+        return None
+     self.journal.applied(journal_seqs)
+     return list(zip(fixes, phone_number_ids))
+
     def download_database_csv(self):
+    # A second click while an export is running cancels it
+     if self.export_job and not self.export_job.done:
+        self.export_job.cancel()
+        return
+
     # Define the file path (saving on the Desktop)
      desktop_path = os.path.join(os.path.expanduser("~"), "Desktop/gps")
      csv_file_path = os.path.join(desktop_path, "gps_coordinates.csv")
 
-     try:
-        # Open the file for writing
-        with open(csv_file_path, mode='w', newline='') as csv_file:
-            writer = csv.writer(csv_file)
-            
-            # Write the header row
-            writer.writerow(["Phone Number", "Latitude", "Longitude", "Timestamp", "Date"])
-            
-            # Fetch the data from the database
-            self.db.cursor.execute("""
-                SELECT phone_numbers.phone_number, coordinates.latitude, coordinates.longitude, coordinates.timestamp, coordinates.date 
-                FROM coordinates
-                JOIN phone_numbers ON coordinates.phone_number_id = phone_numbers.id
-            """)
-            rows = self.db.cursor.fetchall()
-            
-            # Write each row of data to the CSV file
-            for row in rows:
-                writer.writerow(row)
-
-        messagebox.showinfo("Success", f"Database successfully exported to CSV at {csv_file_path}")
-     except Exception as e:
+    # Export on a background thread and poll its progress from the Tk loop
+     self.export_job = CSVExportJob(self.db, csv_file_path).start()
+     self.root.after(200, self.poll_export_job)
+
+    def poll_export_job(self):
+     job = self.export_job
+     if not job.done:
+        self.download_csv_button.config(text=f"Exporting... {job.percent()}% (click to cancel)")
+        self.root.after(200, self.poll_export_job)
+        return
+
+     self.download_csv_button.config(text="Download CSV")
+     if job.cancelled:
+        messagebox.showinfo("Cancelled", "CSV export was cancelled.")
+     elif job.error:
         # Show an error message box
-        messagebox.showerror("Error", f"Error exporting database to CSV: {e}")
+        messagebox.showerror("Error", f"Error exporting database to CSV: {job.error}")
+     else:
+        messagebox.showinfo("Success", f"Database successfully exported to CSV at {job.path}")
 
 
     def create_map_tab(self, phone_number_id):
         tab = ttk.Frame(self.tab_control)
-        map_widget = TkinterMapView(tab, width=800, height=500, borderwidth=2, relief="solid")
+        map_widget = OfflineMapView(tab, tile_store=self.tile_store, width=800, height=500, borderwidth=2, relief="solid")
         map_widget.pack(fill="both", expand=True)
         map_widget.set_position(0, 0)
         map_widget.set_zoom(2)
 
 
         self.tab_control.add(tab, text=f"ID: {phone_number_id}")
-        self.map_markers[phone_number_id] = []
-        self.polylines[phone_number_id] = None
+        self.map_markers[phone_number_id] = MarkerLayer(map_widget, text=f"ID: {phone_number_id}")
+        self.polylines[phone_number_id] = TrackLayer(map_widget)
        
 
         return map_widget
@@ -335,73 +427,66 @@ class GPSMapApp:
         return self.create_map_tab(phone_number_id)
 
     def update_map(self, phone_number_id, lat, lon):
+        self.add_fixes(phone_number_id, [(lat, lon)])
+        self.root.update_idletasks()
+
+    def add_fixes(self, phone_number_id, points):
+        # Draw several new fixes of one vessel with a single re-centre and polyline update
         map_widget = self.get_map_widget(phone_number_id)
 
         # Initialize data structures if they don't exist
         if phone_number_id not in self.map_markers:
-            self.map_markers[phone_number_id] = []
-            self.polylines[phone_number_id] = None
+            self.map_markers[phone_number_id] = MarkerLayer(map_widget, text=f"ID: {phone_number_id}")
+            self.polylines[phone_number_id] = TrackLayer(map_widget)
 
-        # Set the map position and zoom level
+        # Centre on the latest fix
+        lat, lon = points[-1]
         map_widget.set_position(lat, lon)
         map_widget.set_zoom(15)
 
-        # Add a marker to the map
-        marker = map_widget.set_marker(lat, lon, text=f"ID: {phone_number_id}")
-        self.map_markers[phone_number_id].append(marker)
+        # Only the markers in view are drawn, clustered when zoomed out
+        self.map_markers[phone_number_id].extend(points)
 
-        # Update the polyline
-        self.update_polyline(phone_number_id)
+        # Extend the track; only its last segment is redrawn
+        self.polylines[phone_number_id].extend(points)
 
         # Update the date label
         date = self.date_var.get()
         if phone_number_id in self.date_labels:
             self.date_labels[phone_number_id].config(text=f"Date: {date}")
 
-        self.root.update_idletasks()
-
-    def update_polyline(self, phone_number_id):
-        map_widget = self.get_map_widget(phone_number_id)
-
-        # Delete existing polyline if it exists
-        if self.polylines[phone_number_id]:
-            self.polylines[phone_number_id].delete()
-            self.polylines[phone_number_id] = None
-
-        # Create a list of (lat, lon) tuples from markers
-        lat_lon_list = [
-            (marker.position[0], marker.position[1]) for marker in self.map_markers[phone_number_id]
-        ]
-
-        # If there are at least two points, create a polyline
-        if len(lat_lon_list) >= 2:
-            self.polylines[phone_number_id] = map_widget.set_path(lat_lon_list)
-
     def clear_markers(self):
      phone_number_id = self.phone_number_var.get()
+     # Remove the route drawn by Show Route
+     if phone_number_id in self.routes:
+        self.routes[phone_number_id].clear()
      if phone_number_id in self.map_markers:
         map_widget = self.get_map_widget(phone_number_id)
 
         # Delete regular markers
-        for marker in self.map_markers[phone_number_id]:
-            marker.delete()
         self.map_markers[phone_number_id].clear()
 
-        # Delete polyline if it exists
-        if self.polylines[phone_number_id]:
-            self.polylines[phone_number_id].delete()
-            self.polylines[phone_number_id] = None
+        # Remove the track
+        self.polylines[phone_number_id].clear()
 
         # Reset the map view
         map_widget.set_position(0, 0)
         map_widget.set_zoom(2)
 
 
+    def get_track_positions(self, phone_number_id):
+        # The route drawn by Show Route if there is one, else the fixes received live
+        route = self.routes.get(phone_number_id)
+        if route and route.positions:
+            return route.positions
+        markers = self.map_markers.get(phone_number_id)
+        return markers.positions if markers else []
+
     def navigate_to_latest_marker(self):
         phone_number_id = self.phone_number_var.get()
-        if phone_number_id in self.map_markers and self.map_markers[phone_number_id]:
-            latest_marker = self.map_markers[phone_number_id][-1]
-            lat, lon = latest_marker.position  # Assuming 'position' is a tuple (lat, lon)
+        positions = self.get_track_positions(phone_number_id)
+        if positions:
+            lat, lon = positions[-1]
             map_widget = self.get_map_widget(phone_number_id)
             map_widget.set_position(lat, lon)
             map_widget.set_zoom(15)
@@ -410,18 +495,11 @@ class GPSMapApp:
 
     def calculate_distance(self):
      phone_number_id = self.phone_number_var.get()
-     if phone_number_id in self.map_markers and len(self.map_markers[phone_number_id]) >= 2:
+     positions = self.get_track_positions(phone_number_id)
+     if len(positions) >= 2:
         total_distance = 0.0
-        for i in range(len(self.map_markers[phone_number_id]) - 1):
-            coords_1 = (
-                self.map_markers[phone_number_id][i].position[0],
-                self.map_markers[phone_number_id][i].position[1],
-            )
-            coords_2 = (
-                self.map_markers[phone_number_id][i + 1].position[0],
-                self.map_markers[phone_number_id][i + 1].position[1],
-            )
-            total_distance += geopy.distance.distance(coords_1, coords_2).km
+        for i in range(len(positions) - 1):
+            total_distance += geopy.distance.distance(positions[i], positions[i + 1]).km
         
         tk_messagebox.showinfo(
             "Total Distance",
@@ -446,9 +524,12 @@ class GPSMapApp:
         # Fetch coordinates with timestamps
         coordinates = self.db.get_coordinates_for_id_and_date(phone_number_id, date)
         if coordinates:
-            for lat, lon, time_value in coordinates:
-                self.update_map(phone_number_id, lat, lon)
-                
+            # One path simplified to the zoom level, with markers only at the
+            # start, the end and the stops
+            if phone_number_id not in self.routes:
+                self.routes[phone_number_id] = RouteLayer(self.get_map_widget(phone_number_id))
+            self.routes[phone_number_id].show(coordinates)
+
             if phone_number_id in self.date_labels:
                 self.date_labels[phone_number_id].config(text=f"Date: {date}")
         else:
@@ -466,6 +547,7 @@ class GPSMapApp:
 
     def update_phone_number_menu(self):
         phone_numbers_with_ids = self.db.get_all_phone_numbers_with_ids()
+        self.menu_phone_ids = {phone_id for phone_id, _ in phone_numbers_with_ids}
         if phone_numbers_with_ids:
             self.phone_number_var.set(phone_numbers_with_ids[0][0])
         else:
@@ -517,24 +599,10 @@ class GPSMapApp:
     # Optionally log or display an update for debugging
      print(f"Updated date menu for phone_number_id {phone_number_id}: {dates}")
 
-    def wait_for_sms(self):
-     while True:
-        if self.serial_comm and self.serial_comm.serial_port.in_waiting > 0:
-            response = self.serial_comm.serial_port.read(
-                self.serial_comm.serial_port.in_waiting
-            ).decode("utf-8")
-            match = re.search(r'\+CMTI: "SM",(\d+)', response)
-            if match:
-                index = match.group(1)
-                phone_number, time_value, locations = self.serial_comm.read_sms(index)
-                
-                if phone_number and locations:
-                    # Iterate over the locations and enqueue each latitude and longitude
-                    for lat, lon in locations:
-                        self.sms_queue.put((phone_number, time_value, lat, lon))
-                    
-                    # After processing the SMS, delete all messages
-                    self.serial_comm.delete_all_sms()
+    def enqueue_locations(self, phone_number, locations, journal_seq):
+        # Called from the reader thread of whichever modem received the message,
+        # after it was written to the journal
+        self.sms_queue.put((phone_number, locations, journal_seq))
 
 
     def update_com_port_menu(self):
@@ -568,12 +636,11 @@ class GPSMapApp:
         com_port = self.com_port_var.get()
         if com_port and com_port != "No COM ports available":
             try:
-                self.serial_comm = SerialCommunication(com_port)
-                self.serial_comm.configure_for_sms()
-                threading.Thread(target=self.wait_for_sms, daemon=True).start()
-                self.connect_button.config(state="disabled")
+                # Each port gets its own reader; connect again to add more modems
+                self.modem_pool.add_port(com_port)
                 self.disconnect_button.config(state="normal")
-                tk_messagebox.showinfo("Connected", "Serial Connection is established.")
+                self.update_modem_status(reschedule=False)
+                tk_messagebox.showinfo("Connected", f"Serial Connection is established on {com_port}.")
             except Exception as e:
                 tk_messagebox.showerror(
                     "Error",
@@ -583,18 +650,33 @@ class GPSMapApp:
             tk_messagebox.showerror("Error", "No COM port selected or available.")
 
     def disconnect_serial(self):
-        if self.serial_comm:
-            try:
-                self.serial_comm.serial_port.close()
-                self.serial_comm = None
-                self.connect_button.config(state="normal")
+        com_port = self.com_port_var.get()
+        if com_port not in self.modem_pool.ports():
+            tk_messagebox.showerror("Error", f"{com_port} is not connected.")
+            return
+        try:
+            self.modem_pool.remove_port(com_port)
+            if not self.modem_pool.ports():
                 self.disconnect_button.config(state="disabled")
-                tk_messagebox.showinfo("Disconnected", "Serial connection closed.")
-            except Exception as e:
-                tk_messagebox.showerror(
-                    "Error",
-                    f"Failed to disconnect properly.\n\nError: {e}",
-                )
+            self.update_modem_status(reschedule=False)
+            tk_messagebox.showinfo("Disconnected", f"Serial connection on {com_port} closed.")
+        except Exception as e:
+            tk_messagebox.showerror(
+                "Error",
+                f"Failed to disconnect properly.\n\nError: {e}",
+            )
+
+    def update_modem_status(self, reschedule=True):
+        # One line per modem; a failed modem stays listed until it is disconnected
+        lines = []
+        for port, stats in self.modem_pool.stats().items():
+            if stats["healthy"]:
+                lines.append(f"{port}: {stats['messages']} SMS, {stats['fixes_per_minute']:.1f} fixes/min")
+            else:
+                lines.append(f"{port}: FAILED ({stats['last_error']})")
+        self.modem_status_label.config(text="\n".join(lines) or "No modems connected")
+        if reschedule:
+            self.root.after(1000, self.update_modem_status)
 
 
 if __name__ == "__main__":